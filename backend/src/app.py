@@ -1,10 +1,10 @@
 """Main FastAPI application file."""
 
 import logging
-import os
 
-from src.services.load_movies import load_movies_to_es
-from src.utils.preprocess import preprocess_data
+from src.services.ingest import start_ingest
+from src.services.load_movies import with_index_sort
+from src.services.vectorize import vector_dims
 from src.utils.config import config
 from src.utils import logconfig
 from src.utils.loadintodb import load_data_into_db
@@ -55,6 +55,7 @@ mapping = {
                 },
             },
             "vote_average": {"type": "float"},
+            "popularity": {"type": "float"},
             "vote_count": {"type": "integer"},
             "status": {"type": "keyword"},
             "release_date": {"type": "date"},
@@ -72,32 +73,32 @@ mapping = {
             "imdb_rating": {"type": "float"},
             "imdb_votes": {"type": "integer"},
             "plot_synopsis": {"type": "text", "analyzer": "english"},
-            "feedback": {"type": "integer", "null_value": 0},
+            "plot_vector": {
+                "type": "dense_vector",
+                # The dimension of the fitted model, which may differ from LSA_DIMS
+                "dims": vector_dims(),
+                "index": True,
+                "similarity": "cosine",
+            },
+            "feedback_score": {"type": "float", "null_value": 0},
         }
     },
 }
 
+# Sorted by popularity, the searches sorted the same way stop early
+if config["ES_INDEX_SORT"] == "1":
+    mapping = with_index_sort(mapping, "popularity")
+
 
 def __init__() -> None:
-    """Initialize the server."""
+    """Initialize the server.
+
+    The dataset is preprocessed and loaded in the background, the API serves the
+    current index meanwhile. The progress is reported at `/es/ingest`.
+    """
 
     try:
-        # Path for dataset and cleaned dataset
-        dataset_path = config["DATA_PATH"]
-        cleaned_dataset_path = config["CLEANED_DATA_PATH"]
-
-        # Check if preprocessing is required
-        if not os.path.exists(cleaned_dataset_path) or (
-            os.path.exists(dataset_path)
-            and os.path.getmtime(dataset_path) > os.path.getmtime(cleaned_dataset_path)
-        ):
-            log.info("Preprocessing the dataset...")
-            preprocess_data(dataset_path, cleaned_dataset_path, -1)
-
-        # Load the cleaned dataset to Elasticsearch
-        log.info("Loading the dataset to Elasticsearch...")
-        load_movies_to_es(cleaned_dataset_path, "movies", mapping=mapping)
-        log.info("Dataset loaded successfully!")
+        start_ingest(mapping, "movies")
 
         # Load the dataset into MongoDB
         # log.info("Loading the dataset into MongoDB if needed...")
@@ -1,4 +1,10 @@
-from ..services.elastic import es
+from typing import Dict, List
+
+from ..models.movies import MovieSearchRequest
+from ..services.elastic import client_for
+from ..services.elastic_backend import ElasticsearchBackend, build_search_body
+from ..services.ingest import read_status
+from ..services.search_backend import get_search_backend
 
 
 def RC_get_status(index_name: str = "movies") -> dict:
@@ -12,6 +18,8 @@ def RC_get_status(index_name: str = "movies") -> dict:
     """
 
     try:
+        es = client_for("admin")
+
         # Check if the index exists
         if not es.indices.exists(index=index_name):
             return {"error": f"Index '{index_name}' does not exist."}
@@ -29,3 +37,123 @@ def RC_get_status(index_name: str = "movies") -> dict:
 
     except Exception as e:
         return {"error": str(e)}
+
+
+def RC_get_readiness(index_name: str = "movies") -> dict:
+    """Check whether the search backend can serve the index.
+
+    Args:
+        index_name (str): Name of the index.
+
+    Returns:
+        dict: Readiness, the generation of the index and the ingest status.
+    """
+
+    try:
+        generation = get_search_backend().get_generation(index_name)
+        return {"ready": True, "generation": generation, "ingest": read_status()}
+    except Exception as e:
+        return {"ready": False, "reason": str(e), "ingest": read_status()}
+
+
+def RC_get_ingest_status() -> dict:
+    """Get the status of the background ingest.
+
+    Returns:
+        dict: Ingest state and progress.
+    """
+
+    return read_status()
+
+
+def _flatten_profile(
+    node: dict, phase: str, depth: int, clauses: Dict[tuple, dict]
+) -> None:
+    """Add the time of a profiled query and its children to the clauses."""
+
+    key = (phase, depth, node["type"], node["description"])
+    clause = clauses.setdefault(
+        key,
+        {
+            "phase": phase,
+            "depth": depth,
+            "type": node["type"],
+            "description": node["description"],
+        },
+    )
+    clause["time_ms"] = clause.get("time_ms", 0) + node["time_in_nanos"] / 1e6
+
+    for child in node.get("children", []):
+        _flatten_profile(child, phase, depth + 1, clauses)
+
+
+def RC_profile_search(
+    search_query: MovieSearchRequest, index_name: str = "movies", explain: bool = False
+) -> dict:
+    """Profile the search body built for a search request.
+
+    The search runs on the index which serves the request, the companion index sorted
+    on its sort field if any. The hybrid searches are profiled on their lexical query.
+
+    Args:
+        search_query (MovieSearchRequest): Search query.
+        index_name (str): Name of the Elasticsearch index.
+        explain (bool): Whether to explain the score of the hits.
+
+    Returns:
+        dict: Searched index, search body, time of each query clause summed over the
+            shards (slowest first) in the query and the rescore phases, raw profile and
+            explanation of the hits.
+    """
+
+    if search_query.size is None:
+        search_query.size = 10
+    if search_query.page is None:
+        search_query.page = 1
+
+    try:
+        body = build_search_body(search_query)
+
+        backend = get_search_backend()
+        if isinstance(backend, ElasticsearchBackend):
+            index_name = backend._index_for(search_query, index_name)
+
+        response = client_for("admin").search(
+            index=index_name, body={**body, "profile": True, "explain": explain}
+        )
+
+        # The query of the first phase is the first profiled tree, those of the
+        # rescore phase follow it
+        clauses: Dict[tuple, dict] = {}
+        for shard in response["profile"]["shards"]:
+            for search in shard["searches"]:
+                for position, query in enumerate(search["query"]):
+                    phase = "query" if position == 0 else "rescore"
+                    _flatten_profile(query, phase, 0, clauses)
+
+        result = {
+            "index": index_name,
+            "body": body,
+            "took": response["took"],
+            "total": response["hits"]["total"]["value"],
+            "clauses": sorted(
+                clauses.values(), key=lambda clause: clause["time_ms"], reverse=True
+            ),
+            "profile": response["profile"],
+        }
+
+        if explain:
+            result["explanations"] = [
+                {
+                    "id": hit["_source"].get("id"),
+                    "title": hit["_source"].get("title"),
+                    "score": hit["_score"],
+                    "explanation": hit.get("_explanation"),
+                }
+                for hit in response["hits"]["hits"]
+            ]
+
+        return result
+
+    except Exception as e:
+        return {"error": str(e)}
@@ -1,8 +1,19 @@
 from typing import Dict
 import logging
 
-from ..services.elastic import es
+from elasticsearch import NotFoundError
+
+from ..services.elastic import client_for
+from ..services.feedback_log import (
+    append_reset,
+    append_vote,
+    get_reset_task,
+    set_reset_task,
+)
+from ..services.load_movies import SORTED_COPIES, sorted_copy_name
+from ..services.search_backend import get_search_backend
 from ..models.movies import MovieSearchRequest
+from ..utils.config import config
 
 log = logging.getLogger(name="MovieApp")
 
@@ -28,24 +39,9 @@ def RC_feedback(movie_id: str, score: int, index_name: str = "movies") -> Dict:
     score_adjusted: int = score - 3
 
     try:
-        # Update script which checks if the feedback field exists and adds the score to it.
-        # If the field does not exist, it creates the field and assigns the score to it.
-        update_script = {
-            "script": {
-                "source": """
-                    if (ctx._source.feedback == null) {
-                        ctx._source.feedback = params.adjustment
-                    } else {
-                        ctx._source.feedback += params.adjustment
-                    }
-                """,
-                "params": {"adjustment": score_adjusted},
-            },
-            "query": {"term": {"id": movie_id}},
-        }
-
-        # Apply the update script to the movie document.
-        es.update_by_query(index=index_name, body=update_script)
+        # The vote is only recorded here, the feedback score of the movie is
+        # recomputed from the event log by the feedback materializer.
+        append_vote(movie_id, score_adjusted)
 
         return {"status": "success"}
     except Exception as e:
@@ -56,6 +52,8 @@ def RC_reset_feedback(movie_id: str, index_name: str = "movies") -> Dict:
     """
     This function is used to reset the feedback score for a specific movie.
 
+    Only the document of the given movie is updated.
+
     Args:
     movie_id (str): The id of the movie to reset the feedback score for.
     index_name (str): The name of the index to reset the feedback score for.
@@ -65,61 +63,139 @@ def RC_reset_feedback(movie_id: str, index_name: str = "movies") -> Dict:
     """
 
     try:
-        total_slices = 100
-
-        for slice_id in range(total_slices):
-            update_script = {
-                "script": {
-                    "source": "ctx._source.feedback = 0",
-                },
-                "query": {
-                    "bool": {
-                        "must_not": {"term": {"feedback": 0}},
-                    }
-                },
-                "slice": {
-                    "id": slice_id,
-                    "max": total_slices,
-                },
-            }
+        backend = get_search_backend()
 
-            es.update_by_query(
-                index=index_name,
-                body=update_script,
-                conflicts="proceed",
-                wait_for_completion=False,
-            )
+        # Checked first, the reset of an unknown movie would stay in the event log
+        if not backend.get_movie_version(movie_id, index_name):
+            return {"status": "error", "error": f"Movie '{movie_id}' not found."}
 
-            log.info(f"Resetting feedback for slice {slice_id}.")
+        append_reset(movie_id)
+
+        # The score is reset at once, the materializer would only reset it later.
+        if not backend.update_feedback_scores(index_name, {movie_id: 0}):
+            return {
+                "status": "error",
+                "error": f"Feedback score of movie '{movie_id}' not updated.",
+            }
 
         return {"status": "success"}
     except Exception as e:
         return {"status": "error", "error": str(e)}
 
 
+def _is_running(es, task_id: str) -> bool:
+    # The task is forgotten if its result was removed from the cluster
+    try:
+        return not es.tasks.get(task_id=task_id)["completed"]
+    except NotFoundError:
+        return False
+
+
 def RC_reset_all_feedback(index_name: str = "movies") -> Dict:
     """
     This function is used to reset all feedback scores for all movies.
 
+    The reset runs as a single background `update_by_query` task, over the index and
+    its sorted companion indices. While it is running, further calls return the id of
+    the running task instead of starting another one. The id is kept in the feedback
+    database, shared by the worker processes. With the local backend, the indices of
+    the workers are reset by their feedback materializer, without a task.
+
     Args:
     index_name (str): The name of the index to reset the feedback scores for.
 
     Returns:
-    Dict: A dictionary containing the status of the feedback reset operation.
+    Dict: A dictionary containing the status and the id of the reset task.
     """
 
     try:
-        # Update script which resets the feedback field to 0.
+        if config["SEARCH_BACKEND"] == "local":
+            append_reset()
+            return {"status": "success"}
+
+        es = client_for("update")
+        task_id = get_reset_task(index_name)
+
+        if task_id and _is_running(es, task_id):
+            return {"status": "running", "task_id": task_id}
+
+        append_reset()
+
+        # Update script which resets the feedback score to 0.
         update_script = {
             "script": {
-                "source": "ctx._source.feedback = 0",
+                "source": "ctx._source.feedback_score = 0",
+            },
+            "query": {
+                "bool": {
+                    "must_not": {"term": {"feedback_score": 0}},
+                }
             },
-            "query": {"match_all": {}},
         }
 
-        # Apply the update script to all movie documents.
-        es.update_by_query(index=index_name, body=update_script)
+        # The sorted companion indices hold copies of the scores, the missing ones
+        # are skipped
+        indices = [index_name] + [
+            sorted_copy_name(index_name, field) for field in SORTED_COPIES
+        ]
+
+        # Let Elasticsearch parallelize the task over the shards, under one parent task.
+        response = es.update_by_query(
+            index=",".join(indices),
+            body=update_script,
+            ignore_unavailable=True,
+            conflicts="proceed",
+            slices="auto",
+            refresh=True,
+            wait_for_completion=False,
+        )
+
+        task_id = response["task"]
+        set_reset_task(index_name, task_id)
+        log.info(f"Resetting all feedback in task {task_id}.")
+
+        return {"status": "started", "task_id": task_id}
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
 
-        return {"status": "success"}
+
+def RC_get_reset_task(task_id: str) -> Dict:
+    """
+    This function is used to get the progress of a feedback reset task.
+
+    Args:
+    task_id (str): The id of the task returned when starting the reset.
+
+    Returns:
+    Dict: A dictionary containing the completion and progress of the task.
+    """
+
+    if config["SEARCH_BACKEND"] == "local":
+        return {"status": "error", "error": "The local backend runs no reset tasks."}
+
+    try:
+        response = client_for("admin").tasks.get(task_id=task_id)
+        status = response["task"]["status"]
+
+        total = status.get("total", 0)
+        processed = sum(
+            status.get(key, 0)
+            for key in ["updated", "created", "deleted", "noops", "version_conflicts"]
+        )
+
+        if total:
+            progress = processed / total
+        else:
+            progress = 1.0 if response["completed"] else 0.0
+
+        return {
+            "task_id": task_id,
+            "completed": response["completed"],
+            "progress": progress,
+            "total": total,
+            "updated": status.get("updated", 0),
+            "version_conflicts": status.get("version_conflicts", 0),
+            "failures": response.get("response", {}).get("failures", []),
+        }
     except Exception as e:
         return {"status": "error", "error": str(e)}
@@ -1,134 +1,21 @@
+from itertools import chain
 from typing import Dict
 import logging
+import time
 
-from ..services.elastic import es
+from ..services import query_log
+from ..services.search_backend import get_search_backend
 from ..models.movies import MovieSearchRequest
+from ..utils import metrics
 
 
 log = logging.getLogger(name="MovieApp")
 
 
-def build_query(search_query: MovieSearchRequest) -> Dict:
-    """Build Elasticsearch query from search query.
-
-    Args:
-        search_query (MovieSearchRequest): Search query.
-
-    Returns:
-        Dict: Elasticsearch query.
-    """
-
-    # Base query
-    query: Dict = {
-        "bool": {
-            "must": [],
-            "filter": [],
-            "should": [],
-        }
-    }
-
-    # Add full-text search if query exists
-    if search_query.query:
-        # Title Field
-        query["bool"]["should"].append(
-            {
-                "match": {
-                    "title": {
-                        "query": "{}".format(search_query.query),
-                        "fuzziness": "AUTO",
-                        "operator": "and",
-                        "boost": 5,
-                    }
-                }
-            },
-        )
-
-        query["bool"]["should"].append(
-            {
-                "match_phrase": {
-                    "title": {
-                        "query": "{}".format(search_query.query),
-                        "boost": 10,
-                        "slop": 2,
-                    }
-                }
-            },
-        )
-
-        # Plot_synopsis Field
-        query["bool"]["should"].append(
-            {
-                "match": {
-                    "plot_synopsis": {
-                        "query": "{}".format(search_query.query),
-                        "operator": "and",
-                        "fuzziness": "AUTO",
-                        "boost": 1,
-                    }
-                },
-            },
-        )
-
-        query["bool"]["should"].append(
-            {
-                "match_phrase": {
-                    "plot_synopsis": {
-                        "query": "{}".format(search_query.query),
-                        "boost": 2,
-                        "slop": 2,
-                    }
-                },
-            }
-        )
-        query["bool"]["minimum_should_match"] = 1
-
-    # Add filters
-    if search_query.genres:
-        query["bool"]["filter"].append({"terms": {"genres": search_query.genres}})
-
-    if search_query.cast:
-        query["bool"]["filter"].append({"terms": {"cast": search_query.cast}})
-
-    if search_query.director:
-        query["bool"]["filter"].append(
-            {
-                "wildcard": {
-                    "director": f"*{search_query.director}*",
-                }
-            }
-        )
-
-    if search_query.from_year:
-        query["bool"]["filter"].append(
-            {
-                "range": {
-                    "release_date": {
-                        "gte": f"{search_query.from_year}-01-01",
-                        "format": "yyyy-MM-dd",
-                    }
-                }
-            }
-        )
-
-    if search_query.to_year:
-        query["bool"]["filter"].append(
-            {
-                "range": {
-                    "release_date": {
-                        "lte": f"{search_query.to_year}-12-31",
-                        "format": "yyyy-MM-dd",
-                    }
-                }
-            }
-        )
-
-    return query
-
-
 def RC_search_movie(
     search_query: MovieSearchRequest, index_name: str = "movies"
 ) -> dict:
-    """Search movies with given filters/sort in Elasticsearch.
+    """Search movies with given filters/sort with the configured search backend.
 
     The search query can include the following parameters:
     - query: Search text for the movie (e.g., title, plot).
@@ -143,186 +30,194 @@ def RC_search_movie(
 
     Args:
         search_query (MovieSearchRequest): Search query.
-        index_name (str): Name of the Elasticsearch index.
+        index_name (str): Name of the index.
 
     Returns:
         dict: Search results.
     """
 
-    log.info(f"Searching movies with query: {search_query.dict()}")
+    # Routing and request validation happen before the controller is called, the wait
+    # for admission meanwhile is its own stage
+    metrics.record_since_start("parse", exclude=("queue",))
 
     if search_query.size is None:
         search_query.size = 10
     if search_query.page is None:
         search_query.page = 1
 
-    print(search_query.dict())
+    started = time.perf_counter()
 
     try:
-        # Build the query
-        base_query = build_query(search_query)
-
-        # Sorting
-        sort_field = (
-            search_query.sort_by
-            if search_query.sort_by in ["popularity", "release_date"]
-            else None
+        response = get_search_backend().search(search_query, index_name)
+    except Exception as e:
+        log.warning("Search failed for query %r: %s", search_query.query, e)
+        query_log.record_search(
+            search_query, (time.perf_counter() - started) * 1000, error=True
         )
-        order = search_query.order if search_query.order in ["asc", "desc"] else "desc"
-
-        # Search request body
-        query = {
-            "function_score": {
-                "query": base_query,
-                "functions": [
-                    {
-                        "script_score": {
-                            "script": {
-                                "source": """
-                                if (doc['feedback'].empty) {
-                                    return 1;
-                                }
-
-                                double feedback = doc['feedback'].value;
-                                double result = 0.2 * Math.log(Math.abs(feedback) + 1);
-                                if (feedback < 0) {
-                                    result = -result;
-                                }
-
-                                return 1 + result;
-                                """
-                            }
-                        }
-                    }
-                ],
-                "boost_mode": "multiply",
-                "max_boost": 2,
-                "score_mode": "sum",
+        return {"error": str(e)}
+
+    # A single summary record per search, formatted lazily by the log listener
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    log.info(
+        "Search query=%r page=%d size=%d total=%d hits=%d elapsed_ms=%.1f",
+        search_query.query,
+        search_query.page,
+        search_query.size,
+        response["total"],
+        len(response["results"]),
+        elapsed_ms,
+        extra={
+            "search": {
+                "query": search_query.query,
+                "genres": search_query.genres,
+                "cast": search_query.cast,
+                "director": search_query.director,
+                "from_year": search_query.from_year,
+                "to_year": search_query.to_year,
+                "sort_by": search_query.sort_by,
+                "mode": search_query.mode,
+                "page": search_query.page,
+                "size": search_query.size,
+                "total": response["total"],
+                "elapsed_ms": elapsed_ms,
             }
-        }
-
-        body = {
-            "query": query,
-            "from": (search_query.page - 1) * search_query.size,
-            "size": search_query.size,
-        }
-
-        if sort_field:
-            body["sort"] = [{sort_field: {"order": order}}]
-
-        # Execute the search
-        response = es.search(index=index_name, body=body)
-        hits = response["hits"]["hits"]
-
-        # Extract the results
-        results = [hit["_source"] for hit in hits]
-
-        # Log the score
-        for hit in hits:
-            log.info(
-                f"Movie: {hit['_source']['title']}, Score: {hit['_score']}, Feedback: {hit['_source'].get('feedback', 0)}"
-            )
-
-        return {
-            "total": response["hits"]["total"]["value"],
-            "results": results,
-            "page": search_query.page or 1,
-            "size": search_query.size or 10,
-        }
+        },
+    )
+    query_log.record_search(search_query, elapsed_ms, response["total"])
+
+    return response
+
+
+def RC_stream_search(
+    search_query: MovieSearchRequest, index_name: str = "movies"
+) -> dict:
+    """Search movies, returning the documents of the page lazily.
+
+    Args:
+        search_query (MovieSearchRequest): Search query.
+        index_name (str): Name of the index.
+
+    Returns:
+        dict: Total number of results and an iterator over the documents.
+    """
+
+    if search_query.size is None:
+        search_query.size = 10
+    if search_query.page is None:
+        search_query.page = 1
+
+    try:
+        total, documents = get_search_backend().stream_search(search_query, index_name)
+    except Exception as e:
+        log.warning("Search failed for query %r: %s", search_query.query, e)
+        return {"error": str(e)}
+
+    return {"total": total, "documents": documents}
+
+
+def RC_export_movies(
+    search_query: MovieSearchRequest, index_name: str = "movies"
+) -> dict:
+    """Export all the movies matching the search, read in batches.
+
+    Args:
+        search_query (MovieSearchRequest): Search query, its page and sort are ignored.
+        index_name (str): Name of the index.
+
+    Returns:
+        dict: Iterator over the documents.
+    """
+
+    try:
+        documents = get_search_backend().export(search_query, index_name)
+
+        # Read the first document now, so that a failing request is reported
+        first = next(documents, None)
+    except Exception as e:
+        log.warning("Export failed for query %r: %s", search_query.query, e)
+        return {"error": str(e)}
+
+    return {"documents": chain([first], documents) if first is not None else iter(())}
+
+
+def RC_get_generation(index_name: str) -> dict:
+    """Get the generation of the index, which changes when it is rebuilt.
+
+    Args:
+        index_name (str): Name of the index.
+
+    Returns:
+        dict: Generation of the index.
+    """
+
+    try:
+        return {"generation": get_search_backend().get_generation(index_name)}
     except Exception as e:
         return {"error": str(e)}
 
 
 def RC_search_movie_id(id: str, index_name: str) -> dict:
-    """Search movie with a specific ID in Elasticsearch.
+    """Search movie with a specific ID.
 
     Args:
         id (str): Movie ID.
-        index_name (str): Name of the Elasticsearch index.
+        index_name (str): Name of the index.
 
     Returns:
         dict: Search results.
     """
 
-    body = {"query": {"match": {"id": id}}}
-
     try:
-        response = es.search(index=index_name, body=body)
-        hits = response["hits"]["hits"]
+        return get_search_backend().get_movie(id, index_name)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def RC_get_movie_version(id: str, index_name: str) -> dict:
+    """Get the version of the movie with a specific ID, without its details.
+
+    Args:
+        id (str): Movie ID.
+        index_name (str): Name of the index.
 
-        # Extract the results
-        results = [hit["_source"] for hit in hits]
+    Returns:
+        dict: Version of the movie.
+    """
 
-        return {"results": results}
+    try:
+        return {"version": get_search_backend().get_movie_version(id, index_name)}
     except Exception as e:
         return {"error": str(e)}
 
 
 def RC_get_all_genres(index_name: str) -> dict:
-    """Get all genres from Elasticsearch.
+    """Get all genres.
 
     Args:
-        index_name (str): Name of the Elasticsearch index.
+        index_name (str): Name of the index.
 
     Returns:
         dict: Search results.
     """
 
-    body = {
-        "size": 0,
-        "aggs": {
-            "genres": {
-                "terms": {
-                    "field": "genres",
-                    "size": 1000,
-                }
-            }
-        },
-    }
-
     try:
-        response = es.search(index=index_name, body=body)
-        genres = response["aggregations"]["genres"]["buckets"]
-
-        return {"genres": [genre["key"] for genre in genres]}
+        return get_search_backend().get_genres(index_name)
     except Exception as e:
         return {"error": str(e)}
 
 
 def RC_get_suggestions(index_name: str, query: str) -> dict:
-    """Get suggestions from Elasticsearch.
+    """Get title suggestions.
 
     Args:
-        index_name (str): Name of the Elasticsearch index.
+        index_name (str): Name of the index.
         query (str): Search query.
 
     Returns:
         dict: Search results.
     """
 
-    # Search for unique suggestions
-
-    body = {
-        "suggest": {
-            "movie-suggest": {
-                "prefix": query,
-                "completion": {
-                    "field": "title.suggest",
-                    "size": 10,
-                    "skip_duplicates": True,
-                },
-            }
-        },
-    }
-
     try:
-        response = es.search(index=index_name, body=body)
-        suggestions = response["suggest"]["movie-suggest"][0]["options"]
-
-        return {
-            "suggestions": [
-                suggestion["_source"]["title"] for suggestion in suggestions
-            ]
-        }
+        return get_search_backend().get_suggestions(index_name, query)
     except Exception as e:
         return {"error": str(e)}
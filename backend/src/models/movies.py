@@ -1,6 +1,9 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional, Annotated
 
+# Largest rescore window accepted by Elasticsearch, its `index.max_rescore_window`
+MAX_RESCORE_WINDOW = 10000
+
 
 class MovieSearchRequest(BaseModel):
     """Request model for movie search."""
@@ -17,5 +20,15 @@ class MovieSearchRequest(BaseModel):
     order: Optional[str] = Field(
         "desc", description="Order of sorting: 'asc' or 'desc'."
     )
-    page: Optional[int] = Field(1, description="Page number for pagination.")
-    size: Optional[int] = Field(10, description="Number of results per page.")
+    mode: Optional[str] = Field(
+        "lexical", description="Retrieval mode: 'lexical' or 'hybrid'."
+    )
+    rescore_window: Optional[int] = Field(
+        None,
+        ge=0,
+        le=MAX_RESCORE_WINDOW,
+        description="Candidates rescored in the two-phase search, 0 to disable it. "
+        "Defaults to the server configuration.",
+    )
+    page: Optional[int] = Field(1, ge=1, description="Page number for pagination.")
+    size: Optional[int] = Field(10, ge=1, description="Number of results per page.")
@@ -1,7 +1,10 @@
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 
 from ..controllers.es import *
+from ..models.movies import MovieSearchRequest
 
 es_router = APIRouter()
 
@@ -22,3 +25,55 @@ async def RG_get_status(index_name: str = "movies"):
         raise HTTPException(status_code=400, detail=response["error"])
 
     return response
+
+
+@es_router.get("/ready", tags=["Index Management"])
+async def RG_get_readiness(index_name: str = "movies"):
+    """Check whether the API can serve searches, for readiness probes.
+
+    Args:
+        index_name (str): Name of the index.
+
+    Returns:
+        dict: Readiness and ingest status, with a 503 status code when not ready.
+    """
+    response: dict = await run_in_threadpool(RC_get_readiness, index_name)
+
+    if not response["ready"]:
+        return JSONResponse(response, status_code=503)
+
+    return response
+
+
+@es_router.get("/ingest", tags=["Index Management"])
+async def RG_get_ingest_status():
+    """Get the progress of the background ingest.
+
+    Returns:
+        dict: Ingest state and progress.
+    """
+    return RC_get_ingest_status()
+
+
+@es_router.post("/profile", tags=["Diagnostics"])
+async def RP_profile_search(
+    request: MovieSearchRequest, index_name: str = "movies", explain: bool = False
+):
+    """Profile the Elasticsearch query of a search request.
+
+    Args:
+        request (MovieSearchRequest): Search request.
+        index_name (str): Name of the index.
+        explain (bool): Whether to explain the score of the hits.
+
+    Returns:
+        dict: Searched index, search body, profile of each clause and explanations.
+    """
+    response: dict = await run_in_threadpool(
+        RC_profile_search, request, index_name, explain
+    )
+
+    if "error" in response:
+        raise HTTPException(status_code=400, detail=response["error"])
+
+    return response
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..utils import metrics
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def RG_get_metrics():
+    """Get the metrics of the API, in the Prometheus text format.
+
+    The metrics are kept by each worker process and are not aggregated: with several
+    workers, a scrape reports only the worker which answers it.
+
+    Returns:
+        str: Metrics of this worker.
+    """
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -3,20 +3,35 @@
 Function names prefixed with:
     - `RX_` are for request handlers. Where X is the HTTP method (G, P, D, U).
     - `RC_` are for controller handlers.
+
+The controllers block on the search backend, they run in the threadpool. The requests
+are admitted by the limiter of their endpoint, see `utils/admission.py`.
 """
 
 from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from elasticsearch import Elasticsearch
 
 from ..controllers.movies import *
 from ..controllers.feedback import *
 from ..models.movies import MovieSearchRequest
-
-movie_router = APIRouter()
-
-
-@movie_router.get("/search")
+from ..utils import metrics
+from ..utils.admission import Admission, admit
+from ..utils.config import config
+from ..utils.http_cache import (
+    cache_headers,
+    digest,
+    is_not_modified,
+    make_etag,
+    not_modified,
+)
+from ..utils.responses import NDJSONResponse, ORJSONResponse
+
+movie_router = APIRouter(default_response_class=ORJSONResponse)
+
+
+@movie_router.get("/search", dependencies=[Depends(admit("search"))])
 async def RG_search_movie(request: Annotated[MovieSearchRequest, Query()]):
     """Search movie plot in Elasticsearch.
 
@@ -26,15 +41,15 @@ async def RG_search_movie(request: Annotated[MovieSearchRequest, Query()]):
     Returns:
         dict: Search results.
     """
-    response: dict = RC_search_movie(request)
+    response: dict = await run_in_threadpool(RC_search_movie, request)
 
     if "error" in response:
         raise HTTPException(status_code=400, detail=response["error"])
 
-    return response
+    return ORJSONResponse(response)
 
 
-@movie_router.post("/search")
+@movie_router.post("/search", dependencies=[Depends(admit("search"))])
 async def RP_search_movie(request: MovieSearchRequest):
     """Search movie plot in Elasticsearch.
 
@@ -44,15 +59,67 @@ async def RP_search_movie(request: MovieSearchRequest):
     Returns:
         dict: Search results.
     """
-    response: dict = RC_search_movie(request)
+    response: dict = await run_in_threadpool(RC_search_movie, request)
 
     if "error" in response:
         raise HTTPException(status_code=400, detail=response["error"])
 
-    return response
+    return ORJSONResponse(response)
+
+
+@movie_router.get("/search/stream")
+async def RG_stream_search_movie(
+    request: Annotated[MovieSearchRequest, Query()],
+    admission: Annotated[Admission, Depends(admit("search"))],
+):
+    """Search movies, streaming the results as newline-delimited JSON.
+
+    The admission slots are held until the results are sent.
+
+    Args:
+        request (MovieSearchRequest): Search request.
+        admission (Admission): Admission slots of the request.
+
+    Returns:
+        NDJSONResponse: One movie per line, the total in the `X-Total-Count` header.
+    """
+    response: dict = await run_in_threadpool(RC_stream_search, request)
+
+    if "error" in response:
+        raise HTTPException(status_code=400, detail=response["error"])
+
+    return NDJSONResponse(
+        response["documents"],
+        on_close=admission.defer(),
+        headers={"X-Total-Count": str(response["total"])},
+    )
+
 
+@movie_router.get("/export")
+async def RG_export_movies(
+    request: Annotated[MovieSearchRequest, Query()],
+    admission: Annotated[Admission, Depends(admit("export"))],
+):
+    """Export all the movies matching the search as newline-delimited JSON.
 
-@movie_router.post("/feedback/{movie_id}")
+    The admission slots are held until the movies are sent.
+
+    Args:
+        request (MovieSearchRequest): Search request, its page and sort are ignored.
+        admission (Admission): Admission slots of the request.
+
+    Returns:
+        NDJSONResponse: One movie per line.
+    """
+    response: dict = await run_in_threadpool(RC_export_movies, request)
+
+    if "error" in response:
+        raise HTTPException(status_code=400, detail=response["error"])
+
+    return NDJSONResponse(response["documents"], on_close=admission.defer())
+
+
+@movie_router.post("/feedback/{movie_id}", dependencies=[Depends(admit("feedback"))])
 async def RP_feedback(movie_id: str, score: int = 3):
     """Provide feedback on a movie.
 
@@ -63,7 +130,7 @@ async def RP_feedback(movie_id: str, score: int = 3):
     Returns:
         dict: Feedback status.
     """
-    response: dict = RC_feedback(movie_id, score)
+    response: dict = await run_in_threadpool(RC_feedback, movie_id, score)
 
     if "error" in response:
         raise HTTPException(status_code=400, detail=response["error"])
@@ -71,52 +138,122 @@ async def RP_feedback(movie_id: str, score: int = 3):
     return response
 
 
-@movie_router.get("/genres")
-async def RG_get_all_genres():
+async def get_generation() -> str:
+    """Get the generation of the index, the content only changes with it.
+
+    Returns:
+        str: Generation of the index.
+    """
+    response: dict = await run_in_threadpool(RC_get_generation, "movies")
+
+    if "error" in response:
+        raise HTTPException(status_code=400, detail=response["error"])
+
+    return response["generation"]
+
+
+@movie_router.get("/genres", dependencies=[Depends(admit("details"))])
+async def RG_get_all_genres(request: Request):
     """Get all genres.
 
+    Args:
+        request (Request): HTTP request, for its `If-None-Match` header.
+
     Returns:
         dict: Search results.
     """
-    response: dict = RC_get_all_genres("movies")
+    etag = make_etag("genres", await get_generation())
+    max_age = int(config["CACHE_MAX_AGE_GENRES"])
+
+    if is_not_modified(request, etag, "genres"):
+        return not_modified(etag, max_age)
+
+    response: dict = await run_in_threadpool(RC_get_all_genres, "movies")
 
     if "error" in response:
         raise HTTPException(status_code=400, detail=response["error"])
 
-    return response
+    return ORJSONResponse(response, headers=cache_headers(etag, max_age))
 
 
-@movie_router.get("/suggest")
-async def RG_get_suggestions(query: str):
+@movie_router.get("/suggest", dependencies=[Depends(admit("suggest"))])
+async def RG_get_suggestions(request: Request, query: str):
     """Get movie suggestions.
 
     Args:
+        request (Request): HTTP request, for its `If-None-Match` header.
         query (str): Search query.
 
     Returns:
         dict: Search results.
     """
+    # The suggestions differ by query, its digest is part of the ETag
+    etag = make_etag("suggest", await get_generation(), digest(query.strip().lower()))
+    max_age = int(config["CACHE_MAX_AGE_SUGGEST"])
+
+    if is_not_modified(request, etag, "suggest"):
+        return not_modified(etag, max_age)
 
-    response: dict = RC_get_suggestions("movies", query)
+    response: dict = await run_in_threadpool(RC_get_suggestions, "movies", query)
 
     if "error" in response:
         raise HTTPException(status_code=400, detail=response["error"])
 
-    return response
+    return ORJSONResponse(response, headers=cache_headers(etag, max_age))
 
 
-@movie_router.get("/{id}")
-async def RG_get_movie(id: str):
+@movie_router.get("/{id}", dependencies=[Depends(admit("details"))])
+async def RG_get_movie(request: Request, id: str):
     """Get movie by ID.
 
+    The ETag also depends on the version of the documents, which changes with their
+    feedback score. The version alone is read first, the details only if the client
+    copy is stale.
+
     Args:
+        request (Request): HTTP request, for its `If-None-Match` header.
         id (str): Movie ID.
 
     Returns:
         dict: Movie details.
     """
 
-    response: dict = RC_search_movie_id(id, "movies")
+    generation = await get_generation()
+    max_age = int(config["CACHE_MAX_AGE_MOVIE"])
+
+    if request.headers.get("if-none-match"):
+        response: dict = await run_in_threadpool(RC_get_movie_version, id, "movies")
+
+        if "error" in response:
+            raise HTTPException(status_code=400, detail=response["error"])
+
+        etag = make_etag("movie", generation, response["version"])
+        if is_not_modified(request, etag, "movie"):
+            return not_modified(etag, max_age)
+    else:
+        metrics.CACHE_REQUESTS.inc("movie", "miss")
+
+    response = await run_in_threadpool(RC_search_movie_id, id, "movies")
+
+    if "error" in response:
+        raise HTTPException(status_code=400, detail=response["error"])
+
+    etag = make_etag("movie", generation, response.pop("version", ""))
+
+    return ORJSONResponse(response, headers=cache_headers(etag, max_age))
+
+
+@movie_router.delete("/feedback/all", dependencies=[Depends(admit("reset"))])
+async def RD_reset_all_feedback():
+    """Reset feedback for all movies.
+
+    The reset runs in the background, use `/feedback/tasks/{task_id}` to follow it.
+
+    Returns:
+        dict: Reset status and task ID.
+    """
+
+    response: dict = await run_in_threadpool(RC_reset_all_feedback, "movies")
 
     if "error" in response:
         raise HTTPException(status_code=400, detail=response["error"])
@@ -124,18 +261,18 @@ async def RG_get_movie(id: str):
     return response
 
 
-@movie_router.delete("/feedback/{movie_id}")
-async def RD_reset_feedback(movie_id: str):
-    """Reset feedback for a movie.
+@movie_router.get("/feedback/tasks/{task_id}", dependencies=[Depends(admit("reset"))])
+async def RG_get_reset_task(task_id: str):
+    """Get the progress of a feedback reset task.
 
     Args:
-        movie_id (str): Movie ID.
+        task_id (str): Task ID.
 
     Returns:
-        dict: Reset status.
+        dict: Task completion and progress.
     """
 
-    response: dict = RC_reset_feedback(movie_id, "movies")
+    response: dict = await run_in_threadpool(RC_get_reset_task, task_id)
 
     if "error" in response:
         raise HTTPException(status_code=400, detail=response["error"])
@@ -143,15 +280,18 @@ async def RD_reset_feedback(movie_id: str):
     return response
 
 
-@movie_router.delete("/feedback/all")
-async def RD_reset_all_feedback():
-    """Reset feedback for all movies.
+@movie_router.delete("/feedback/{movie_id}", dependencies=[Depends(admit("reset"))])
+async def RD_reset_feedback(movie_id: str):
+    """Reset feedback for a movie.
+
+    Args:
+        movie_id (str): Movie ID.
 
     Returns:
         dict: Reset status.
     """
 
-    response: dict = RC_reset_all_feedback("movies")
+    response: dict = await run_in_threadpool(RC_reset_feedback, movie_id, "movies")
 
     if "error" in response:
         raise HTTPException(status_code=400, detail=response["error"])
@@ -1,17 +1,34 @@
 """Main FastAPI application file."""
 
+from contextlib import asynccontextmanager
+import logging
+
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 import uvicorn
 
 from src.routes.movies import movie_router
 from src.routes.es import es_router
+from src.routes.metrics import metrics_router
+from src.services.elastic import close_client, wait_for_cluster
+from src.services.feedback_materializer import materializer
+from src.services.search_backend import get_search_backend
+from src.utils import logconfig
+from src.utils.config import config
+from src.utils.metrics import MetricsMiddleware, TimedJSONResponse
+
+log = logging.getLogger(name="MovieApp")
 
 
 class Server:
     def __init__(self):
-        self.app = FastAPI(title="Movie Search API")
+        self.app = FastAPI(
+            title="Movie Search API",
+            lifespan=self.lifespan,
+            default_response_class=TimedJSONResponse,
+        )
 
         # Add middlewares
         self.security_middleware()
@@ -20,6 +37,30 @@ class Server:
         # Add routes
         self.add_routes()
 
+    @asynccontextmanager
+    async def lifespan(self, app: FastAPI):
+        """Start the background services with the application and stop them with it."""
+
+        if config["SEARCH_BACKEND"] == "elasticsearch":
+            # An unreachable cluster does not stop the worker, the client reconnects
+            if not await run_in_threadpool(wait_for_cluster):
+                log.warning("Elasticsearch is unreachable, starting anyway.")
+
+            # The feedback scores are materialized into the Elasticsearch index
+            materializer.start()
+        else:
+            # The index is built before the worker serves its first request
+            try:
+                await run_in_threadpool(get_search_backend().load)
+            except FileNotFoundError:
+                log.warning("The dataset is not ready, the local index is built later.")
+
+            # Each worker materializes the feedback scores into its own index
+            materializer.start(exclusive=False)
+        yield
+        materializer.stop()
+        close_client()
+
     def security_middleware(self) -> None:
         """Add security middleware to the FastAPI application.
 
@@ -43,8 +84,12 @@ class Server:
         )
 
     def standard_middlewares(self) -> None:
-        """Add standard middlewares to the FastAPI application."""
-        pass
+        """Add standard middlewares to the FastAPI application.
+
+        The metrics middleware records the latency of each route and stage, they are
+        exposed at `/metrics`.
+        """
+        self.app.add_middleware(MetricsMiddleware)
 
     def add_routes(self) -> None:
         """Add the API routes to the FastAPI application."""
@@ -57,15 +102,47 @@ class Server:
         # Add the movie search route
         self.app.include_router(movie_router, prefix="/movies", tags=["movies"])
         self.app.include_router(es_router, prefix="/es", tags=["elasticsearch"])
+        self.app.include_router(metrics_router, tags=["metrics"])
 
         return
 
     def run(self):
-        """Run the FastAPI application."""
+        """Run the FastAPI application.
+
+        Each worker process creates its own application with `create_app`, the clients
+        and caches are never shared between processes. uvloop and httptools are used
+        when they are installed, and `SIGHUP` restarts the workers gracefully.
+        """
+
+        reload = config["API_RELOAD"] == "1"
 
         try:
             print("Starting the server")
-            uvicorn.run(self.app, host="127.0.0.1", port=3001)
+            uvicorn.run(
+                "src.server:create_app",
+                factory=True,
+                host=config["API_HOST"],
+                port=int(config["API_PORT"]),
+                workers=None if reload else int(config["API_WORKERS"]),
+                reload=reload,
+                loop="auto",
+                http="auto",
+                timeout_graceful_shutdown=int(config["API_GRACEFUL_TIMEOUT"]),
+                log_config=None,
+            )
 
         except Exception as e:
             print(f"An error occurred: {e}")
+
+
+def create_app() -> FastAPI:
+    """Create the application of a worker process.
+
+    Returns:
+        FastAPI: FastAPI application.
+    """
+
+    # The worker processes are spawned, they set up their own logging
+    logconfig.setup_logging()
+
+    return Server().app
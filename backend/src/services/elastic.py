@@ -1,16 +1,129 @@
+"""Elasticsearch client, created lazily and shared by the application.
+
+Importing this module does not touch the network: the client is created on first use,
+and again in each worker process. The requests use a timeout per type of operation.
+"""
+
 import logging
-import pandas as pd
+import os
+import threading
+import time
+from typing import List
 
 from elasticsearch import Elasticsearch
 from ..utils.config import config
 
-# Initialize Elasticsearch client
-logging.info("Initializing Elasticsearch client...")
-es = Elasticsearch(
-    [{"host": config["ES_HOST"], "port": int(config["ES_PORT"]), "scheme": "http"}],
-    basic_auth=(config["ES_CLIENT"], config["ES_PASSWORD"]),
-    verify_certs=False,
-)
+log = logging.getLogger(name="MovieApp")
+
+# Request timeout of each type of operation, in seconds
+TIMEOUTS = {
+    "search": float(config["ES_TIMEOUT_SEARCH"]),
+    "suggest": float(config["ES_TIMEOUT_SUGGEST"]),
+    "update": float(config["ES_TIMEOUT_UPDATE"]),
+    "bulk": float(config["ES_TIMEOUT_BULK"]),
+    "admin": float(config["ES_TIMEOUT_ADMIN"]),
+}
+
+_client: Elasticsearch | None = None
+_client_pid: int | None = None
+_lock = threading.Lock()
+
+
+def _hosts() -> List[str]:
+    """Get the URLs of the cluster nodes, `ELASTICSEARCH_HOSTS` or host and port."""
+    if config["ES_HOSTS"]:
+        return [host.strip() for host in config["ES_HOSTS"].split(",") if host.strip()]
+
+    return [f"{config['ES_SCHEME']}://{config['ES_HOST']}:{config['ES_PORT']}"]
+
+
+def create_client() -> Elasticsearch:
+    """Create an Elasticsearch client from the configuration.
+
+    The client keeps a pool of HTTP connections per node, retries the failed requests
+    on the other nodes, and can discover the nodes of the cluster by sniffing.
+
+    Returns:
+        Elasticsearch: Elasticsearch client.
+    """
+    sniff = config["ES_SNIFF"] == "1"
+
+    return Elasticsearch(
+        _hosts(),
+        basic_auth=(
+            (config["ES_CLIENT"], config["ES_PASSWORD"])
+            if config["ES_CLIENT"]
+            else None
+        ),
+        verify_certs=False,
+        connections_per_node=int(config["ES_POOL_SIZE"]),
+        request_timeout=TIMEOUTS["search"],
+        max_retries=int(config["ES_MAX_RETRIES"]),
+        retry_on_timeout=True,
+        sniff_on_start=sniff,
+        sniff_on_node_failure=sniff,
+    )
+
+
+def get_client() -> Elasticsearch:
+    """Get the client of this process, created on first use.
+
+    Returns:
+        Elasticsearch: Elasticsearch client.
+    """
+    global _client, _client_pid
+
+    # A client inherited through fork shares its sockets with the parent
+    if _client is None or _client_pid != os.getpid():
+        with _lock:
+            if _client is None or _client_pid != os.getpid():
+                log.info("Initializing Elasticsearch client...")
+                _client = create_client()
+                _client_pid = os.getpid()
+
+    return _client
+
+
+def client_for(operation: str) -> Elasticsearch:
+    """Get the client with the request timeout of a type of operation.
+
+    Args:
+        operation (str): Type of operation, a key of `TIMEOUTS`.
+
+    Returns:
+        Elasticsearch: Elasticsearch client.
+    """
+    return get_client().options(request_timeout=TIMEOUTS[operation])
+
+
+def wait_for_cluster(attempts: int = 5, backoff: float = 0.5) -> bool:
+    """Wait for the cluster to answer, with exponential backoff.
+
+    Args:
+        attempts (int): Number of pings.
+        backoff (float): Delay before the second ping, doubled after each attempt.
+
+    Returns:
+        bool: Whether the cluster answered.
+    """
+    for attempt in range(attempts):
+        try:
+            if get_client().ping():
+                return True
+        except Exception as e:
+            log.warning(f"Elasticsearch ping failed: {e}")
+
+        if attempt < attempts - 1:
+            time.sleep(backoff * 2**attempt)
+
+    return False
+
+
+def close_client() -> None:
+    """Close the connections of the client of this process."""
+    global _client
 
-if not es.ping():
-    raise ValueError("Connection failed")
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
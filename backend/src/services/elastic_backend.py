@@ -0,0 +1,814 @@
+"""Elasticsearch implementation of the movie search backend."""
+
+from typing import Dict, Iterator, List, Tuple
+import logging
+import random
+import time
+
+from elasticsearch import helpers
+
+from .elastic import client_for
+from .load_movies import SORTED_COPIES, sorted_copy_name
+from .search_backend import (
+    BOOSTS,
+    SUGGEST_MATCH,
+    SearchBackend,
+    reciprocal_rank_fusion,
+)
+from .vectorize import embed_query
+from ..models.movies import MAX_RESCORE_WINDOW, MovieSearchRequest
+from ..utils import metrics
+from ..utils.config import config
+
+
+log = logging.getLogger(name="MovieApp")
+
+
+# Documents read per request when streaming a page of results
+STREAM_BATCH_SIZE = 500
+
+# Feedback factor of the score, read from the materialized feedback score
+FEEDBACK_FUNCTION = {
+    "script_score": {
+        "script": {
+            "source": """
+            if (doc['feedback_score'].empty) {
+                return 1;
+            }
+
+            double feedback = doc['feedback_score'].value;
+            double result = params.factor * Math.log(Math.abs(feedback) + 1);
+            if (feedback < 0) {
+                result = -result;
+            }
+
+            // A negative score fails the search
+            return Math.max(0, 1 + result);
+            """,
+            "params": {"factor": BOOSTS["feedback"]},
+        }
+    }
+}
+
+
+def build_phrase_clauses(search_query: MovieSearchRequest) -> List[Dict]:
+    """Build the phrase clauses of the search text.
+
+    Args:
+        search_query (MovieSearchRequest): Search query.
+
+    Returns:
+        List[Dict]: Phrase queries on the title and the plot synopsis.
+    """
+
+    return [
+        {
+            "match_phrase": {
+                "title": {
+                    "query": "{}".format(search_query.query),
+                    "boost": BOOSTS["title_phrase"],
+                    "slop": BOOSTS["slop"],
+                }
+            }
+        },
+        {
+            "match_phrase": {
+                "plot_synopsis": {
+                    "query": "{}".format(search_query.query),
+                    "boost": BOOSTS["synopsis_phrase"],
+                    "slop": BOOSTS["slop"],
+                }
+            },
+        },
+    ]
+
+
+def build_query(search_query: MovieSearchRequest, phrases: bool = True) -> Dict:
+    """Build Elasticsearch query from search query.
+
+    Args:
+        search_query (MovieSearchRequest): Search query.
+        phrases (bool): Whether to include the phrase clauses.
+
+    Returns:
+        Dict: Elasticsearch query.
+    """
+
+    # Base query
+    query: Dict = {
+        "bool": {
+            "must": [],
+            "filter": [],
+            "should": [],
+        }
+    }
+
+    # Add full-text search if query exists
+    if search_query.query:
+        # Title Field
+        query["bool"]["should"].append(
+            {
+                "match": {
+                    "title": {
+                        "query": "{}".format(search_query.query),
+                        "fuzziness": "AUTO",
+                        "operator": "and",
+                        "boost": BOOSTS["title"],
+                    }
+                }
+            },
+        )
+
+        # Plot_synopsis Field
+        query["bool"]["should"].append(
+            {
+                "match": {
+                    "plot_synopsis": {
+                        "query": "{}".format(search_query.query),
+                        "operator": "and",
+                        "fuzziness": "AUTO",
+                        "boost": BOOSTS["synopsis"],
+                    }
+                },
+            },
+        )
+
+        # Phrase clauses, left to the rescore phase in the two-phase search
+        if phrases:
+            query["bool"]["should"].extend(build_phrase_clauses(search_query))
+
+        query["bool"]["minimum_should_match"] = 1
+
+    # Add filters
+    if search_query.genres:
+        query["bool"]["filter"].append({"terms": {"genres": search_query.genres}})
+
+    if search_query.cast:
+        query["bool"]["filter"].append({"terms": {"cast": search_query.cast}})
+
+    if search_query.director:
+        query["bool"]["filter"].append(
+            {
+                "wildcard": {
+                    "director": f"*{search_query.director}*",
+                }
+            }
+        )
+
+    if search_query.from_year:
+        query["bool"]["filter"].append(
+            {
+                "range": {
+                    "release_date": {
+                        "gte": f"{search_query.from_year}-01-01",
+                        "format": "yyyy-MM-dd",
+                    }
+                }
+            }
+        )
+
+    if search_query.to_year:
+        query["bool"]["filter"].append(
+            {
+                "range": {
+                    "release_date": {
+                        "lte": f"{search_query.to_year}-12-31",
+                        "format": "yyyy-MM-dd",
+                    }
+                }
+            }
+        )
+
+    return query
+
+
+def build_rescore(search_query: MovieSearchRequest, window_size: int) -> List[Dict]:
+    """Build the rescore phase of the two-phase search.
+
+    The top `window_size` candidates of each shard get the phrase boosts added to their
+    score, then their score is multiplied by the feedback factor.
+
+    Args:
+        search_query (MovieSearchRequest): Search query.
+        window_size (int): Number of candidates rescored per shard.
+
+    Returns:
+        List[Dict]: Elasticsearch rescorers.
+    """
+
+    return [
+        {
+            "window_size": window_size,
+            "query": {
+                "rescore_query": {
+                    "bool": {"should": build_phrase_clauses(search_query)}
+                },
+                "score_mode": "total",
+            },
+        },
+        {
+            "window_size": window_size,
+            "query": {
+                "rescore_query": {
+                    "function_score": {
+                        "functions": [FEEDBACK_FUNCTION],
+                        "boost_mode": "replace",
+                        "max_boost": 2,
+                    }
+                },
+                "score_mode": "multiply",
+            },
+        },
+    ]
+
+
+def build_search_body(search_query: MovieSearchRequest) -> Dict:
+    """Build the body of the search request, with the feedback factor and sorting.
+
+    Args:
+        search_query (MovieSearchRequest): Search query, with its page and size set.
+
+    Returns:
+        Dict: Elasticsearch search body.
+    """
+
+    # Sorting
+    sort_field = (
+        search_query.sort_by
+        if search_query.sort_by in ["popularity", "release_date"]
+        else None
+    )
+    order = search_query.order if search_query.order in ["asc", "desc"] else "desc"
+
+    # Two-phase search: the phrase clauses and the feedback factor only score the
+    # top candidates of a cheap first-stage query. Rescoring cannot be sorted.
+    rescore_window = (
+        search_query.rescore_window
+        if search_query.rescore_window is not None
+        else int(config["RESCORE_WINDOW"])
+    )
+    # The requested page must lie in the rescored window, which Elasticsearch caps:
+    # the deeper pages are searched in one phase
+    page_end = search_query.page * search_query.size
+    two_phase = (
+        rescore_window > 0
+        and page_end <= MAX_RESCORE_WINDOW
+        and bool(search_query.query)
+        and not sort_field
+        and search_query.mode != "hybrid"
+    )
+
+    # Build the query
+    base_query = build_query(search_query, phrases=not two_phase)
+
+    # Search request body
+    query = {
+        "function_score": {
+            "query": base_query,
+            "functions": [FEEDBACK_FUNCTION],
+            "boost_mode": "multiply",
+            "max_boost": 2,
+            "score_mode": "sum",
+        }
+    }
+
+    body = {
+        "query": query,
+        "from": (search_query.page - 1) * search_query.size,
+        "size": search_query.size,
+        "_source": {"excludes": ["plot_vector"]},
+    }
+
+    if sort_field:
+        # On an index sorted the same way, the search stops once the page and the
+        # capped count of hits are collected
+        body["sort"] = [{sort_field: {"order": order}}]
+        body["track_total_hits"] = int(config["ES_TRACK_TOTAL_HITS"])
+
+    if two_phase:
+        body["query"] = base_query
+        body["rescore"] = build_rescore(
+            search_query, min(max(rescore_window, page_end), MAX_RESCORE_WINDOW)
+        )
+
+    return body
+
+
+def document_version(hits: List[Dict]) -> str:
+    """Get the version of the documents of search hits.
+
+    The sequence number changes with every update of a document.
+
+    Args:
+        hits (List[Dict]): Hits of a search with `seq_no_primary_term`.
+
+    Returns:
+        str: Version of the documents.
+    """
+    return ",".join(f"{hit['_primary_term']}.{hit['_seq_no']}" for hit in hits)
+
+
+def get_document_ids(movie_ids: List[str], index_name: str) -> Dict[str, str]:
+    """Find the Elasticsearch document ids of the given movies.
+
+    Args:
+        movie_ids (List[str]): Movie ids.
+        index_name (str): Name of the Elasticsearch index.
+
+    Returns:
+        Dict[str, str]: Document id of each movie found in the index.
+    """
+    document_ids: Dict[str, str] = {}
+    chunk_size = 1000
+
+    for start in range(0, len(movie_ids), chunk_size):
+        chunk = movie_ids[start : start + chunk_size]
+        response = client_for("search").search(
+            index=index_name,
+            body={
+                "query": {"terms": {"id": chunk}},
+                "_source": ["id"],
+                "size": len(chunk),
+            },
+        )
+
+        for hit in response["hits"]["hits"]:
+            document_ids[str(hit["_source"]["id"])] = hit["_id"]
+
+    return document_ids
+
+
+class ElasticsearchBackend(SearchBackend):
+    """Search backend running the queries on the Elasticsearch cluster."""
+
+    def __init__(self) -> None:
+        # Generation of each index and the time it was read at
+        self._generations: Dict[str, Tuple[str, float]] = {}
+        # Whether each sorted companion index exists, and the time it was checked at
+        self._sorted_copies: Dict[str, Tuple[bool, float]] = {}
+
+    def _index_for(self, search_query: MovieSearchRequest, index_name: str) -> str:
+        """Get the index to search, the companion index sorted on the sort field if any.
+
+        Args:
+            search_query (MovieSearchRequest): Search query.
+            index_name (str): Name of the Elasticsearch index.
+
+        Returns:
+            str: Name of the index to search.
+        """
+
+        if config["ES_INDEX_SORT"] != "1" or search_query.sort_by not in SORTED_COPIES:
+            return index_name
+
+        copy_name = sorted_copy_name(index_name, search_query.sort_by)
+        return copy_name if self._sorted_copy_exists(copy_name) else index_name
+
+    def _sorted_copy_exists(self, copy_name: str) -> bool:
+        """Check whether a sorted companion index exists, cached for a while.
+
+        Args:
+            copy_name (str): Name of the alias of the companion index.
+
+        Returns:
+            bool: Whether the companion index exists.
+        """
+
+        exists, checked_at = self._sorted_copies.get(copy_name, (False, 0.0))
+
+        # The companion index is missing until the first ingest completes
+        if time.monotonic() - checked_at >= float(config["CACHE_GENERATION_TTL"]):
+            exists = bool(client_for("admin").indices.exists(index=copy_name))
+            self._sorted_copies[copy_name] = (exists, time.monotonic())
+
+        return exists
+
+    def sorted_copies(self, index_name: str) -> List[str]:
+        """Get the sorted companion indices of an index which exist.
+
+        Args:
+            index_name (str): Name of the Elasticsearch index.
+
+        Returns:
+            List[str]: Names of the aliases of the companion indices.
+        """
+
+        copies = [sorted_copy_name(index_name, field) for field in SORTED_COPIES]
+        return [
+            copy_name for copy_name in copies if self._sorted_copy_exists(copy_name)
+        ]
+
+    def search(self, search_query: MovieSearchRequest, index_name: str) -> dict:
+        """Search movies with given filters/sort in Elasticsearch.
+
+        Args:
+            search_query (MovieSearchRequest): Search query.
+            index_name (str): Name of the Elasticsearch index.
+
+        Returns:
+            dict: Search results.
+        """
+
+        with metrics.stage("build_query"):
+            body = build_search_body(search_query)
+
+            # Hybrid retrieval ranks by relevance only
+            query_vector = None
+            if (
+                search_query.mode == "hybrid"
+                and search_query.query
+                and "sort" not in body
+            ):
+                query_vector = embed_query(search_query.query)
+
+        if query_vector is not None:
+            return self._hybrid_search(search_query, index_name, body, query_vector)
+
+        # Execute the search
+        with metrics.stage("elasticsearch"):
+            started = time.perf_counter()
+            response = client_for("search").search(
+                index=self._index_for(search_query, index_name), body=body
+            )
+            metrics.record_elasticsearch(
+                "search", response["took"], time.perf_counter() - started
+            )
+
+        with metrics.stage("extract"):
+            hits = response["hits"]["hits"]
+
+            # Extract the results
+            results = [hit["_source"] for hit in hits]
+
+            # Log the scores of a sample of the searches, in a single record
+            if random.random() < float(config["LOG_SCORE_SAMPLE_RATE"]):
+                log.info(
+                    "Search scores (title, score, feedback): %s",
+                    [
+                        (
+                            hit["_source"]["title"],
+                            hit["_score"],
+                            hit["_source"].get("feedback_score", 0),
+                        )
+                        for hit in hits
+                    ],
+                )
+
+        return {
+            "total": response["hits"]["total"]["value"],
+            # `gte` when the count of hits stopped at the cap
+            "total_relation": response["hits"]["total"]["relation"],
+            "results": results,
+            "page": search_query.page or 1,
+            "size": search_query.size or 10,
+        }
+
+    def _hybrid_search(
+        self,
+        search_query: MovieSearchRequest,
+        index_name: str,
+        body: Dict,
+        query_vector: list,
+    ) -> dict:
+        """Fuse the BM25 and the kNN candidates with reciprocal rank fusion.
+
+        Args:
+            search_query (MovieSearchRequest): Search query.
+            index_name (str): Name of the Elasticsearch index.
+            body (Dict): Lexical search body, built by `build_search_body`.
+            query_vector (list): Embedding of the search text.
+
+        Returns:
+            dict: Search results.
+        """
+
+        start = (search_query.page - 1) * search_query.size
+        window = max(start + search_query.size, int(config["HYBRID_RANK_WINDOW"]))
+
+        lexical = {"query": body["query"], "size": window, "_source": False}
+        knn = {
+            "knn": {
+                "field": "plot_vector",
+                "query_vector": query_vector,
+                "k": window,
+                "num_candidates": 2 * window,
+                "filter": build_query(search_query)["bool"]["filter"],
+            },
+            "size": window,
+            "_source": False,
+        }
+
+        # Both candidate lists in one round trip
+        with metrics.stage("elasticsearch"):
+            started = time.perf_counter()
+            response = client_for("search").msearch(
+                body=[{"index": index_name}, lexical, {"index": index_name}, knn]
+            )
+            metrics.record_elasticsearch(
+                "msearch", response["took"], time.perf_counter() - started
+            )
+        responses = response["responses"]
+
+        for response in responses:
+            if "error" in response:
+                raise ValueError(response["error"])
+
+        fused = reciprocal_rank_fusion(
+            [[hit["_id"] for hit in response["hits"]["hits"]] for response in responses]
+        )
+        page_ids = fused[start : start + search_query.size]
+
+        results = []
+        if page_ids:
+            with metrics.stage("elasticsearch"):
+                docs = client_for("search").mget(
+                    index=index_name,
+                    body={"ids": page_ids},
+                    _source_excludes=["plot_vector"],
+                )["docs"]
+            results = [doc["_source"] for doc in docs if doc.get("found")]
+
+        return {
+            "total": max(responses[0]["hits"]["total"]["value"], len(fused)),
+            "total_relation": responses[0]["hits"]["total"]["relation"],
+            "results": results,
+            "page": search_query.page or 1,
+            "size": search_query.size or 10,
+        }
+
+    def stream_search(
+        self, search_query: MovieSearchRequest, index_name: str
+    ) -> Tuple[int, Iterator[dict]]:
+        """Search movies, returning the total and the documents of the page lazily.
+
+        The page is read in batches of `STREAM_BATCH_SIZE` documents: the first one with
+        the total, the next ones as the documents are consumed. All the batches share
+        the ranking of the page, its rescore window included. Only the documents and
+        the total are read from the responses, the hybrid search falls back to the
+        regular search.
+
+        Args:
+            search_query (MovieSearchRequest): Search query.
+            index_name (str): Name of the Elasticsearch index.
+
+        Returns:
+            Tuple[int, Iterator[dict]]: Total number of results and the documents.
+        """
+
+        if search_query.mode == "hybrid":
+            return super().stream_search(search_query, index_name)
+
+        with metrics.stage("build_query"):
+            body = build_search_body(search_query)
+
+        index = self._index_for(search_query, index_name)
+        page_start, page_size = body["from"], body["size"]
+
+        def fetch(offset: int, track_total_hits: bool) -> dict:
+            batch = {
+                **body,
+                "from": page_start + offset,
+                "size": min(STREAM_BATCH_SIZE, page_size - offset),
+            }
+            if not track_total_hits:
+                batch["track_total_hits"] = False
+
+            with metrics.stage("elasticsearch"):
+                started = time.perf_counter()
+                response = client_for("search").search(
+                    index=index,
+                    body=batch,
+                    filter_path=["took", "hits.total.value", "hits.hits._source"],
+                )
+                metrics.record_elasticsearch(
+                    "search", response["took"], time.perf_counter() - started
+                )
+
+            return response
+
+        # The first batch is read now, so that a failing search is reported
+        first = fetch(0, track_total_hits=True)
+        total = first["hits"]["total"]["value"]
+
+        def documents() -> Iterator[dict]:
+            response, offset = first, 0
+            while True:
+                hits = response["hits"].get("hits", [])
+                for hit in hits:
+                    yield hit["_source"]
+
+                offset += len(hits)
+                if len(hits) < STREAM_BATCH_SIZE or offset >= page_size:
+                    return
+                response = fetch(offset, track_total_hits=False)
+
+        return total, documents()
+
+    def export(
+        self, search_query: MovieSearchRequest, index_name: str
+    ) -> Iterator[dict]:
+        """Iterate over all the movies matching the search, in no particular order.
+
+        The documents are read in batches with a scroll, so only one batch is held in
+        memory at a time.
+
+        Args:
+            search_query (MovieSearchRequest): Search query, its page and sort are ignored.
+            index_name (str): Name of the Elasticsearch index.
+
+        Returns:
+            Iterator[dict]: Documents of the matching movies.
+        """
+
+        hits = helpers.scan(
+            client_for("bulk"),
+            index=index_name,
+            query={
+                "query": build_query(search_query),
+                "_source": {"excludes": ["plot_vector"]},
+            },
+            size=1000,
+            scroll="2m",
+        )
+
+        return (hit["_source"] for hit in hits)
+
+    def get_generation(self, index_name: str) -> str:
+        """Get the generation of the index, the uuid of the index behind its name.
+
+        The index is recreated on reindex, so its uuid changes. It is cached for
+        `CACHE_GENERATION_TTL` seconds.
+
+        Args:
+            index_name (str): Name of the Elasticsearch index.
+
+        Returns:
+            str: Generation of the index.
+        """
+
+        generation, read_at = self._generations.get(index_name, ("", 0.0))
+        if time.monotonic() - read_at < float(config["CACHE_GENERATION_TTL"]):
+            return generation
+
+        settings = client_for("admin").indices.get_settings(
+            index=index_name, name="index.uuid"
+        )
+        generation = "+".join(
+            sorted(index["settings"]["index"]["uuid"] for index in settings.values())
+        )
+        self._generations[index_name] = (generation, time.monotonic())
+
+        return generation
+
+    def get_movie(self, id: str, index_name: str) -> dict:
+        """Search movie with a specific ID in Elasticsearch.
+
+        Args:
+            id (str): Movie ID.
+            index_name (str): Name of the Elasticsearch index.
+
+        Returns:
+            dict: Search results, and the version of the documents.
+        """
+
+        body = {
+            "query": {"match": {"id": id}},
+            "_source": {"excludes": ["plot_vector"]},
+            "seq_no_primary_term": True,
+        }
+
+        response = client_for("search").search(index=index_name, body=body)
+        hits = response["hits"]["hits"]
+
+        # Extract the results
+        results = [hit["_source"] for hit in hits]
+
+        return {"results": results, "version": document_version(hits)}
+
+    def get_movie_version(self, id: str, index_name: str) -> str:
+        """Get the version of the movie with a specific ID, without its document.
+
+        Args:
+            id (str): Movie ID.
+            index_name (str): Name of the Elasticsearch index.
+
+        Returns:
+            str: Version of the documents, as returned by `get_movie`.
+        """
+
+        body = {
+            "query": {"match": {"id": id}},
+            "_source": False,
+            "seq_no_primary_term": True,
+        }
+
+        response = client_for("search").search(index=index_name, body=body)
+
+        return document_version(response["hits"]["hits"])
+
+    def get_genres(self, index_name: str) -> dict:
+        """Get all genres from Elasticsearch.
+
+        Args:
+            index_name (str): Name of the Elasticsearch index.
+
+        Returns:
+            dict: Search results.
+        """
+
+        body = {
+            "size": 0,
+            "aggs": {
+                "genres": {
+                    "terms": {
+                        "field": "genres",
+                        "size": 1000,
+                    }
+                }
+            },
+        }
+
+        response = client_for("search").search(index=index_name, body=body)
+        genres = response["aggregations"]["genres"]["buckets"]
+
+        return {"genres": [genre["key"] for genre in genres]}
+
+    def get_suggestions(self, index_name: str, query: str) -> dict:
+        """Get suggestions from Elasticsearch.
+
+        Args:
+            index_name (str): Name of the Elasticsearch index.
+            query (str): Search query.
+
+        Returns:
+            dict: Search results.
+        """
+
+        # Search for unique suggestions
+
+        body = {
+            "suggest": {
+                "movie-suggest": {
+                    "prefix": query,
+                    "completion": {
+                        "field": "title.suggest",
+                        "size": 10,
+                        "skip_duplicates": True,
+                    },
+                }
+            },
+        }
+
+        response = client_for("suggest").search(index=index_name, body=body)
+        suggestions = response["suggest"]["movie-suggest"][0]["options"]
+
+        return {
+            "suggestions": [
+                suggestion["_source"]["title"] for suggestion in suggestions
+            ],
+            "match": SUGGEST_MATCH,
+        }
+
+    def update_feedback_scores(self, index_name: str, scores: Dict[str, float]) -> int:
+        """Write the feedback scores of movies into the `feedback_score` field.
+
+        The sorted companion indices are updated as well, their documents are copies
+        with the same ids.
+
+        Args:
+            index_name (str): Name of the Elasticsearch index.
+            scores (Dict[str, float]): Feedback score of each movie id.
+
+        Returns:
+            int: Number of movies updated in the index.
+        """
+
+        document_ids = get_document_ids(list(scores), index_name)
+        updated = 0
+
+        for index in [index_name] + self.sorted_copies(index_name):
+            actions = [
+                {
+                    "_op_type": "update",
+                    "_index": index,
+                    "_id": document_ids[movie_id],
+                    "doc": {"feedback_score": float(score)},
+                }
+                for movie_id, score in scores.items()
+                if movie_id in document_ids
+            ]
+
+            success, errors = helpers.bulk(
+                client_for("bulk"), actions, raise_on_error=False, chunk_size=1000
+            )
+            if errors:
+                log.warning(
+                    f"{len(errors)} feedback scores were not updated in '{index}': "
+                    f"{errors[:10]}"
+                )
+
+            # The movies are counted in the main index, the companions are copies
+            if index == index_name:
+                updated = success
+
+        return updated
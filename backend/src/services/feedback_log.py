@@ -0,0 +1,199 @@
+"""Append-only log of the feedback events.
+
+Every vote and every reset is stored as an event in a local SQLite database, so the
+feedback score of a movie can always be recomputed from its history.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+
+from ..utils.config import config
+
+# Movie id used by the reset events which apply to all movies.
+ALL_MOVIES = "*"
+
+VOTE = 0
+RESET = 1
+
+_connection: sqlite3.Connection | None = None
+_connection_pid: int | None = None
+_lock = threading.Lock()
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Open the feedback database on first use.
+
+    Returns:
+        sqlite3.Connection: Connection to the feedback database.
+    """
+    global _connection, _connection_pid
+
+    # A connection inherited through fork must not be used by the child
+    if _connection is None or _connection_pid != os.getpid():
+        _connection_pid = os.getpid()
+        _connection = sqlite3.connect(
+            config["FEEDBACK_DB_PATH"], check_same_thread=False
+        )
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS feedback_events (
+                movie_id TEXT NOT NULL,
+                kind INTEGER NOT NULL,
+                adjustment INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)"
+        )
+        _connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reset_tasks (
+                index_name TEXT PRIMARY KEY,
+                task_id TEXT NOT NULL
+            )
+            """
+        )
+        _connection.commit()
+
+    return _connection
+
+
+def _append_event(movie_id: str, kind: int, adjustment: int) -> None:
+    with _lock:
+        connection = _get_connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO feedback_events VALUES (?, ?, ?, ?)",
+                (str(movie_id), kind, adjustment, time.time()),
+            )
+
+
+def append_vote(movie_id: str, adjustment: int) -> None:
+    """Record a feedback vote on a movie.
+
+    Args:
+        movie_id (str): The id of the movie.
+        adjustment (int): The feedback adjustment of the vote.
+    """
+    _append_event(movie_id, VOTE, adjustment)
+
+
+def append_reset(movie_id: str = ALL_MOVIES) -> None:
+    """Record a feedback reset, the votes recorded before it are ignored.
+
+    Args:
+        movie_id (str): The id of the movie, or `ALL_MOVIES` to reset every movie.
+    """
+    _append_event(movie_id, RESET, 0)
+
+
+def get_reset_task(index_name: str) -> str | None:
+    """Get the id of the last bulk reset task started on an index, by any worker.
+
+    Args:
+        index_name (str): The name of the index.
+
+    Returns:
+        str | None: The id of the task, or None if no reset was started.
+    """
+    with _lock:
+        row = (
+            _get_connection()
+            .execute(
+                "SELECT task_id FROM reset_tasks WHERE index_name = ?", (index_name,)
+            )
+            .fetchone()
+        )
+
+    return row[0] if row else None
+
+
+def set_reset_task(index_name: str, task_id: str) -> None:
+    """Record the id of the bulk reset task started on an index.
+
+    Args:
+        index_name (str): The name of the index.
+        task_id (str): The id of the task.
+    """
+    with _lock:
+        connection = _get_connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO reset_tasks VALUES (?, ?)",
+                (index_name, task_id),
+            )
+
+
+def import_legacy_votes(totals: Dict[str, int]) -> bool:
+    """Record the vote totals of the former `feedback` field, once.
+
+    Each total becomes a single vote at the current time, as the times of the former
+    votes were not stored.
+
+    Args:
+        totals (Dict[str, int]): Feedback total of each movie.
+
+    Returns:
+        bool: Whether the votes were recorded, False if they were already imported.
+    """
+    now = time.time()
+
+    with _lock:
+        connection = _get_connection()
+        with connection:
+            imported = connection.execute(
+                "INSERT OR IGNORE INTO migrations VALUES ('legacy_feedback')"
+            ).rowcount
+            if imported:
+                connection.executemany(
+                    "INSERT INTO feedback_events VALUES (?, ?, ?, ?)",
+                    [
+                        (str(movie_id), VOTE, int(total), now)
+                        for movie_id, total in totals.items()
+                    ],
+                )
+
+    return bool(imported)
+
+
+def load_events() -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Load all feedback events as column arrays.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: Movie ids, event kinds,
+            adjustments and timestamps of the events.
+    """
+    with _lock:
+        rows = (
+            _get_connection()
+            .execute(
+                "SELECT movie_id, kind, adjustment, created_at FROM feedback_events"
+            )
+            .fetchall()
+        )
+
+    if not rows:
+        return (
+            np.empty(0, dtype=object),
+            np.empty(0, dtype=np.int8),
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.float64),
+        )
+
+    movie_ids, kinds, adjustments, timestamps = zip(*rows)
+
+    return (
+        np.array(movie_ids, dtype=object),
+        np.array(kinds, dtype=np.int8),
+        np.array(adjustments, dtype=np.float64),
+        np.array(timestamps, dtype=np.float64),
+    )
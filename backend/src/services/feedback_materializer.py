@@ -0,0 +1,248 @@
+"""Materialize the time-decayed feedback scores into the search backend.
+
+The feedback event log is aggregated periodically into the `feedback_score` field of
+each movie, so the search only reads a precomputed value. With the local backend, each
+worker process materializes the scores into its own index.
+"""
+
+import logging
+import threading
+import time
+from typing import Tuple
+
+import numpy as np
+from elasticsearch import helpers
+
+from .elastic import client_for
+from .feedback_log import ALL_MOVIES, RESET, VOTE, import_legacy_votes, load_events
+from .search_backend import get_search_backend
+from ..utils.config import config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+log = logging.getLogger(name="MovieApp")
+
+
+def compute_decayed_scores(
+    movie_ids: np.ndarray,
+    kinds: np.ndarray,
+    adjustments: np.ndarray,
+    timestamps: np.ndarray,
+    now: float,
+    half_life: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Compute the time-decayed feedback score of every movie.
+
+    Each vote weighs `adjustment * 2 ** (-age / half_life)`. The votes recorded before
+    the last reset of the movie (or of all movies) are ignored.
+
+    Args:
+        movie_ids (np.ndarray): Movie id of each event.
+        kinds (np.ndarray): Kind of each event, `VOTE` or `RESET`.
+        adjustments (np.ndarray): Feedback adjustment of each event.
+        timestamps (np.ndarray): Time of each event, in seconds.
+        now (float): Time the scores are computed at, in seconds.
+        half_life (float): Half-life of a vote, in seconds.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Sorted movie ids and their scores.
+    """
+    movies, inverse = np.unique(movie_ids.astype(str), return_inverse=True)
+
+    # Time of the last reset of each movie
+    cutoffs = np.full(len(movies), -np.inf)
+    resets = kinds == RESET
+    np.maximum.at(cutoffs, inverse[resets], timestamps[resets])
+
+    everything = np.searchsorted(movies, ALL_MOVIES)
+    if everything < len(movies) and movies[everything] == ALL_MOVIES:
+        cutoffs = np.maximum(cutoffs, cutoffs[everything])
+
+    votes = (kinds == VOTE) & (timestamps > cutoffs[inverse])
+    weights = adjustments[votes] * np.exp2(-(now - timestamps[votes]) / half_life)
+    scores = np.bincount(inverse[votes], weights=weights, minlength=len(movies))
+
+    keep = movies != ALL_MOVIES
+    return movies[keep], scores[keep]
+
+
+def migrate_legacy_feedback(index_name: str = "movies") -> int:
+    """Import the votes of the former `feedback` field into the event log.
+
+    The indices created before the event log summed the votes in a `feedback` field,
+    which the new indices do not have. The totals are read from the current index
+    before it is replaced, and imported once.
+
+    Args:
+        index_name (str): Name of the Elasticsearch alias.
+
+    Returns:
+        int: Number of movies whose votes were imported.
+    """
+    es = client_for("bulk")
+    if not es.indices.exists(index=index_name):
+        return 0
+
+    mappings = es.indices.get_mapping(index=index_name)
+    if not any(
+        "feedback" in mapping["mappings"].get("properties", {})
+        for mapping in mappings.values()
+    ):
+        return 0
+
+    hits = helpers.scan(
+        es,
+        index=index_name,
+        query={
+            "query": {
+                "bool": {
+                    "filter": {"exists": {"field": "feedback"}},
+                    "must_not": {"term": {"feedback": 0}},
+                }
+            },
+            "_source": ["id", "feedback"],
+        },
+    )
+    totals = {
+        str(hit["_source"]["id"]): int(hit["_source"]["feedback"])
+        for hit in hits
+        if hit["_source"].get("feedback")
+    }
+
+    if not import_legacy_votes(totals):
+        return 0
+
+    log.info(f"Imported the legacy feedback of {len(totals)} movies.")
+    return len(totals)
+
+
+class FeedbackMaterializer:
+    """Periodically write the decayed feedback scores which changed."""
+
+    def __init__(
+        self,
+        index_name: str = "movies",
+        interval: float = float(config["FEEDBACK_MATERIALIZE_INTERVAL"]),
+        half_life_days: float = float(config["FEEDBACK_HALF_LIFE_DAYS"]),
+        tolerance: float = 0.01,
+    ) -> None:
+        self.index_name = index_name
+        self.interval = interval
+        self.half_life = half_life_days * 24 * 3600
+        self.tolerance = tolerance
+
+        # Scores last written to the index, sorted by movie id
+        self._movies = np.empty(0, dtype=str)
+        self._scores = np.empty(0, dtype=np.float64)
+        self._generation = ""
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock_file = None
+
+    def run_once(self) -> int:
+        """Recompute the scores and write the ones which changed.
+
+        Returns:
+            int: Number of movies updated.
+        """
+        # A reindex swaps in an index without feedback, all the scores are rewritten
+        generation = get_search_backend().get_generation(self.index_name)
+        if generation != self._generation:
+            self._movies = np.empty(0, dtype=str)
+            self._scores = np.empty(0, dtype=np.float64)
+            self._generation = generation
+
+        movies, scores = compute_decayed_scores(
+            *load_events(), now=time.time(), half_life=self.half_life
+        )
+
+        # Align the previously written scores with the new ones
+        previous = np.zeros(len(movies))
+        if len(self._movies):
+            index = np.searchsorted(self._movies, movies)
+            index = np.minimum(index, len(self._movies) - 1)
+            found = self._movies[index] == movies
+            previous[found] = self._scores[index[found]]
+
+        changed = np.abs(scores - previous) > self.tolerance
+        if not changed.any():
+            return 0
+
+        updated = get_search_backend().update_feedback_scores(
+            self.index_name,
+            dict(zip(movies[changed].tolist(), scores[changed].tolist())),
+        )
+
+        self._movies = movies
+        self._scores = np.where(changed, scores, previous)
+
+        log.info(f"Materialized feedback scores of {updated} movies.")
+        return updated
+
+    def start(self, exclusive: bool = True) -> None:
+        """Start materializing the scores in a background thread.
+
+        Args:
+            exclusive (bool): Whether the index is shared by the worker processes, then
+                only the one holding the lock file runs it.
+        """
+        if self._thread is not None:
+            return
+
+        if exclusive and not self._acquire_lock():
+            log.info("Feedback scores are materialized by another worker.")
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="FeedbackMaterializer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread."""
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _acquire_lock(self) -> bool:
+        if fcntl is None:
+            return True
+
+        self._lock_file = open(f"{config['FEEDBACK_DB_PATH']}.lock", "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+
+        return True
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                log.error(f"Failed to materialize feedback scores: {e}")
+
+            if self._stop.wait(self.interval):
+                return
+
+
+materializer = FeedbackMaterializer()
+
+
+if __name__ == "__main__":
+    FeedbackMaterializer().run_once()
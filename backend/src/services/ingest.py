@@ -0,0 +1,119 @@
+"""Background ingest of the movie dataset.
+
+The API serves the current index at once, while the dataset is preprocessed and loaded
+into a new index in a background thread. The new index replaces the current one once
+complete. The progress is written to a status file, so every worker process can
+report it.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from .feedback_materializer import migrate_legacy_feedback
+from .load_movies import SORTED_COPIES, load_movies_to_es, load_sorted_copy
+from ..utils.config import config
+from ..utils.preprocess import preprocess_data
+
+log = logging.getLogger(name="MovieApp")
+
+
+def write_status(state: str, **details) -> None:
+    """Write the ingest status, atomically.
+
+    Args:
+        state (str): `preprocessing`, `loading`, `ready` or `failed`.
+        **details: Details of the state, such as the progress or the error.
+    """
+    status = {"state": state, "updated_at": time.time(), **details}
+    path = config["INGEST_STATUS_PATH"]
+
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(status, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_status() -> dict:
+    """Read the ingest status.
+
+    Returns:
+        dict: Ingest status, `idle` if no ingest ran.
+    """
+    try:
+        with open(config["INGEST_STATUS_PATH"], "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"state": "idle"}
+
+
+def run_ingest(mapping: dict, index_name: str = "movies") -> None:
+    """Preprocess the dataset if needed, and load it into Elasticsearch.
+
+    Args:
+        mapping (dict): Mapping of the Elasticsearch index.
+        index_name (str): Name of the Elasticsearch alias.
+    """
+
+    started = time.time()
+
+    try:
+        # Path for dataset and cleaned dataset
+        dataset_path = config["DATA_PATH"]
+        cleaned_dataset_path = config["CLEANED_DATA_PATH"]
+
+        # Check if preprocessing is required
+        if not os.path.exists(cleaned_dataset_path) or (
+            os.path.exists(dataset_path)
+            and os.path.getmtime(dataset_path) > os.path.getmtime(cleaned_dataset_path)
+        ):
+            log.info("Preprocessing the dataset...")
+            write_status("preprocessing", started_at=started)
+            preprocess_data(dataset_path, cleaned_dataset_path, -1)
+
+        # The local backend reads the cleaned dataset directly
+        if config["SEARCH_BACKEND"] == "elasticsearch":
+            # The votes of an index created before the event log would be lost
+            migrate_legacy_feedback(index_name)
+
+            log.info("Loading the dataset to Elasticsearch...")
+            write_status("loading", started_at=started, loaded=0, total=None)
+            loaded = load_movies_to_es(
+                cleaned_dataset_path,
+                index_name,
+                mapping=mapping,
+                progress=lambda loaded, total: write_status(
+                    "loading", started_at=started, loaded=loaded, total=total
+                ),
+            )
+
+            # Companion indices for the searches sorted on other fields
+            if config["ES_INDEX_SORT"] == "1":
+                for field in SORTED_COPIES:
+                    load_sorted_copy(index_name, field, mapping, rebuild=loaded)
+            log.info("Dataset loaded successfully!")
+
+        write_status("ready", started_at=started, finished_at=time.time())
+
+    except Exception as e:
+        log.error(f"Ingest failed: {e}")
+        write_status("failed", started_at=started, error=str(e))
+
+
+def start_ingest(mapping: dict, index_name: str = "movies") -> threading.Thread:
+    """Run the ingest in a background thread.
+
+    Args:
+        mapping (dict): Mapping of the Elasticsearch index.
+        index_name (str): Name of the Elasticsearch alias.
+
+    Returns:
+        threading.Thread: The ingest thread.
+    """
+    thread = threading.Thread(
+        target=run_ingest, args=(mapping, index_name), name="Ingest", daemon=True
+    )
+    thread.start()
+
+    return thread
@@ -1,15 +1,26 @@
 import ast
+import logging
 import os
+import time
 from typing import Callable
 import pandas as pd
 import hashlib
 
 from elasticsearch import helpers
-from ..services.elastic import es
+from ..services.elastic import client_for
+from ..services.vectorize import get_plot_vectors
 from ..utils.config import config
 
+log = logging.getLogger(name="MovieApp")
+
 HASH_FILE = "./src/data/hash.txt"
 
+# Fields of the companion indices, sorted on another field than the main index
+SORTED_COPIES = ["release_date"]
+
+# Seconds between the checks of a running reindex task
+REINDEX_POLL_INTERVAL = 2
+
 
 def format_data(df: pd.DataFrame) -> pd.DataFrame:
     """This is for formatting the data before loading it to Elasticsearch.
@@ -84,22 +95,92 @@ def compute_hash(file_path: str, additional_str: str = "") -> str:
     return hashlib.md5(str(metadata).encode()).hexdigest()
 
 
+def with_index_sort(mapping: dict, field: str, order: str = "desc") -> dict:
+    """Copy the index mapping, with the documents sorted on a field.
+
+    Searches sorted the same way stop after the first hits of each segment.
+
+    Args:
+        mapping (dict): Mapping of the Elasticsearch index.
+        field (str): Field sorting the index, which must be in the mapping.
+        order (str): Order of the sort, `asc` or `desc`.
+
+    Returns:
+        dict: Mapping of the sorted index.
+    """
+    settings = mapping.get("settings", {})
+    index_settings = {
+        **settings.get("index", {}),
+        "sort.field": field,
+        "sort.order": order,
+    }
+
+    return {**mapping, "settings": {**settings, "index": index_settings}}
+
+
+def sorted_copy_name(alias: str, field: str) -> str:
+    """Get the alias of the companion index sorted on a field.
+
+    Args:
+        alias (str): Name of the alias of the main index.
+        field (str): Field sorting the companion index.
+
+    Returns:
+        str: Name of the alias of the companion index.
+    """
+    # Not `<alias>-*`, which names the indices of the main alias
+    return f"{alias}_by_{field}"
+
+
+def swap_alias(es, alias: str, index_name: str) -> None:
+    """Point the alias at the index, and delete the indices it replaces.
+
+    The swap is atomic, searches see either the old or the new index. An index created
+    under the name of the alias, before the aliases were used, is replaced as well.
+
+    Args:
+        es (Elasticsearch): Elasticsearch client.
+        alias (str): Name of the alias, used by the searches.
+        index_name (str): Name of the new index.
+    """
+
+    actions: list = [{"add": {"index": index_name, "alias": alias}}]
+
+    # Indices of previous loads, including the ones which failed before their swap
+    old_indices = set(es.indices.get(index=f"{alias}-*", expand_wildcards="open"))
+    if es.indices.exists_alias(name=alias):
+        old_indices |= set(es.indices.get_alias(name=alias))
+    elif es.indices.exists(index=alias):
+        old_indices.add(alias)
+
+    old_indices.discard(index_name)
+    actions += [{"remove_index": {"index": old}} for old in sorted(old_indices)]
+
+    es.indices.update_aliases(body={"actions": actions})
+
+
 def load_movies_to_es(
     panda_path: str,
     index_name: str,
     format_column: Callable | None = format_data2,
     mapping: dict | None = None,
-) -> None:
+    progress: Callable[[int, int], None] | None = None,
+) -> bool:
     """Load movies data to Elasticsearch.
 
+    The movies are loaded into a new index, which replaces the current one once
+    complete: `index_name` is an alias of the latest index.
+
     Args:
         panda_path (str): Path to the Pandas readable file.
-        index_name (str): Name of the Elasticsearch index.
+        index_name (str): Name of the Elasticsearch alias.
         format_column (Callable, optional): Function to format columns. Defaults to None.
         mapping (dict, optional): Mapping for the Elasticsearch index. Defaults to None.
+        progress (Callable, optional): Called with the number of movies loaded and the
+            total. Defaults to None.
 
     Returns:
-        None
+        bool: Whether the movies were loaded, False if the dataset did not change.
 
     Raises:
         FileNotFoundError: If the CSV file is not found.
@@ -119,15 +200,20 @@ def load_movies_to_es(
         with open(HASH_FILE, "r") as f:
             old_hash = f.read()
 
-    if new_hash == old_hash:
+    es = client_for("bulk")
+
+    if new_hash == old_hash and es.indices.exists(index=index_name):
         print("No changes in the dataset. Skipping the loading to Elasticsearch.")
-        return
+        return False
+
+    # The searches keep using the current index while the new one is loaded
+    new_index = f"{index_name}-{time.strftime('%Y%m%d%H%M%S')}"
 
     try:
-        # Ensures Elasticsearch index is created
-        if es.indices.exists(index=index_name):
-            es.indices.delete(index=index_name)
-        es.indices.create(index=index_name, body=mapping)
+        # No refresh while loading, the index is refreshed before the swap
+        body = dict(mapping or {})
+        body["settings"] = {**body.get("settings", {}), "refresh_interval": "-1"}
+        es.indices.create(index=new_index, body=body)
 
         # Bulk upload data
         actions: list = []
@@ -144,34 +230,121 @@ def load_movies_to_es(
         if format_column:
             df = format_column(df)
 
+        # Dense vectors of the plots, if the vectorization stage ran
+        vectors = get_plot_vectors(df)
+
         for i, row in df.iterrows():
             source_dict = row.to_dict()
             source_dict["suggest"] = {
                 "input": source_dict["title"].split(" "),
                 "weight": float(source_dict["popularity"]),
             }
+            # A plot without any known term has no vector, the cosine similarity of
+            # a zero vector is undefined
+            if vectors is not None and vectors[i].any():
+                source_dict["plot_vector"] = vectors[i].tolist()
 
             action = {
-                "_index": index_name,
+                "_index": new_index,
                 "_id": i,
                 "_source": source_dict,
             }
             actions.append(action)
 
-        helpers.bulk(
-            es, actions, index=index_name, raise_on_error=False, chunk_size=1000
+        loaded = 0
+        for ok, item in helpers.streaming_bulk(
+            es, actions, index=new_index, raise_on_error=False, chunk_size=1000
+        ):
+            if not ok:
+                log.warning(f"A movie was not loaded: {item}")
+            loaded += 1
+            if progress and (loaded % 1000 == 0 or loaded == len(actions)):
+                progress(loaded, len(actions))
+
+        es.indices.put_settings(
+            index=new_index,
+            body={"index": {"refresh_interval": config["ES_REFRESH_INTERVAL"]}},
         )
+        es.indices.refresh(index=new_index)
 
         # Preview the mapping
-        template = es.indices.get_mapping(index=index_name)
+        template = es.indices.get_mapping(index=new_index)
         print(template)
+
+        swap_alias(es, index_name, new_index)
     except Exception as e:
+        # The current index is left untouched
+        if es.indices.exists(index=new_index):
+            es.indices.delete(index=new_index)
         raise e
 
     # Save the hash of the file
     with open(HASH_FILE, "w") as f:
         f.write(new_hash)
 
+    return True
+
+
+def load_sorted_copy(
+    alias: str, field: str, mapping: dict, rebuild: bool = False
+) -> None:
+    """Copy the movies of the main index into a companion index sorted on a field.
+
+    The documents are copied by the cluster with a reindex, into a new index which
+    then replaces the current companion, as in `load_movies_to_es`. The reindex runs
+    as a background task, polled until it completes: a request waiting for it would
+    outlast the timeout of the client, which would send it again.
+
+    Args:
+        alias (str): Name of the alias of the main index.
+        field (str): Field sorting the companion index, in descending order.
+        mapping (dict): Mapping of the main index.
+        rebuild (bool): Whether to replace an existing companion index.
+    """
+
+    es = client_for("bulk")
+    copy_alias = sorted_copy_name(alias, field)
+
+    if not rebuild and es.indices.exists(index=copy_alias):
+        return
+
+    new_index = f"{copy_alias}-{time.strftime('%Y%m%d%H%M%S')}"
+
+    try:
+        body = with_index_sort(mapping, field)
+        body["settings"]["refresh_interval"] = "-1"
+        es.indices.create(index=new_index, body=body)
+
+        task_id = es.reindex(
+            body={"source": {"index": alias}, "dest": {"index": new_index}},
+            wait_for_completion=False,
+        )["task"]
+
+        admin = client_for("admin")
+        while True:
+            task = admin.tasks.get(task_id=task_id)
+            if task["completed"]:
+                break
+            time.sleep(REINDEX_POLL_INTERVAL)
+
+        if "error" in task:
+            raise ValueError(f"Reindex failed: {task['error']}")
+        if task.get("response", {}).get("failures"):
+            raise ValueError(f"Reindex failed: {task['response']['failures'][:3]}")
+
+        es.indices.put_settings(
+            index=new_index,
+            body={"index": {"refresh_interval": config["ES_REFRESH_INTERVAL"]}},
+        )
+        es.indices.refresh(index=new_index)
+
+        swap_alias(es, copy_alias, new_index)
+    except Exception as e:
+        # The current companion index is left untouched
+        if es.indices.exists(index=new_index):
+            es.indices.delete(index=new_index)
+        raise e
+
 
 if __name__ == "__main__":
     load_movies_to_es(config["CLEANED_DATA_PATH"], "movies", format_data)
@@ -0,0 +1,610 @@
+"""In-process BM25 search engine.
+
+The engine keeps an inverted index of the title and the plot synopsis of the movies in
+compact NumPy arrays and answers the same requests as the Elasticsearch backend,
+without a cluster. It is meant for local development and latency-sensitive nodes.
+
+The analysis and scoring follow `elastic_backend.build_query`:
+    - The title is indexed with edge n-grams (3 to 10 characters), the plot synopsis
+      with a light English analyzer (stop words and plural stemming).
+    - Both fields are scored with BM25 and the same boosts as the Elasticsearch query.
+      Matches require all the query terms (`operator: and`). Fuzziness is not
+      supported, and the phrase clauses are approximated by the conjunctive match.
+    - Genres, cast, director and year filters are applied as bitsets.
+"""
+
+from collections import Counter
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .ingest import read_status
+from .search_backend import BOOSTS, SUGGEST_MATCH, SearchBackend, suggest_key
+from .load_movies import format_data2
+from ..models.movies import MovieSearchRequest
+from ..utils import metrics
+from ..utils.config import config
+
+log = logging.getLogger(name="MovieApp")
+
+# BM25 parameters, the Elasticsearch defaults
+K1 = 1.2
+B = 0.75
+
+# Boosts of the (match, match_phrase) clauses of each field
+FIELD_BOOSTS = {
+    "title": (BOOSTS["title"], BOOSTS["title_phrase"]),
+    "plot_synopsis": (BOOSTS["synopsis"], BOOSTS["synopsis_phrase"]),
+}
+
+# Director filters whose bitsets are kept
+DIRECTOR_CACHE_SIZE = 1024
+
+# Stop words of the Elasticsearch english analyzer
+ENGLISH_STOP_WORDS = frozenset(
+    "a an and are as at be but by for if in into is it no not of on or such that the "
+    "their then there these they this to was will with".split()
+)
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def analyze_title(text: str) -> List[str]:
+    """Split a title into lowercase edge n-grams, like the `edge_ngram_analyzer`."""
+    return [
+        token[:n]
+        for token in _TOKEN.findall(text.lower())
+        for n in range(3, min(len(token), 10) + 1)
+    ]
+
+
+def analyze_synopsis(text: str) -> List[str]:
+    """Split a plot synopsis into folded, stemmed terms without stop words."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    terms = []
+
+    for token in _TOKEN.findall(text.lower()):
+        if token in ENGLISH_STOP_WORDS:
+            continue
+
+        if len(token) > 4 and token.endswith("ies"):
+            token = token[:-3] + "y"
+        elif (
+            len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us"))
+        ):
+            token = token[:-1]
+
+        terms.append(token)
+
+    return terms
+
+
+def feedback_boost(feedback: np.ndarray) -> np.ndarray:
+    """Score factor of the feedback scores, as the Elasticsearch feedback function."""
+    return np.clip(
+        1 + np.sign(feedback) * BOOSTS["feedback"] * np.log(np.abs(feedback) + 1), 0, 2
+    ).astype(np.float32)
+
+
+class FieldIndex:
+    """Inverted index of one text field, with CSR postings.
+
+    The postings of the term `t` are `doc_ids[indptr[t]:indptr[t + 1]]`, and the BM25
+    weight of the term in each of these documents is stored alongside in `weights`.
+    """
+
+    def __init__(self, documents: List[List[str]]) -> None:
+        self.vocabulary: Dict[str, int] = {}
+        terms: List[int] = []
+        docs: List[int] = []
+        freqs: List[int] = []
+        lengths = np.zeros(len(documents), dtype=np.float32)
+
+        for doc_id, tokens in enumerate(documents):
+            lengths[doc_id] = len(tokens)
+            for token, freq in Counter(tokens).items():
+                terms.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+                docs.append(doc_id)
+                freqs.append(freq)
+
+        terms_array = np.array(terms, dtype=np.int32)
+        order = np.argsort(terms_array, kind="stable")
+
+        self.doc_ids = np.array(docs, dtype=np.int32)[order]
+        self.indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(terms_array, minlength=len(self.vocabulary)),
+            out=self.indptr[1:],
+        )
+
+        # Precompute the BM25 weight of each posting
+        n_docs = len(documents)
+        doc_freqs = np.diff(self.indptr).astype(np.float32)
+        idf = np.log(1 + (n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+        tf = np.array(freqs, dtype=np.float32)[order]
+        norm = 1 - B + B * lengths[self.doc_ids] / max(float(lengths.mean()), 1.0)
+        self.weights = (
+            idf[terms_array[order]] * tf * (K1 + 1) / (tf + K1 * norm)
+        ).astype(np.float32)
+
+    def match(self, tokens: List[str], n_docs: int) -> np.ndarray | None:
+        """Score the documents containing all the tokens.
+
+        Args:
+            tokens (List[str]): Analyzed query tokens.
+            n_docs (int): Number of documents.
+
+        Returns:
+            np.ndarray | None: BM25 score of each document, 0 for the documents which
+                do not match, or None if no document matches.
+        """
+        query = Counter(tokens)
+        if not query:
+            return None
+
+        scores = np.zeros(n_docs, dtype=np.float32)
+        counts = np.zeros(n_docs, dtype=np.int16)
+
+        for token, freq in query.items():
+            term = self.vocabulary.get(token)
+            if term is None:
+                return None
+
+            postings = slice(self.indptr[term], self.indptr[term + 1])
+            docs = self.doc_ids[postings]
+            scores[docs] += freq * self.weights[postings]
+            counts[docs] += 1
+
+        scores[counts < len(query)] = 0
+        return scores
+
+
+class KeywordIndex:
+    """Postings of a multi-valued keyword field."""
+
+    def __init__(self, values: List[List[str]], n_docs: int) -> None:
+        self.n_docs = n_docs
+        self.postings: Dict[str, np.ndarray] = {}
+
+        docs: Dict[str, List[int]] = {}
+        for doc_id, doc_values in enumerate(values):
+            for value in doc_values:
+                docs.setdefault(value, []).append(doc_id)
+
+        for value, doc_ids in docs.items():
+            self.postings[value] = np.array(doc_ids, dtype=np.int32)
+
+        self.values = np.array(list(self.postings), dtype=str)
+
+    def bitset(self, values: List[str]) -> np.ndarray:
+        """Packed bitset of the documents with any of the values."""
+        mask = np.zeros(self.n_docs, dtype=bool)
+        for value in values:
+            if value in self.postings:
+                mask[self.postings[value]] = True
+
+        return np.packbits(mask)
+
+    def contains_bitset(self, substring: str) -> np.ndarray:
+        """Packed bitset of the documents with a value containing the substring."""
+        matches = self.values[np.char.find(self.values, substring) >= 0]
+        return self.bitset(matches.tolist())
+
+
+class LocalSearchEngine:
+    """In-process index of the movies."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        started = time.perf_counter()
+
+        # Documents whose release date is not a date are rejected by Elasticsearch
+        release_dates = pd.to_datetime(
+            df["release_date"], format="ISO8601", errors="coerce"
+        )
+        df = df[release_dates.notna()].reset_index(drop=True)
+        release_dates = release_dates[release_dates.notna()].reset_index(drop=True)
+
+        self.n_docs = len(df)
+        self.documents: List[dict] = json.loads(
+            df.to_json(orient="records", date_format="iso")
+        )
+
+        # Text fields
+        self.title = FieldIndex([analyze_title(str(t)) for t in df["title"]])
+        self.plot_synopsis = FieldIndex(
+            [analyze_synopsis(str(p)) for p in df["plot_synopsis"]]
+        )
+
+        # Filters: precomputed genre bitsets, one bitset per release year (cumulative)
+        self.genres = KeywordIndex(df["genres"].tolist(), self.n_docs)
+        self.genre_bitsets = {
+            genre: self.genres.bitset([genre]) for genre in self.genres.postings
+        }
+        self.cast = KeywordIndex(df["cast"].tolist(), self.n_docs)
+        self.director = KeywordIndex(df["director"].tolist(), self.n_docs)
+        self._director_bitsets: Dict[str, np.ndarray] = {}
+
+        self.years = release_dates.dt.year.to_numpy(dtype=np.int32)
+        self.first_year = int(self.years.min()) if self.n_docs else 0
+        self.released_by = np.stack(
+            [
+                np.packbits(self.years <= year)
+                for year in range(
+                    self.first_year - 1, int(self.years.max(initial=0)) + 1
+                )
+            ]
+        )
+
+        # Sort keys and feedback boost
+        self.popularity = df["popularity"].to_numpy(dtype=np.float64)
+        self.release_dates = release_dates.to_numpy(dtype="datetime64[ns]").view(
+            np.int64
+        )
+        self.feedback = (
+            df["feedback_score"].fillna(0).to_numpy(dtype=np.float64)
+            if "feedback_score" in df
+            else np.zeros(self.n_docs)
+        )
+        self.boost = feedback_boost(self.feedback)
+
+        # Suggestions: normalized titles sorted for prefix lookups
+        titles = sorted(
+            (suggest_key(title), doc_id)
+            for doc_id, title in enumerate(df["title"].astype(str))
+        )
+        self.suggest_titles = np.array([title for title, _ in titles], dtype=str)
+        self.suggest_docs = np.array([doc_id for _, doc_id in titles], dtype=np.int32)
+
+        self.ids: Dict[str, List[int]] = {}
+        for doc_id, movie_id in enumerate(df["id"]):
+            self.ids.setdefault(str(movie_id), []).append(doc_id)
+
+        self.genre_counts = Counter(
+            genre for genres in df["genres"] for genre in genres
+        ).most_common(1000)
+
+        log.info(
+            f"Built the local index of {self.n_docs} movies in "
+            f"{time.perf_counter() - started:.2f}s."
+        )
+
+    @classmethod
+    def from_file(cls, path: str) -> "LocalSearchEngine":
+        """Build the engine from a cleaned dataset file (Parquet, CSV or XLSX)."""
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"File not found: {path}")
+
+        if path.endswith(".parquet"):
+            df = pd.read_parquet(path)
+        elif path.endswith(".csv"):
+            df = pd.read_csv(path)
+        elif path.endswith(".xlsx"):
+            df = pd.read_excel(path)
+        else:
+            raise ValueError("File format not supported.")
+
+        return cls(format_data2(df))
+
+    def _year_bitset(self, from_year: int | None, to_year: int | None) -> np.ndarray:
+        last = len(self.released_by) - 1
+
+        def released_by(year: int) -> np.ndarray:
+            return self.released_by[min(max(year - self.first_year + 1, 0), last)]
+
+        bits = np.full(self.released_by.shape[1], 0xFF, dtype=np.uint8)
+        if to_year:
+            bits &= released_by(to_year)
+        if from_year:
+            bits &= ~released_by(from_year - 1)
+
+        return bits
+
+    def _director_bitset(self, director: str) -> np.ndarray:
+        bits = self._director_bitsets.get(director)
+        if bits is None:
+            if len(self._director_bitsets) >= DIRECTOR_CACHE_SIZE:
+                self._director_bitsets.clear()
+            bits = self._director_bitsets[director] = self.director.contains_bitset(
+                director
+            )
+
+        return bits
+
+    def filter_mask(self, search_query: MovieSearchRequest) -> np.ndarray | None:
+        """Combine the filters of the request into a mask of the documents."""
+        bitsets = []
+
+        if search_query.genres:
+            genres = [self.genre_bitsets.get(g) for g in search_query.genres]
+            genres = [bits for bits in genres if bits is not None]
+            if not genres:
+                return np.zeros(self.n_docs, dtype=bool)
+            bitsets.append(np.bitwise_or.reduce(genres))
+        if search_query.cast:
+            bitsets.append(self.cast.bitset(search_query.cast))
+        if search_query.director:
+            bitsets.append(self._director_bitset(search_query.director))
+        if search_query.from_year or search_query.to_year:
+            bitsets.append(
+                self._year_bitset(search_query.from_year, search_query.to_year)
+            )
+
+        if not bitsets:
+            return None
+
+        return np.unpackbits(np.bitwise_and.reduce(bitsets), count=self.n_docs).astype(
+            bool
+        )
+
+    def match(self, search_query: MovieSearchRequest) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the documents matching the search text and the filters.
+
+        Args:
+            search_query (MovieSearchRequest): Search query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Matching documents and their scores.
+        """
+        if search_query.query:
+            scores = np.zeros(self.n_docs, dtype=np.float32)
+            for field, index, tokens in [
+                ("title", self.title, analyze_title(search_query.query)),
+                (
+                    "plot_synopsis",
+                    self.plot_synopsis,
+                    analyze_synopsis(search_query.query),
+                ),
+            ]:
+                field_scores = index.match(tokens, self.n_docs)
+                if field_scores is not None:
+                    scores += sum(FIELD_BOOSTS[field]) * field_scores
+            matched = scores > 0
+        else:
+            scores = np.ones(self.n_docs, dtype=np.float32)
+            matched = np.ones(self.n_docs, dtype=bool)
+
+        mask = self.filter_mask(search_query)
+        if mask is not None:
+            matched &= mask
+
+        candidates = np.flatnonzero(matched)
+        return candidates, scores[candidates] * self.boost[candidates]
+
+    def search(self, search_query: MovieSearchRequest) -> dict:
+        """Search movies with given filters/sort.
+
+        Args:
+            search_query (MovieSearchRequest): Search query.
+
+        Returns:
+            dict: Search results, like the Elasticsearch backend.
+        """
+        size = search_query.size or 10
+        page = search_query.page or 1
+
+        candidates, scores = self.match(search_query)
+
+        # Sorting
+        sort_field = (
+            search_query.sort_by
+            if search_query.sort_by in ["popularity", "release_date"]
+            else None
+        )
+        if sort_field:
+            keys = self.popularity if sort_field == "popularity" else self.release_dates
+            keys = keys[candidates]
+            order = np.argsort(
+                keys if search_query.order == "asc" else -keys, kind="stable"
+            )
+        else:
+            # Only the documents up to the requested page need to be ranked
+            top = min(page * size, len(candidates))
+            order = np.argpartition(-scores, top - 1)[:top] if top else candidates[:0]
+            order = order[np.lexsort((order, -scores[order]))]
+
+        page_order = order[(page - 1) * size : page * size]
+
+        return {
+            "total": len(candidates),
+            "total_relation": "eq",
+            "results": [self.documents[i] for i in candidates[page_order]],
+            "page": page,
+            "size": size,
+        }
+
+    def get_movie(self, id: str) -> dict:
+        return {
+            "results": [self.documents[i] for i in self.ids.get(str(id), [])],
+            "version": self.get_movie_version(id),
+        }
+
+    def get_movie_version(self, id: str) -> str:
+        # The documents only change with their feedback score
+        return ",".join(f"{self.feedback[i]:g}" for i in self.ids.get(str(id), []))
+
+    def get_genres(self) -> dict:
+        return {"genres": [genre for genre, _ in self.genre_counts]}
+
+    def get_feedback_scores(self) -> Dict[str, float]:
+        """Get the non-zero feedback scores, by movie id."""
+        return {
+            movie_id: float(self.feedback[doc_ids[0]])
+            for movie_id, doc_ids in self.ids.items()
+            if self.feedback[doc_ids[0]]
+        }
+
+    def set_feedback_scores(self, scores: Dict[str, float]) -> int:
+        """Set the feedback scores of movies, and their score factor.
+
+        Args:
+            scores (Dict[str, float]): Feedback score of each movie id.
+
+        Returns:
+            int: Number of movies found in the index.
+        """
+        feedback = self.feedback.copy()
+        found = 0
+        for movie_id, score in scores.items():
+            doc_ids = self.ids.get(str(movie_id))
+            if doc_ids:
+                feedback[doc_ids] = score
+                for doc_id in doc_ids:
+                    self.documents[doc_id]["feedback_score"] = float(score)
+                found += 1
+
+        # Replaced at once, the searches running meanwhile read either version
+        self.feedback, self.boost = feedback, feedback_boost(feedback)
+
+        return found
+
+    def get_suggestions(self, query: str, size: int = 10) -> dict:
+        # The start of the title, as the completion suggester of Elasticsearch
+        prefix = suggest_key(query)
+        if not prefix:
+            return {"suggestions": [], "match": SUGGEST_MATCH}
+
+        start = np.searchsorted(self.suggest_titles, prefix, side="left")
+        end = np.searchsorted(self.suggest_titles, prefix + "\uffff", side="left")
+
+        # Best suggestions first, without duplicate titles
+        docs = self.suggest_docs[start:end]
+        docs = docs[np.argsort(-self.popularity[docs], kind="stable")]
+
+        suggestions: List[str] = []
+        for doc_id in docs:
+            title = self.documents[doc_id]["title"]
+            if title not in suggestions:
+                suggestions.append(title)
+            if len(suggestions) == size:
+                break
+
+        return {"suggestions": suggestions, "match": SUGGEST_MATCH}
+
+
+class LocalBackend(SearchBackend):
+    """Search backend running the queries on the in-process engine.
+
+    The index is built from the cleaned dataset by `load`, when the application
+    starts; `index_name` is ignored. It is rebuilt in the background when an ingest
+    rewrites the dataset, see `refresh`.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._engine: LocalSearchEngine | None = None
+        self._generation = ""
+        self._checked_at = 0.0
+        self._reloading = False
+        self._lock = threading.Lock()
+
+    def _read_generation(self) -> str:
+        # The same file gives the same generation in every worker
+        return f"{os.path.getmtime(self.path):.0f}"
+
+    def load(self) -> LocalSearchEngine:
+        """Build the index, unless it is built already.
+
+        Returns:
+            LocalSearchEngine: The engine of the index.
+        """
+        if self._engine is None:
+            # Built once, by the first of the threads requesting it
+            with self._lock:
+                if self._engine is None:
+                    self._generation = self._read_generation()
+                    self._engine = LocalSearchEngine.from_file(self.path)
+                    self._checked_at = time.monotonic()
+
+        return self._engine
+
+    def refresh(self) -> None:
+        """Rebuild the index in the background if the dataset changed.
+
+        The dataset is checked at most every `CACHE_GENERATION_TTL` seconds, and not
+        while an ingest is writing it. The current index serves the requests until
+        the new one replaces it, with the current feedback scores.
+        """
+        now = time.monotonic()
+        if (
+            self._engine is None
+            or self._reloading
+            or now - self._checked_at < float(config["CACHE_GENERATION_TTL"])
+        ):
+            return
+        self._checked_at = now
+
+        if read_status()["state"] in ("preprocessing", "loading"):
+            return
+
+        try:
+            generation = self._read_generation()
+        except FileNotFoundError:
+            return
+
+        with self._lock:
+            if generation == self._generation or self._reloading:
+                return
+            self._reloading = True
+
+        threading.Thread(
+            target=self._reload, args=(generation,), name="LocalReload", daemon=True
+        ).start()
+
+    def _reload(self, generation: str) -> None:
+        try:
+            engine = LocalSearchEngine.from_file(self.path)
+            engine.set_feedback_scores(self._engine.get_feedback_scores())
+            self._engine, self._generation = engine, generation
+            log.info(f"Reloaded the local index of {self.path}.")
+        except Exception as e:
+            log.error(f"Reloading the local index failed: {e}")
+        finally:
+            self._reloading = False
+
+    @property
+    def engine(self) -> LocalSearchEngine:
+        # Built by the application, or by a script using the backend directly
+        if self._engine is None:
+            return self.load()
+
+        self.refresh()
+        return self._engine
+
+    def get_generation(self, index_name: str) -> str:
+        self.load()
+        self.refresh()
+        return self._generation
+
+    def search(self, search_query: MovieSearchRequest, index_name: str) -> dict:
+        with metrics.stage("local_search"):
+            return self.engine.search(search_query)
+
+    def export(
+        self, search_query: MovieSearchRequest, index_name: str
+    ) -> Iterator[dict]:
+        candidates, _ = self.engine.match(search_query)
+        return (self.engine.documents[i] for i in candidates)
+
+    def get_movie(self, id: str, index_name: str) -> dict:
+        return self.engine.get_movie(id)
+
+    def get_movie_version(self, id: str, index_name: str) -> str:
+        return self.engine.get_movie_version(id)
+
+    def get_genres(self, index_name: str) -> dict:
+        return self.engine.get_genres()
+
+    def get_suggestions(self, index_name: str, query: str) -> dict:
+        return self.engine.get_suggestions(query)
+
+    def update_feedback_scores(self, index_name: str, scores: Dict[str, float]) -> int:
+        return self.engine.set_feedback_scores(scores)
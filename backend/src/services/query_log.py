@@ -0,0 +1,143 @@
+"""Opt-in capture of the search requests, for replaying production traffic.
+
+When `QUERY_LOG_ENABLED` is set, every search is appended as a JSON line to a rotating
+log, apart from the text logs: its time, the non-default fields of the request, the
+number of results and the latency of the search backend. The rotated files are
+compressed with gzip. No client information is recorded, and e-mail addresses and
+long numbers are masked in the search text.
+
+Each worker process writes its own file, `<QUERY_LOG_PATH>.<pid>`, from a background
+thread. `testing/replay.py` replays the logs.
+"""
+
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from typing import Optional
+
+from ..models.movies import MovieSearchRequest
+from ..utils import logconfig
+from ..utils.config import config
+
+# Search texts can carry personal data pasted by the users
+EMAIL = re.compile(r"\S+@\S+")
+LONG_NUMBER = re.compile(r"\d{6,}")
+
+_logger: Optional[logging.Logger] = None
+_logger_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class _Json:
+    """Record formatted as compact JSON when the log line is written."""
+
+    __slots__ = ("record",)
+
+    def __init__(self, record: dict) -> None:
+        self.record = record
+
+    def __str__(self) -> str:
+        return json.dumps(self.record, separators=(",", ":"), default=str)
+
+
+def _get_logger() -> logging.Logger:
+    """Open the query log of the process on first use.
+
+    Returns:
+        logging.Logger: Logger writing the query log.
+    """
+    global _logger, _logger_pid
+
+    # The file of a parent process must not be shared by the workers
+    with _lock:
+        if _logger is None or _logger_pid != os.getpid():
+            path = f"{config['QUERY_LOG_PATH']}.{os.getpid()}"
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+            handler = logging.handlers.RotatingFileHandler(
+                path,
+                maxBytes=int(config["QUERY_LOG_MAX_BYTES"]),
+                backupCount=int(config["QUERY_LOG_BACKUPS"]),
+                encoding="utf8",
+                delay=True,
+            )
+            handler.namer = lambda name: f"{name}.gz"
+            handler.rotator = _gzip_rotator
+            handler.setFormatter(logging.Formatter("%(message)s"))
+
+            logger = logging.getLogger("QueryLog")
+            logger.handlers = [handler]
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.disabled = False
+            if config["LOG_ASYNC"] == "1":
+                logconfig.make_handlers_async([logger])
+
+            _logger = logger
+            _logger_pid = os.getpid()
+
+    return _logger
+
+
+def anonymize(text: Optional[str]) -> Optional[str]:
+    """Mask the e-mail addresses and long numbers of a search text.
+
+    Args:
+        text (Optional[str]): Search text.
+
+    Returns:
+        Optional[str]: Masked search text.
+    """
+    if not text:
+        return text
+
+    return LONG_NUMBER.sub("0", EMAIL.sub("user@example.com", text))
+
+
+def record_search(
+    search_query: MovieSearchRequest,
+    elapsed_ms: float,
+    total: Optional[int] = None,
+    error: bool = False,
+) -> None:
+    """Append a search to the query log, if enabled.
+
+    Args:
+        search_query (MovieSearchRequest): Search request.
+        elapsed_ms (float): Latency of the search backend, in milliseconds.
+        total (Optional[int]): Number of results, None if the search failed.
+        error (bool): Whether the search failed.
+    """
+    if config["QUERY_LOG_ENABLED"] != "1":
+        return
+    if random.random() >= float(config["QUERY_LOG_SAMPLE_RATE"]):
+        return
+
+    request = search_query.model_dump(exclude_defaults=True)
+    if "query" in request:
+        request["query"] = anonymize(request["query"])
+
+    record = {
+        "ts": round(time.time(), 3),
+        "request": request,
+        "total": total,
+        "elapsed_ms": round(elapsed_ms, 1),
+    }
+    if error:
+        record["error"] = True
+
+    # The record is serialized by the log listener thread, off the request path
+    _get_logger().info("%s", _Json(record))
@@ -0,0 +1,151 @@
+"""Pluggable backend of the movie search.
+
+The backend is selected with the `SEARCH_BACKEND` configuration:
+    - `elasticsearch`: queries run on the Elasticsearch cluster.
+    - `local`: queries run on an in-process index built from the cleaned dataset.
+"""
+
+from abc import ABC, abstractmethod
+import re
+from typing import Dict, Iterator, List, Tuple
+
+from ..models.movies import MovieSearchRequest
+from ..utils.config import config
+
+# Weights of the ranking, shared by the backends and tuned offline with `testing/tune.py`
+BOOSTS = {
+    "title": 5,
+    "title_phrase": 10,
+    "synopsis": 1,
+    "synopsis_phrase": 2,
+    "slop": 2,
+    "feedback": 0.2,
+}
+
+# Suggestions match the start of the title, reported to the clients which filter them
+SUGGEST_MATCH = "title"
+
+
+def suggest_key(text: str) -> str:
+    """Normalize a title or a prefix for the suggestions.
+
+    The words are lowercased and split on the spaces and the punctuation, as by the
+    standard analyzer of the completion field: "spider m" matches "Spider-Man".
+
+    Args:
+        text (str): Title or prefix.
+
+    Returns:
+        str: Words of the text, separated by single spaces.
+    """
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+class SearchBackend(ABC):
+    """Interface of the movie search backends.
+
+    The methods return the same dictionaries as the `RC_` controllers and raise on
+    failure.
+    """
+
+    @abstractmethod
+    def search(self, search_query: MovieSearchRequest, index_name: str) -> dict:
+        """Search movies with given filters/sort."""
+        raise NotImplementedError
+
+    def stream_search(
+        self, search_query: MovieSearchRequest, index_name: str
+    ) -> Tuple[int, Iterator[dict]]:
+        """Search movies, returning the total and the documents of the page lazily."""
+        response = self.search(search_query, index_name)
+        return response["total"], iter(response["results"])
+
+    @abstractmethod
+    def export(
+        self, search_query: MovieSearchRequest, index_name: str
+    ) -> Iterator[dict]:
+        """Iterate over all the movies matching the search, in no particular order."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_generation(self, index_name: str) -> str:
+        """Get the generation of the index, which changes when it is rebuilt."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_movie(self, id: str, index_name: str) -> dict:
+        """Get the movies with a specific ID, and their `version` when available."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_movie_version(self, id: str, index_name: str) -> str:
+        """Get the version of the movies with a specific ID, without their documents."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_genres(self, index_name: str) -> dict:
+        """Get all genres."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_suggestions(self, index_name: str, query: str) -> dict:
+        """Get title suggestions for a prefix, and how they `match` it."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_feedback_scores(self, index_name: str, scores: Dict[str, float]) -> int:
+        """Write the feedback scores of movies, returning the number of them updated."""
+        raise NotImplementedError
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Fuse rankings of document ids with reciprocal rank fusion.
+
+    Each document scores `sum(1 / (k + rank))` over the rankings it appears in.
+
+    Args:
+        rankings (List[List[str]]): Document ids, best first, of each ranking.
+        k (int): Constant damping the weight of the top ranks.
+
+    Returns:
+        List[str]: Document ids of all the rankings, best first.
+    """
+    scores: Dict[str, float] = {}
+
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (k + rank)
+
+    return sorted(scores, key=scores.__getitem__, reverse=True)
+
+
+_backend: SearchBackend | None = None
+
+
+def get_search_backend() -> SearchBackend:
+    """Get the configured search backend, created on first use.
+
+    Returns:
+        SearchBackend: The search backend.
+
+    Raises:
+        ValueError: If the configured backend is unknown.
+    """
+    global _backend
+
+    if _backend is None:
+        name = config["SEARCH_BACKEND"]
+
+        # Import lazily, so that the local backend never touches the cluster.
+        if name == "elasticsearch":
+            from .elastic_backend import ElasticsearchBackend
+
+            _backend = ElasticsearchBackend()
+        elif name == "local":
+            from .local_engine import LocalBackend
+
+            _backend = LocalBackend(config["LOCAL_INDEX_PATH"])
+        else:
+            raise ValueError(f"Unknown search backend: {name}")
+
+    return _backend
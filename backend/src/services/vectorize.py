@@ -0,0 +1,200 @@
+"""Dense vectors of the plot synopsis, computed locally with LSA.
+
+The offline stage fits TF-IDF + truncated SVD on the plot synopsis of the cleaned
+dataset, and stores the model and the vectors of the movies as a float32 matrix which
+is memory-mapped when read. Run it with `python -m src.services.vectorize`.
+"""
+
+import logging
+import os
+from typing import Iterable, List
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from ..utils.config import config
+
+log = logging.getLogger(name="MovieApp")
+
+
+class LSAModel:
+    """TF-IDF + truncated SVD embedding of texts."""
+
+    def __init__(self, dims: int = int(config["LSA_DIMS"])) -> None:
+        self.vectorizer = TfidfVectorizer(
+            stop_words="english", sublinear_tf=True, min_df=2, dtype=np.float32
+        )
+        self.svd = TruncatedSVD(n_components=dims, random_state=42)
+
+    @property
+    def dims(self) -> int:
+        return self.svd.n_components
+
+    def fit(self, texts: Iterable[str]) -> "LSAModel":
+        """Fit the model on a corpus."""
+        self.svd.fit(self.vectorizer.fit_transform(texts))
+        return self
+
+    def transform(self, texts: List[str], batch_size: int = 1000) -> np.ndarray:
+        """Embed texts in batches.
+
+        Args:
+            texts (List[str]): Texts to embed.
+            batch_size (int): Number of texts embedded at once.
+
+        Returns:
+            np.ndarray: L2-normalized float32 vectors, one row per text. The vector
+                of a text without any term of the vocabulary is all zeros.
+        """
+        vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start : start + batch_size]
+            vectors[start : start + len(batch)] = self.svd.transform(
+                self.vectorizer.transform(batch)
+            )
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def save(self, path: str) -> None:
+        # The fitted estimators only, a pickled LSAModel would be bound to the module
+        # it was created from, `__main__` when run as a script.
+        joblib.dump(
+            {"tfidf": self.vectorizer, "svd": self.svd, "dims": self.dims}, path
+        )
+
+    @staticmethod
+    def load(path: str) -> "LSAModel":
+        state = joblib.load(path)
+
+        model = LSAModel(state["dims"])
+        model.vectorizer = state["tfidf"]
+        model.svd = state["svd"]
+
+        return model
+
+
+_model: LSAModel | None = None
+
+
+def get_model() -> LSAModel | None:
+    """Get the fitted model, loaded once, or None if the offline stage never ran."""
+    global _model
+
+    if _model is None and os.path.exists(config["LSA_MODEL_PATH"]):
+        _model = LSAModel.load(config["LSA_MODEL_PATH"])
+
+    return _model
+
+
+def vector_dims() -> int:
+    """Get the dimension of the plot vectors, of the fitted model if there is one."""
+    model = get_model()
+    return model.dims if model is not None else int(config["LSA_DIMS"])
+
+
+def embed_query(query: str) -> List[float] | None:
+    """Embed a search query.
+
+    Returns None if no model is available, or if no term of the query is in its
+    vocabulary: the cosine similarity of a zero vector is undefined.
+    """
+    model = get_model()
+    if model is None:
+        return None
+
+    vector = model.transform([query])[0]
+    if not vector.any():
+        return None
+
+    return vector.tolist()
+
+
+def build_vectors(
+    data_path: str = config["CLEANED_DATA_PATH"],
+    model_path: str = config["LSA_MODEL_PATH"],
+    vectors_path: str = config["LSA_VECTORS_PATH"],
+    dims: int = int(config["LSA_DIMS"]),
+) -> None:
+    """Fit the model on a dataset and store the vectors of its movies.
+
+    The vectors are written to a float32 `.npy` matrix, and the movie id of each row
+    to `<vectors_path>.ids.npy`.
+
+    Args:
+        data_path (str): Path to the cleaned dataset.
+        model_path (str): Path to save the model to.
+        vectors_path (str): Path to save the vectors to.
+        dims (int): Dimension of the vectors.
+    """
+    if data_path.endswith(".csv"):
+        df = pd.read_csv(data_path)
+    elif data_path.endswith(".xlsx"):
+        df = pd.read_excel(data_path)
+    else:
+        raise ValueError("File format not supported.")
+
+    texts = df["plot_synopsis"].fillna("").astype(str).tolist()
+
+    log.info(f"Fitting LSA with {dims} dimensions on {len(texts)} plots...")
+    model = LSAModel(dims).fit(texts)
+    model.save(model_path)
+
+    vectors = np.lib.format.open_memmap(
+        vectors_path, mode="w+", dtype=np.float32, shape=(len(texts), dims)
+    )
+    vectors[:] = model.transform(texts)
+    vectors.flush()
+    np.save(f"{vectors_path}.ids.npy", df["id"].to_numpy(dtype=np.int64))
+
+    log.info(f"Saved the plot vectors to {vectors_path}.")
+
+
+def get_plot_vectors(df: pd.DataFrame) -> np.ndarray | None:
+    """Get the vectors of the movies of a dataset.
+
+    The stored vectors are reused for the movies of the offline stage, the new movies
+    are embedded in batches.
+
+    Args:
+        df (pd.DataFrame): Movies, with the `id` and `plot_synopsis` columns.
+
+    Returns:
+        np.ndarray | None: One vector per row, or None if no model is available.
+    """
+    model = get_model()
+    if model is None:
+        return None
+
+    ids = df["id"].to_numpy(dtype=np.int64)
+    vectors = np.zeros((len(df), model.dims), dtype=np.float32)
+    missing = np.ones(len(df), dtype=bool)
+
+    vectors_path = config["LSA_VECTORS_PATH"]
+    if os.path.exists(vectors_path) and os.path.exists(f"{vectors_path}.ids.npy"):
+        stored = np.load(vectors_path, mmap_mode="r")
+        stored_ids = np.load(f"{vectors_path}.ids.npy")
+
+        if len(stored_ids) and stored.shape[1] == model.dims:
+            order = np.argsort(stored_ids, kind="stable")
+            position = np.searchsorted(stored_ids, ids, sorter=order)
+            position = np.minimum(position, len(stored_ids) - 1)
+            rows = order[position]
+            found = stored_ids[rows] == ids
+
+            vectors[found] = stored[rows[found]]
+            missing = ~found
+
+    if missing.any():
+        texts = df["plot_synopsis"].fillna("").astype(str)[missing].tolist()
+        vectors[missing] = model.transform(texts)
+
+    return vectors
+
+
+if __name__ == "__main__":
+    build_vectors()
@@ -0,0 +1,203 @@
+"""Admission control of the requests reaching the search backend.
+
+Each endpoint has its own concurrency limit and wait queue, then all of them share the
+slots of the cluster, which are handed to the waiting requests by priority: the
+interactive searches and suggestions before the details, then the feedback, resets and
+exports. A request finding a full queue, or waiting longer than the timeout, gets a
+`429 Too Many Requests` with a `Retry-After` header.
+
+The limits apply to each worker process. The slots of a streamed response are held
+until its body is sent, see `Admission.defer`.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+from typing import AsyncIterator, Callable, Dict, List
+
+from fastapi import HTTPException
+
+from . import metrics
+from .config import config
+
+# Priority (lowest first), concurrency limit and queue size of each endpoint
+ENDPOINTS = {
+    "search": (0, 8, 32),
+    "suggest": (0, 8, 32),
+    "details": (1, 6, 24),
+    "feedback": (2, 2, 8),
+    "reset": (2, 1, 4),
+    "export": (2, 1, 2),
+}
+
+
+class PriorityLimiter:
+    """Concurrency limit with a bounded wait queue, served by priority then in order.
+
+    The limiter is used from the event loop only, it needs no lock.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, timeout: float) -> None:
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+
+        # Heap of [priority, arrival, future] of the waiting requests
+        self._waiters: List[list] = []
+        self._arrivals = itertools.count()
+
+    def _update_metrics(self) -> None:
+        metrics.ADMISSION_IN_FLIGHT.set(self.active, self.name)
+        metrics.ADMISSION_QUEUE_DEPTH.set(len(self._waiters), self.name)
+
+    async def acquire(self, priority: int = 0) -> bool:
+        """Take a slot, waiting in the queue if none is free.
+
+        Args:
+            priority (int): Priority of the request, the lowest is served first.
+
+        Returns:
+            bool: Whether a slot was taken, False if the request is rejected.
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self._update_metrics()
+            return True
+
+        if len(self._waiters) >= self.max_queue:
+            metrics.ADMISSION_REJECTED.inc(self.name, "queue_full")
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._arrivals), future]
+        heapq.heappush(self._waiters, entry)
+        self._update_metrics()
+
+        try:
+            await asyncio.wait_for(future, self.timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over as the wait ended, pass it on
+                self.release()
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._update_metrics()
+
+            if isinstance(e, asyncio.CancelledError):
+                raise
+
+            metrics.ADMISSION_REJECTED.inc(self.name, "timeout")
+            return False
+
+    def release(self) -> None:
+        """Free a slot, handing it to the first waiting request."""
+        while self._waiters:
+            future = heapq.heappop(self._waiters)[2]
+            if not future.done():
+                future.set_result(None)
+                self._update_metrics()
+                return
+
+        self.active -= 1
+        self._update_metrics()
+
+
+_limiters: Dict[str, PriorityLimiter] = {}
+
+
+def get_limiter(name: str) -> PriorityLimiter:
+    """Get the limiter of an endpoint, or of the cluster, created on first use.
+
+    Args:
+        name (str): Name of the endpoint in `ENDPOINTS`, or `cluster`.
+
+    Returns:
+        PriorityLimiter: The limiter.
+    """
+    if name not in _limiters:
+        timeout = float(config["ADMISSION_QUEUE_TIMEOUT"])
+
+        if name == "cluster":
+            limit = int(config["ADMISSION_MAX_CONCURRENCY"])
+            max_queue = int(config["ADMISSION_MAX_QUEUE"])
+        else:
+            _, limit, max_queue = ENDPOINTS[name]
+
+        _limiters[name] = PriorityLimiter(name, limit, max_queue, timeout)
+
+    return _limiters[name]
+
+
+def reject() -> None:
+    """Reject the request with a `429 Too Many Requests`.
+
+    Raises:
+        HTTPException: Always.
+    """
+    retry_after = math.ceil(float(config["ADMISSION_QUEUE_TIMEOUT"]))
+    raise HTTPException(
+        status_code=429,
+        detail="Too many requests, retry later.",
+        headers={"Retry-After": str(max(retry_after, 1))},
+    )
+
+
+class Admission:
+    """Slots held by an admitted request, released once."""
+
+    def __init__(self) -> None:
+        self._limiters: List[PriorityLimiter] = []
+        self.deferred = False
+
+    def hold(self, limiter: PriorityLimiter) -> None:
+        self._limiters.append(limiter)
+
+    def release(self) -> None:
+        """Free the slots, the last taken first."""
+        while self._limiters:
+            self._limiters.pop().release()
+
+    def defer(self) -> Callable[[], None]:
+        """Keep the slots past the request handler, for a streamed response.
+
+        Returns:
+            Callable[[], None]: Releases the slots, to call once the body is sent.
+        """
+        self.deferred = True
+        return self.release
+
+
+def admit(endpoint: str) -> Callable[[], AsyncIterator[Admission]]:
+    """Build the dependency admitting the requests of an endpoint.
+
+    Args:
+        endpoint (str): Name of the endpoint in `ENDPOINTS`.
+
+    Returns:
+        Callable[[], AsyncIterator[Admission]]: Dependency holding the slots of the
+            request, until the request ends or until released by the response.
+    """
+    priority = ENDPOINTS[endpoint][0]
+
+    async def dependency() -> AsyncIterator[Admission]:
+        admission = Admission()
+
+        try:
+            for limiter in [get_limiter(endpoint), get_limiter("cluster")]:
+                with metrics.stage("queue"):
+                    admitted = await limiter.acquire(priority)
+                if not admitted:
+                    reject()
+                admission.hold(limiter)
+
+            yield admission
+        finally:
+            if not admission.deferred:
+                admission.release()
+
+    return dependency
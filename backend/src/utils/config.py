@@ -8,13 +8,71 @@ config = {
     # Movie dataset
     "DATA_PATH": "src/data/merged_movies_dataset.xlsx",
     "CLEANED_DATA_PATH": "src/data/cleaned.xlsx",
+    # Search backend: "elasticsearch" or "local"
+    "SEARCH_BACKEND": os.getenv("SEARCH_BACKEND") or "elasticsearch",
+    "LOCAL_INDEX_PATH": os.getenv("LOCAL_INDEX_PATH") or "src/data/cleaned.xlsx",
+    # Two-phase search: candidates rescored per shard, 0 to disable
+    "RESCORE_WINDOW": os.getenv("RESCORE_WINDOW") or 0,
+    # Dense vectors of the plot synopsis
+    "LSA_DIMS": os.getenv("LSA_DIMS") or 128,
+    "LSA_MODEL_PATH": os.getenv("LSA_MODEL_PATH") or "src/data/lsa.joblib",
+    "LSA_VECTORS_PATH": os.getenv("LSA_VECTORS_PATH") or "src/data/plot_vectors.npy",
+    "HYBRID_RANK_WINDOW": os.getenv("HYBRID_RANK_WINDOW") or 100,
+    # Background ingest of the dataset, its progress is shared by the workers
+    "INGEST_STATUS_PATH": os.getenv("INGEST_STATUS_PATH")
+    or "src/data/ingest_status.json",
+    # Feedback configuration
+    "FEEDBACK_DB_PATH": os.getenv("FEEDBACK_DB_PATH") or "src/data/feedback.db",
+    "FEEDBACK_HALF_LIFE_DAYS": os.getenv("FEEDBACK_HALF_LIFE_DAYS") or 30,
+    "FEEDBACK_MATERIALIZE_INTERVAL": os.getenv("FEEDBACK_MATERIALIZE_INTERVAL") or 60,
     # API configuration
+    "API_HOST": os.getenv("HOST") or "127.0.0.1",
     "API_PORT": os.getenv("PORT") or 3001,
+    # Worker processes, code reload for development, seconds to finish the requests
+    "API_WORKERS": os.getenv("WORKERS") or 1,
+    "API_RELOAD": os.getenv("RELOAD") or "0",
+    "API_GRACEFUL_TIMEOUT": os.getenv("GRACEFUL_TIMEOUT") or 30,
+    # Admission control: slots of the cluster per worker, waiting requests, max wait (s)
+    "ADMISSION_MAX_CONCURRENCY": os.getenv("ADMISSION_MAX_CONCURRENCY") or 10,
+    "ADMISSION_MAX_QUEUE": os.getenv("ADMISSION_MAX_QUEUE") or 64,
+    "ADMISSION_QUEUE_TIMEOUT": os.getenv("ADMISSION_QUEUE_TIMEOUT") or 2,
+    # HTTP caching: max-age of each route and lifetime of the index generation (seconds)
+    "CACHE_MAX_AGE_GENRES": os.getenv("CACHE_MAX_AGE_GENRES") or 300,
+    "CACHE_MAX_AGE_SUGGEST": os.getenv("CACHE_MAX_AGE_SUGGEST") or 60,
+    "CACHE_MAX_AGE_MOVIE": os.getenv("CACHE_MAX_AGE_MOVIE") or 30,
+    "CACHE_GENERATION_TTL": os.getenv("CACHE_GENERATION_TTL") or 5,
     # Elasticsearch configuration
     "ES_HOST": os.getenv("ELASTICSEARCH_HOST") or "localhost",
     "ES_PORT": os.getenv("ELASTICSEARCH_PORT") or "9200",
     "ES_CLIENT": os.getenv("ELASTICSEARCH_CLIENT"),
     "ES_PASSWORD": os.getenv("ELASTICSEARCH_PASSWORD"),
+    "ES_SCHEME": os.getenv("ELASTICSEARCH_SCHEME") or "http",
+    # Comma-separated node URLs, replaces ES_HOST and ES_PORT when set
+    "ES_HOSTS": os.getenv("ELASTICSEARCH_HOSTS"),
+    "ES_POOL_SIZE": os.getenv("ELASTICSEARCH_POOL_SIZE") or 10,
+    "ES_MAX_RETRIES": os.getenv("ELASTICSEARCH_MAX_RETRIES") or 3,
+    "ES_SNIFF": os.getenv("ELASTICSEARCH_SNIFF") or "0",
+    "ES_REFRESH_INTERVAL": os.getenv("ELASTICSEARCH_REFRESH_INTERVAL") or "1s",
+    # Index sorting (1/0): the index is sorted by popularity, a companion index by
+    # release date, and the sorted searches count their hits up to the cap
+    "ES_INDEX_SORT": os.getenv("ELASTICSEARCH_INDEX_SORT") or "1",
+    "ES_TRACK_TOTAL_HITS": os.getenv("ELASTICSEARCH_TRACK_TOTAL_HITS") or 1000,
+    # Request timeouts per type of operation, in seconds
+    "ES_TIMEOUT_SEARCH": os.getenv("ELASTICSEARCH_TIMEOUT_SEARCH") or 5,
+    "ES_TIMEOUT_SUGGEST": os.getenv("ELASTICSEARCH_TIMEOUT_SUGGEST") or 1,
+    "ES_TIMEOUT_UPDATE": os.getenv("ELASTICSEARCH_TIMEOUT_UPDATE") or 10,
+    "ES_TIMEOUT_BULK": os.getenv("ELASTICSEARCH_TIMEOUT_BULK") or 60,
+    "ES_TIMEOUT_ADMIN": os.getenv("ELASTICSEARCH_TIMEOUT_ADMIN") or 30,
+    # Logging: logs written from background threads (1/0), share of the searches whose
+    # hit scores are logged
+    "LOG_ASYNC": os.getenv("LOG_ASYNC") or "1",
+    "LOG_SCORE_SAMPLE_RATE": os.getenv("LOG_SCORE_SAMPLE_RATE") or 0.01,
+    # Query log of the searches, for replays: opt-in (1/0), file, rotation, sampling
+    "QUERY_LOG_ENABLED": os.getenv("QUERY_LOG_ENABLED") or "0",
+    "QUERY_LOG_PATH": os.getenv("QUERY_LOG_PATH") or "src/data/query_log/queries.jsonl",
+    "QUERY_LOG_MAX_BYTES": os.getenv("QUERY_LOG_MAX_BYTES") or 10485760,
+    "QUERY_LOG_BACKUPS": os.getenv("QUERY_LOG_BACKUPS") or 20,
+    "QUERY_LOG_SAMPLE_RATE": os.getenv("QUERY_LOG_SAMPLE_RATE") or 1,
     # MongoDB configuration
     "MONGODB_URI": os.getenv("MONGODB_URI"),
     "MONGODB_USERNAME": os.getenv("MONGODB_USERNAME"),
@@ -0,0 +1,84 @@
+"""HTTP caching with ETags and conditional requests.
+
+The ETags are derived from the generation of the index, and from the version of the
+documents for the movie details, and include a digest of the request parameters which
+select the content. A client sending a matching `If-None-Match` header
+gets a `304 Not Modified` without a body.
+"""
+
+import hashlib
+
+from fastapi import Request, Response
+
+from . import metrics
+
+
+def make_etag(*parts: str) -> str:
+    """Build a weak ETag from its non-empty parts.
+
+    Args:
+        *parts (str): Parts identifying the version of the content.
+
+    Returns:
+        str: ETag.
+    """
+    return 'W/"' + "-".join(str(part) for part in parts if part) + '"'
+
+
+def digest(text: str) -> str:
+    """Get a short digest of a text, safe to include in an ETag.
+
+    Args:
+        text (str): Text, such as a request parameter.
+
+    Returns:
+        str: Hexadecimal digest.
+    """
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def cache_headers(etag: str, max_age: int) -> dict:
+    """Get the caching headers of a response.
+
+    Args:
+        etag (str): ETag of the content.
+        max_age (int): Seconds the response can be reused without revalidation.
+
+    Returns:
+        dict: Response headers.
+    """
+    return {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+
+
+def is_not_modified(request: Request, etag: str, cache: str) -> bool:
+    """Check whether the client already has the content, and count the lookup.
+
+    Args:
+        request (Request): Request, with its `If-None-Match` header.
+        etag (str): ETag of the current content.
+        cache (str): Name of the cache in the metrics.
+
+    Returns:
+        bool: Whether the ETag matches one of the client.
+    """
+    tags = {
+        tag.strip().removeprefix("W/")
+        for tag in request.headers.get("if-none-match", "").split(",")
+    }
+    matched = "*" in tags or etag.removeprefix("W/") in tags
+
+    metrics.CACHE_REQUESTS.inc(cache, "hit" if matched else "miss")
+    return matched
+
+
+def not_modified(etag: str, max_age: int) -> Response:
+    """Build a `304 Not Modified` response.
+
+    Args:
+        etag (str): ETag of the content.
+        max_age (int): Seconds the response can be reused without revalidation.
+
+    Returns:
+        Response: Empty response with the caching headers.
+    """
+    return Response(status_code=304, headers=cache_headers(etag, max_age))
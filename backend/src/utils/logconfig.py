@@ -6,11 +6,16 @@ the project or site requirements.
 """
 
 import os
+import copy
 import json
+import atexit
 import logging.config
+import logging.handlers
 import getpass
+import queue
 import threading
 
+from .config import config
 
 default_config = {
     "version": 1,
@@ -34,7 +39,7 @@ default_config = {
         "local_file_handler": {
             "class": "logging.handlers.RotatingFileHandler",
             #  "class": "logging.handlers.FileHandler",
-            "level": "DEBUG",
+            "level": "INFO",
             "formatter": "extended",
             "filename": "debug.log",
             "maxBytes": 1048576,
@@ -60,6 +65,8 @@ default_config = {
         # Fine-grained logging configuration for individual modules or classes
         # Use this to set different log levels without changing 'real' code.
         "MovieApp": {"level": "INFO", "propagate": True, "handlers": ["console"]},
+        # The server logs, uvicorn leaves their configuration to the application
+        "uvicorn": {"level": "INFO", "propagate": False, "handlers": ["console"]},
     },
     "root": {
         # Set the level here to be the default minimum level of log record to be produced
@@ -81,8 +88,75 @@ class ThreadContextFilter(logging.Filter):
         return True
 
 
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """A queue handler which leaves the formatting of the records to the listener.
+
+    The standard QueueHandler formats the message in the calling thread, this one
+    only enqueues the record so that logging costs a queue put on the hot path.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+# Listeners of the queues created by `setup_logging`
+_listeners = []
+
+
+def make_handlers_async(loggers):
+    """Move the handlers of the loggers behind queues, served by listener threads.
+
+    Args:
+        loggers (list[logging.Logger]): Loggers whose handlers should not block.
+    """
+    for logger in loggers:
+        if not logger.handlers:
+            continue
+
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            log_queue, *logger.handlers, respect_handler_level=True
+        )
+        logger.handlers = [LazyQueueHandler(log_queue)]
+        listener.start()
+        _listeners.append(listener)
+
+
+def stop_async_handlers():
+    """Flush the queues and stop the listener threads."""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(stop_async_handlers)
+
+
+def per_process_files(dict_config):
+    """Suffix the files of the handlers with the pid of the process, `<filename>.<pid>`.
+
+    Each worker process rotates its own file, the rotations of a shared file would
+    rename it under the other workers.
+
+    Args:
+        dict_config (dict): Logging configuration.
+
+    Returns:
+        dict: Copy of the configuration, with the suffixed file names.
+    """
+    dict_config = copy.deepcopy(dict_config)
+    for handler in dict_config.get("handlers", {}).values():
+        if "filename" in handler:
+            handler["filename"] = f"{handler['filename']}.{os.getpid()}"
+
+    return dict_config
+
+
 def setup_logging(
-    default_log_config=None, default_level=logging.INFO, env_key="LOG_CFG"
+    default_log_config=None,
+    default_level=logging.INFO,
+    env_key="LOG_CFG",
+    async_handlers=config["LOG_ASYNC"] == "1",
+    per_process=int(config["API_WORKERS"]) > 1,
 ):
     """Setup logging configuration
 
@@ -102,6 +176,10 @@ def setup_logging(
             a path to a configuration file.
         default_level (int): logging level to set as default. Ignored if a log
             configuration is found elsewhere.
+        async_handlers (bool): Write the logs from background threads, so that
+            logging never blocks the caller. Defaults to the `LOG_ASYNC` configuration.
+        per_process (bool): Write the log files of each process apart, see
+            `per_process_files`. Defaults to whether several workers are configured.
 
     Returns: None
     """
@@ -121,7 +199,18 @@ def setup_logging(
         if file_config is not None:
             dict_config = file_config
 
+    if dict_config is not None and per_process:
+        dict_config = per_process_files(dict_config)
+
+    stop_async_handlers()
+
     if dict_config is not None:
         logging.config.dictConfig(dict_config)
     else:
         logging.basicConfig(level=default_level)
+
+    if async_handlers:
+        loggers = [logging.getLogger()] + [
+            logging.getLogger(name) for name in (dict_config or {}).get("loggers", {})
+        ]
+        make_handlers_async(loggers)
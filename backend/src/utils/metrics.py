@@ -0,0 +1,326 @@
+"""In-process metrics, exposed in the Prometheus text format.
+
+The metrics are kept in memory by each worker, and `/metrics` renders those of the
+worker answering the request, without aggregating the other workers:
+    - `http_request_duration_seconds`: latency of each route.
+    - `http_requests_total`: requests of each route, by status code.
+    - `http_request_errors_total`: requests of each route answered with an error.
+    - `stage_duration_seconds`: latency of each stage of a request (queue, parse,
+      build_query, elasticsearch, extract, encode), recorded with `stage()`.
+    - `elasticsearch_took_seconds` / `elasticsearch_wall_seconds`: time spent in
+      Elasticsearch, as reported by `took` and as measured by the client.
+    - `cache_requests_total`: cache lookups, by cache and result (hit or miss).
+    - `admission_in_flight` / `admission_queue_depth`: requests admitted and waiting
+      in each admission limiter, `admission_rejected_total`: requests rejected.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from fastapi.responses import JSONResponse
+
+# Default latency buckets, in seconds
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+registry: List["Metric"] = []
+
+
+class Metric:
+    """Base class of the metrics, with one value per combination of labels."""
+
+    type = ""
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...]) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _format_labels(self, values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [
+            f'{label}="{_escape(value)}"' for label, value in zip(self.labels, values)
+        ]
+        if extra:
+            pairs.append(extra)
+
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join(
+            [
+                f"# HELP {self.name} {self.description}",
+                f"# TYPE {self.name} {self.type}",
+                *self.samples(),
+            ]
+        )
+
+
+class Counter(Metric):
+    """Monotonic counter."""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+
+        return [
+            f"{self.name}{self._format_labels(labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Gauge(Metric):
+    """Value which goes up and down."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+
+        return [
+            f"{self.name}{self._format_labels(labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Histogram(Metric):
+    """Histogram of observations, with cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        # Counts of each bucket (not cumulative), then +Inf, then the sum
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+
+        lines = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = self._format_labels(labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {counts[-1]}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+    """Render all the metrics in the Prometheus text format."""
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Latency of the requests.", ("route", "method")
+)
+REQUESTS = Counter(
+    "http_requests_total", "Requests answered.", ("route", "method", "status")
+)
+ERRORS = Counter(
+    "http_request_errors_total", "Requests answered with an error.", ("route",)
+)
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds",
+    "Latency of the stages of the requests.",
+    ("route", "stage"),
+)
+ES_TOOK_SECONDS = Histogram(
+    "elasticsearch_took_seconds",
+    "Time spent in Elasticsearch, as reported by took.",
+    ("operation",),
+)
+ES_WALL_SECONDS = Histogram(
+    "elasticsearch_wall_seconds",
+    "Time spent waiting for Elasticsearch, as measured by the client.",
+    ("operation",),
+)
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups.", ("cache", "result"))
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight", "Requests holding a slot of the limiter.", ("limiter",)
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth", "Requests waiting for a slot of the limiter.", ("limiter",)
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Requests rejected by the limiter, because its queue was full or on timeout.",
+    ("limiter", "reason"),
+)
+
+
+# Start time and stage durations of the current request
+_request: ContextVar[Tuple[float, Dict[str, float]] | None] = ContextVar(
+    "request_metrics", default=None
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage of the current request.
+
+    Args:
+        name (str): Name of the stage.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """Record the duration of a stage of the current request."""
+    request = _request.get()
+    if request is not None:
+        stages = request[1]
+        stages[name] = stages.get(name, 0) + seconds
+
+
+def record_since_start(name: str, exclude: Tuple[str, ...] = ()) -> None:
+    """Record the time since the start of the current request as a stage.
+
+    Args:
+        name (str): Name of the stage.
+        exclude (Tuple[str, ...]): Stages recorded meanwhile, left out of the time.
+    """
+    request = _request.get()
+    if request is not None:
+        started, stages = request
+        excluded = sum(stages.get(other, 0) for other in exclude)
+        record_stage(name, time.perf_counter() - started - excluded)
+
+
+def record_elasticsearch(operation: str, took_ms: float, wall_seconds: float) -> None:
+    """Record the `took` and the wall time of an Elasticsearch request."""
+    ES_TOOK_SECONDS.observe(took_ms / 1000, operation)
+    ES_WALL_SECONDS.observe(wall_seconds, operation)
+
+
+def _route_template(scope) -> str:
+    """Get the route template of a request, to bound the cardinality of the labels.
+
+    The path parameters are replaced by their names, e.g. `/movies/{id}`.
+    """
+    if "endpoint" not in scope:
+        return "<unmatched>"
+
+    names = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join(
+        f"{{{names[segment]}}}" if segment in names else segment
+        for segment in scope["path"].split("/")
+    )
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency and the stages of each request."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        stages: Dict[str, float] = {}
+        token = _request.set((started, stages))
+        status = [500]
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request.reset(token)
+
+            route = _route_template(scope)
+            method = scope["method"]
+
+            REQUEST_SECONDS.observe(time.perf_counter() - started, route, method)
+            REQUESTS.inc(route, method, str(status[0]))
+            if status[0] >= 400:
+                ERRORS.inc(route)
+
+            for name, seconds in stages.items():
+                STAGE_SECONDS.observe(seconds, route, name)
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSON response recording its encoding as the `encode` stage."""
+
+    def render(self, content: Any) -> bytes:
+        with stage("encode"):
+            return super().render(content)
@@ -0,0 +1,74 @@
+"""Response classes encoding JSON with orjson.
+
+    - `ORJSONResponse`: JSON response, its encoding recorded as the `encode` stage.
+    - `NDJSONResponse`: streamed response with one JSON document per line.
+"""
+
+from typing import Any, Callable, Iterable, Iterator
+
+from fastapi.responses import JSONResponse, StreamingResponse
+import orjson
+
+from .metrics import stage
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded with orjson.
+
+    Returning an instance from a route skips the `jsonable_encoder` pass of FastAPI,
+    which is only needed for non-JSON types such as models and dates.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with stage("encode"):
+            return orjson.dumps(content, option=OPTIONS)
+
+
+def ndjson_lines(documents: Iterable[Any], batch_size: int = 100) -> Iterator[bytes]:
+    """Encode documents as JSON lines, in chunks of `batch_size` lines.
+
+    Args:
+        documents (Iterable[Any]): Documents to encode.
+        batch_size (int): Number of lines per chunk.
+
+    Returns:
+        Iterator[bytes]: Chunks of the response body.
+    """
+    batch = []
+    for document in documents:
+        batch.append(orjson.dumps(document, option=OPTIONS))
+        if len(batch) == batch_size:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+
+    if batch:
+        yield b"\n".join(batch) + b"\n"
+
+
+class NDJSONResponse(StreamingResponse):
+    """Response streaming documents as newline-delimited JSON.
+
+    The documents are read and encoded while the response is sent, in a threadpool
+    when they come from a regular iterator. `on_close` is called once the body is
+    sent, or once the client is gone.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def __init__(
+        self,
+        documents: Iterable[Any],
+        on_close: Callable[[], None] | None = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(ndjson_lines(documents), **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                self.on_close()
@@ -1,7 +1,14 @@
 import streamlit as st
 from streamlit_searchbox import st_searchbox
 from st_keyup import st_keyup
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import unicodedata
 
 api_url = "https://fleet-massive-monkey.ngrok-free.app"
@@ -9,10 +16,50 @@ image_url = "https://image.tmdb.org/t/p/w600_and_h900_bestv2"
 movie_url = "https://www.themoviedb.org/movie"
 year_range = (1900, 2100)
 
+# Seconds the API responses are reused, as the max-age of the API
+genres_ttl = 300
+suggestions_ttl = 60
+details_ttl = 30
+
+# Suggestions returned by the API, prefixes kept per user, keystroke debounce (ms)
+suggestions_size = 10
+suggestions_cache_size = 256
+suggestions_debounce = 300
+
+# Movie details fetched at once when rendering the results, movie details kept
+details_workers = 8
+details_cache_size = 1000
+
+
+@st.cache_resource
+def get_session():
+    # Shared by the reruns and the users, so the connections to the API are reused
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.2, allowed_methods=["GET"]),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@st.cache_resource
+def get_executor():
+    # Bounded pool shared by the users, within the connection pool of the session
+    return ThreadPoolExecutor(max_workers=details_workers)
+
+
+@st.cache_resource
+def get_details_cache():
+    # Movie details shared by the users, only read and written by the script threads
+    return OrderedDict(), threading.Lock()
+
 
 def get_response(endpoint, params=None):
     try:
-        response = requests.get(f"{api_url}/{endpoint}", params=params)
+        response = get_session().get(f"{api_url}/{endpoint}", params=params, timeout=10)
         return response.json()
     except:
         st.error("Failed to connect to the API.")
@@ -20,21 +67,80 @@ def get_response(endpoint, params=None):
 
 def post_response(endpoint, params=None, data=None):
     try:
-        response = requests.post(f"{api_url}/{endpoint}", params=params, json=data)
+        response = get_session().post(
+            f"{api_url}/{endpoint}", params=params, json=data, timeout=10
+        )
         return response.json()
     except:
         st.error("Failed to connect to the API.")
 
 
+@st.cache_data(ttl=genres_ttl, show_spinner=False)
 def get_all_genres():
     response = get_response("movies/genres")
     return response["genres"]
 
 
+@st.cache_data(ttl=suggestions_ttl, max_entries=1000, show_spinner=False)
+def fetch_suggestions(query):
+    response = get_response("movies/suggest", {"query": query})
+    # How the API matches the prefix, "title" by default: the start of the title
+    return response["suggestions"], response.get("match", "title")
+
+
+def suggestion_words(text):
+    # Lowercased and split on the spaces and the punctuation, as the API analyzes it
+    return re.findall(r"\w+", text.lower())
+
+
+def suggestion_matches(title, prefix, match):
+    # Same matching as the API, or the locally filtered suggestions would differ:
+    # the start of the title, or with "word" the start of any of its words
+    words = suggestion_words(title)
+    key = " ".join(suggestion_words(prefix))
+    starts = range(len(words)) if match == "word" else range(1)
+    return any(" ".join(words[start:]).startswith(key) for start in starts)
+
+
+def get_prefix_suggestions(prefix):
+    cache = st.session_state.suggestions
+    now = time.monotonic()
+
+    if prefix in cache and now - cache[prefix][0] < suggestions_ttl:
+        cache.move_to_end(prefix)
+        return list(cache[prefix][1])
+
+    # A shorter prefix with less than a full page of suggestions had all its matches,
+    # those of the longer prefix are among them
+    for end in range(len(prefix) - 1, 0, -1):
+        shorter = cache.get(prefix[:end])
+        if (
+            shorter
+            and now - shorter[0] < suggestions_ttl
+            and len(shorter[1]) < suggestions_size
+        ):
+            match = shorter[2]
+            suggestions = [
+                t for t in shorter[1] if suggestion_matches(t, prefix, match)
+            ]
+            break
+    else:
+        suggestions, match = fetch_suggestions(prefix)
+
+    cache[prefix] = (now, suggestions, match)
+    cache.move_to_end(prefix)
+    if len(cache) > suggestions_cache_size:
+        cache.popitem(last=False)
+
+    return list(suggestions)
+
+
 def get_suggestions(query):
+    query = query or ""
+    prefix = query.strip().lower()
+
     try:
-        response = get_response("movies/suggest", {"query": query})
-        response = response["suggestions"]
+        response = get_prefix_suggestions(prefix) if prefix else []
     except:
         response = []
 
@@ -73,8 +179,37 @@ def search_movies():
     return (response["total"], [result["id"] for result in response["results"]])
 
 
+def fetch_movie_details(id):
+    # Runs in the pool threads, which have no script context: no Streamlit calls
+    response = get_session().get(f"{api_url}/movies/{id}", timeout=10)
+    response.raise_for_status()
+    return response.json()["results"][0]
+
+
+def get_cached_details(id):
+    cache, lock = get_details_cache()
+    with lock:
+        entry = cache.get(id)
+        if entry and time.monotonic() - entry[0] < details_ttl:
+            cache.move_to_end(id)
+            return entry[1]
+
+
+def set_cached_details(id, details):
+    cache, lock = get_details_cache()
+    with lock:
+        cache[id] = (time.monotonic(), details)
+        cache.move_to_end(id)
+        if len(cache) > details_cache_size:
+            cache.popitem(last=False)
+
+
 def get_movie_details(id):
-    return get_response(f"movies/{id}")["results"][0]
+    details = get_cached_details(id)
+    if details is None:
+        details = fetch_movie_details(id)
+        set_cached_details(id, details)
+    return details
 
 
 def set_movie_like(id, like):
@@ -109,6 +244,7 @@ def init():
         st.session_state.page = 1
         st.session_state.results = None
         st.session_state.score = {}
+        st.session_state.suggestions = OrderedDict()
         st.session_state.init = True
 
 
@@ -155,12 +291,15 @@ def run():
             get_suggestions,
             label="Query",
             placeholder="Search text for the movie (e.g., title, plot)",
+            debounce=suggestions_debounce,
         )
     else:
         col1, col2 = st.columns([1, 1])
         with col1:
             query = st_keyup(
-                "Query", placeholder="Search text for the movie (e.g., title, plot)"
+                "Query",
+                placeholder="Search text for the movie (e.g., title, plot)",
+                debounce=suggestions_debounce,
             )
         with col2:
             query = st.selectbox(
@@ -216,8 +355,27 @@ def run():
 
     st.success(f"Found {st.session_state.results[0]} results for {searched}.")
 
-    for i, id in enumerate(st.session_state.results[1]):
-        result = get_movie_details(id)
+    # Fetch the details of the results not cached concurrently, each card is rendered
+    # as soon as its details and those of the cards above it have arrived. The cache
+    # and the errors are handled here, on the script thread.
+    ids = st.session_state.results[1]
+    details = {id: get_cached_details(id) for id in ids}
+    futures = {
+        id: get_executor().submit(fetch_movie_details, id)
+        for id in ids
+        if details[id] is None
+    }
+
+    for i, id in enumerate(ids):
+        result = details[id]
+        if result is None:
+            try:
+                result = futures[id].result()
+            except:
+                st.error(f"Failed to load the details of result #{i + 1}.")
+                continue
+            set_cached_details(id, result)
+
         with st.expander(
             f"**Result #{i + 1}: {result['title']} ({result['release_date'][:4]}) | Average Rating: {float(result['vote_average']):.2f}**",
             expanded=True,
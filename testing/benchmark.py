@@ -0,0 +1,285 @@
+"""Relevance and latency benchmark of the search, with regression baselines.
+
+For each bucket of query length, reports the MRR, P@k, nDCG@k and the p50/p99 latency
+of the searches of `test_data.xlsx`. The results can be saved as a JSON baseline, and
+compared to one: the run fails when the relevance drops or the latency grows past the
+thresholds.
+
+    python benchmark.py --save-baseline main
+    python benchmark.py --compare main
+
+The queries are the keywords and the plot queries truncated to each of `--max-words`.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+
+from evaluate import precision_at_k, truncate
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Version of the baseline format
+BASELINE_VERSION = 1
+
+RELEVANCE_METRICS = ["mrr", "precision", "ndcg"]
+LATENCY_METRICS = ["p50_ms", "p99_ms"]
+
+
+def build_queries(data, max_words):
+    """Build the (query, title) pairs: the keywords, then the truncated plot queries."""
+    pairs = [
+        (keywords, title)
+        for keywords, title in zip(data["keywords"], data["title"])
+        if isinstance(keywords, str) and keywords.strip()
+    ]
+
+    for words in max_words:
+        pairs += [
+            (truncate(query, words), title)
+            for query, title in zip(data["query"], data["title"])
+            if isinstance(query, str) and len(query) >= 10
+        ]
+
+    return pairs
+
+
+async def run_searches(queries, url, concurrency, k):
+    """Run the searches, timing each of them.
+
+    Returns:
+        list: Results and latency (seconds) of each query.
+    """
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+
+        async def search(query):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(
+                    "/movies/search", params={"query": query, "size": k}
+                )
+                latency = time.perf_counter() - started
+                response.raise_for_status()
+                return response.json()["results"], latency
+
+        # Warm up the caches of the API and the cluster
+        for query in queries[:10]:
+            await search(query)
+
+        return await asyncio.gather(*[search(query) for query in queries])
+
+
+def score(results, title, k):
+    """Score the results of a query whose target is the movie `title`."""
+    titles = [item["title"] for item in results[:k]]
+    rank = (titles.index(title) + 1) if title in titles else 0
+
+    return {
+        "mrr": 1 / rank if rank else 0.0,
+        "precision": precision_at_k(results, title, k),
+        # A single relevant movie, so the ideal DCG is 1
+        "ndcg": 1 / np.log2(rank + 1) if rank else 0.0,
+    }
+
+
+def summarize(rows):
+    latencies = np.array([row["latency"] for row in rows])
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+
+    summary = {"queries": len(rows)}
+    for metric in RELEVANCE_METRICS:
+        summary[metric] = float(np.mean([row[metric] for row in rows]))
+    summary["p50_ms"] = float(p50)
+    summary["p99_ms"] = float(p99)
+
+    return summary
+
+
+def benchmark(pairs, url, concurrency, k, bins):
+    searches = asyncio.run(
+        run_searches([query for query, _ in pairs], url, concurrency, k)
+    )
+
+    rows = []
+    for (query, title), (results, latency) in zip(pairs, searches):
+        rows.append(
+            {
+                "words": len(query.split()),
+                "latency": latency,
+                **score(results, title, k),
+            }
+        )
+
+    buckets = {}
+    for low, high in zip(bins[:-1], bins[1:]):
+        bucket = [row for row in rows if low <= row["words"] < high]
+        if bucket:
+            buckets[f"{low}-{high - 1} words"] = summarize(bucket)
+
+    return {"overall": summarize(rows), "buckets": buckets}
+
+
+def print_report(report):
+    columns = ["queries", *RELEVANCE_METRICS, *LATENCY_METRICS]
+    print(f"{'bucket':<14}" + "".join(f"{column:>11}" for column in columns))
+
+    for name, summary in [*report["buckets"].items(), ("overall", report["overall"])]:
+        values = [f"{summary['queries']:>11}"] + [
+            f"{summary[c]:>11.3f}" for c in columns[1:]
+        ]
+        print(f"{name:<14}" + "".join(values))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, max_relevance_drop, max_latency_increase):
+    """Compare a report to a baseline.
+
+    Returns:
+        list: Description of each regression.
+    """
+    regressions = []
+
+    for name, summary in [*report["buckets"].items(), ("overall", report["overall"])]:
+        reference = (
+            baseline["overall"] if name == "overall" else baseline["buckets"].get(name)
+        )
+        if reference is None:
+            continue
+
+        for metric in RELEVANCE_METRICS:
+            if summary[metric] < reference[metric] - max_relevance_drop:
+                regressions.append(
+                    f"{name}: {metric} {reference[metric]:.3f} -> {summary[metric]:.3f}"
+                )
+
+        for metric in LATENCY_METRICS:
+            if summary[metric] > reference[metric] * (1 + max_latency_increase):
+                regressions.append(
+                    f"{name}: {metric} {reference[metric]:.1f} -> {summary[metric]:.1f}"
+                )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--url", default="http://127.0.0.1:3001", help="URL of the API."
+    )
+    parser.add_argument(
+        "--data", default="test_data.xlsx", help="Test data with queries and titles."
+    )
+    parser.add_argument("--k", type=int, default=10, help="Results scored per query.")
+    parser.add_argument(
+        "--max-words",
+        type=int,
+        nargs="+",
+        default=[3, 5, 8],
+        help="Truncation lengths of the plot queries.",
+    )
+    parser.add_argument(
+        "--bins",
+        type=int,
+        nargs="+",
+        default=[1, 3, 5, 8, 1000],
+        help="Bounds of the query length buckets, in words.",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="Concurrent searches."
+    )
+    parser.add_argument(
+        "--save-baseline", metavar="NAME", help="Save the results as a baseline."
+    )
+    parser.add_argument(
+        "--compare", metavar="NAME", help="Fail on a regression from this baseline."
+    )
+    parser.add_argument(
+        "--max-relevance-drop",
+        type=float,
+        default=0.02,
+        help="Tolerated absolute drop of MRR, P@k and nDCG.",
+    )
+    parser.add_argument(
+        "--max-latency-increase",
+        type=float,
+        default=0.2,
+        help="Tolerated relative increase of the p50 and p99 latency.",
+    )
+    args = parser.parse_args()
+
+    pairs = build_queries(pd.read_excel(args.data), args.max_words)
+    print(f"Benchmarking {len(pairs)} queries against {args.url}...")
+
+    report = benchmark(pairs, args.url, args.concurrency, args.k, args.bins)
+    report["settings"] = {
+        "k": args.k,
+        "max_words": args.max_words,
+        "bins": args.bins,
+        "concurrency": args.concurrency,
+        "data": os.path.basename(args.data),
+    }
+    print_report(report)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        baseline = {
+            "version": BASELINE_VERSION,
+            "commit": git_commit(),
+            "created_at": time.time(),
+            **report,
+        }
+        with open(path, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline saved to {path}")
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+
+        if baseline.get("version") != BASELINE_VERSION:
+            sys.exit(
+                f"Baseline {args.compare} has version {baseline.get('version')}, expected {BASELINE_VERSION}."
+            )
+        if baseline["settings"] != report["settings"]:
+            print(
+                f"Warning: the settings differ from the baseline: {baseline['settings']}"
+            )
+
+        regressions = compare(
+            report, baseline, args.max_relevance_drop, args.max_latency_increase
+        )
+        if regressions:
+            print("Regressions from the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+        print(
+            f"No regression from the baseline {args.compare} (commit {baseline.get('commit')})."
+        )
+
+
+if __name__ == "__main__":
+    main()
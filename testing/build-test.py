@@ -1,18 +1,36 @@
 
 import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import google.generativeai as genai
 import pandas as pd
 from openpyxl import Workbook, load_workbook
 import time
 import spacy
 
+# Parts of speech kept as keywords (nouns, proper nouns, adjectives)
+KEYWORD_POS = {"NOUN", "PROPN", "ADJ"}
+
+_nlp = None
+
+def get_nlp():
+    """Load the spaCy pipeline once, without the components POS tagging does not need."""
+    global _nlp
+    if _nlp is None:
+        _nlp = spacy.load("en_core_web_sm", exclude=["parser", "ner", "lemmatizer"])
+    return _nlp
+
+def keywords_of(doc):
+    return ' '.join([token.text for token in doc if token.pos_ in KEYWORD_POS])
+
 def extract_keywords(text):
-    nlp = spacy.load("en_core_web_sm")
-    doc = nlp(text)
+    return keywords_of(get_nlp()(text))
 
-    # Extract keywords (nouns, proper nouns, adjectives)
-    keywords = ' '.join([token.text for token in doc if token.pos_ in ["NOUN", "PROPN", "ADJ"]])
-    return keywords
+def extract_keywords_batch(texts, batch_size=256, n_process=1):
+    """Extract the keywords of many texts, in batches and optionally on several processes."""
+    docs = get_nlp().pipe(texts, batch_size=batch_size, n_process=n_process)
+    return [keywords_of(doc) for doc in docs]
 
 genai.configure(api_key="NOTHING_TO_SEE_HERE")
 
@@ -52,25 +70,83 @@ def summarize_plot(plot, max_length=50, max_retries=5):
     prompt = "Provide one plot point in the following synopsis in one sentence. Use only the words in the synopsis. Avoid offensive phrasing."
     sanitized_plot = sanitize_text(plot)
 
-    try:
-        response = model.generate_content([prompt, sanitized_plot])
-        return response.text  # Adjust based on API response
-    except Exception as e:
-        if "PROHIBITED_CONTENT" in str(e):
-            print(f"Blocked prompt detected. Skipping plot: {e}")
-            return None
-        
-        if "429 Resource has been exhausted" in str(e):
-            print("API rate limit reached. Please wait before retrying.")
-            time.sleep(20)
-
-        if max_retries > 0:
-            print(f"Retrying to summarize plot. {max_retries} retries left.")
-            time.sleep(1)
-            return summarize_plot(plot, max_length, max_retries - 1)
-        print(f"Failed to summarize plot: {e}")
-
-        return None
+    for attempt in range(max_retries + 1):
+        try:
+            response = model.generate_content([prompt, sanitized_plot])
+            return response.text  # Adjust based on API response
+        except Exception as e:
+            if "PROHIBITED_CONTENT" in str(e):
+                print(f"Blocked prompt detected. Skipping plot: {e}")
+                return None
+
+            if attempt == max_retries:
+                print(f"Failed to summarize plot: {e}")
+                return None
+
+            # Back off exponentially, longer when the quota is exhausted
+            delay = 2 ** attempt
+            if "429 Resource has been exhausted" in str(e):
+                print("API rate limit reached. Please wait before retrying.")
+                delay = max(delay, 20)
+
+            print(f"Retrying to summarize plot. {max_retries - attempt} retries left.")
+            time.sleep(delay)
+
+
+class GeminiClient:
+    """Summarizes the plots with the Gemini model."""
+
+    def summarize(self, plot):
+        return summarize_plot(plot)
+
+
+class StubClient:
+    """Stands in for the LLM without any API call: the first sentence of the plot."""
+
+    def summarize(self, plot):
+        return sanitize_text(plot).split(". ")[0].strip()[:300] or None
+
+
+class TokenBucket:
+    """Rate limiter allowing `rate` calls per second, with bursts of `capacity` calls."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def read_checkpoint(checkpoint_file):
+    """Read the rows already generated, skipping a line truncated by an interruption."""
+    rows = {}
+    if not os.path.exists(checkpoint_file):
+        return rows
+
+    with open(checkpoint_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            rows[row["index"]] = row
+
+    return rows
 
 def generate_keyword_queries(input_file, output_file, max_entries=1000):
     # Read the Excel file
@@ -82,23 +158,31 @@ def generate_keyword_queries(input_file, output_file, max_entries=1000):
     workbook = load_workbook(output_file) if os.path.exists(output_file) else Workbook()
     sheet = workbook.active
 
-    for index, row in data.iterrows():
-        title = row['title']
-        print(f"{index}: Processing {title}...")
-        summary = row['query']
+    summaries = data['query']
+    valid = summaries.map(lambda summary: isinstance(summary, str) and len(summary) >= 10)
+    texts = summaries[valid].tolist()
+    print(f"Extracting the keywords of {len(texts)} queries...")
 
-        if not summary or not isinstance(summary, str) or len(summary) < 10:
-            continue
+    # Several processes only pay off once each has enough texts to amortize loading the model
+    n_process = min(os.cpu_count() or 1, max(1, len(texts) // 2000))
+    keywords = extract_keywords_batch(texts, n_process=n_process)
+
+    for index, row_keywords in zip(data.index[valid], keywords):
+        sheet.cell(row=index+2, column=3, value=row_keywords)
 
-        if not summary:
-            continue
-        keywords = extract_keywords(summary)
-        sheet.cell(row=index+2, column=3, value=keywords)
-    
     workbook.save(output_file)
     print(f"Generated queries have been saved to {output_file}")
 
-def generate_queries_from_long_essays(input_file, output_file, max_entries=1000):
+def generate_queries_from_long_essays(
+    input_file, output_file, max_entries=1000, client=None, workers=4, rate=1.0, checkpoint_file=None
+):
+    """Generate a query from the plot of each movie.
+
+    The plots are summarized by `workers` threads, at most `rate` calls per second. Each
+    summary is appended to a JSONL checkpoint, and a new run resumes after the movies
+    already in it. The new queries are added to the output workbook once, at the end,
+    below the rows it already has.
+    """
     # Read the Excel file
     data = pd.read_excel(input_file)
 
@@ -109,33 +193,58 @@ def generate_queries_from_long_essays(input_file, output_file, max_entries=1000)
     # Limit the data to the first `max_entries` rows
     data = data.head(max_entries)
 
-    # Process each row to generate queries
+    client = client or GeminiClient()
+    checkpoint_file = checkpoint_file or f"{output_file}.jsonl"
+    bucket = TokenBucket(rate)
+
     workbook = load_workbook(output_file) if os.path.exists(output_file) else Workbook()
     sheet = workbook.active
+    if sheet.max_row == 1 and sheet.cell(row=1, column=1).value is None:
+        sheet.append(['query', 'title'])
     current_row = sheet.max_row
 
-    for index, row in data.iterrows():
-        if index + 2 <= current_row:
-            continue
-
-        title = row['title']
-        print(f"{index}: Processing {title}...")
-        plot_synopsis = row['plot_synopsis']
-        if isinstance(plot_synopsis, str):
-            # Summarize the plot
-            summary = summarize_plot(plot_synopsis)
-            time.sleep(1)
-            if summary:
-                sheet.append([summary, title])
-            else:
-                sheet.append(["", title])
-            workbook.save(output_file)
+    # The movies whose row is already in the workbook are skipped, as are the checkpointed ones
+    done = read_checkpoint(checkpoint_file)
+    todo = [
+        (index, row['title'], row['plot_synopsis'])
+        for index, row in data.iterrows()
+        if index + 2 > current_row
+        and index not in done
+        and isinstance(row['plot_synopsis'], str)
+    ]
+    print(f"{len(done)} queries already generated, {len(todo)} to go.")
+
+    def summarize(plot_synopsis):
+        bucket.acquire()
+        return client.summarize(plot_synopsis)
+
+    # The summaries are written by this thread only, as they complete
+    with open(checkpoint_file, "a", encoding="utf-8") as f, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(summarize, plot): (index, title) for index, title, plot in todo}
+
+        for future in as_completed(futures):
+            index, title = futures[future]
+            row = {"index": int(index), "title": title, "query": future.result() or ""}
+            f.write(json.dumps(row) + "\n")
+            f.flush()
+            done[row["index"]] = row
+            print(f"{len(done)}: Generated a query for {title}")
+
+    # Only the new rows are written, the other columns and rows of the workbook are kept
+    for index in sorted(done):
+        if index + 2 > current_row:
+            sheet.cell(row=index+2, column=1, value=done[index]["query"])
+            sheet.cell(row=index+2, column=2, value=done[index]["title"])
+
+    workbook.save(output_file)
 
     print(f"Generated queries have been saved to {output_file}")
 
-# Example usage
-input_xlsx = "test_data.xlsx"   # Input file with 'title' and 'plot_synopsis' columns
-output_xlsx = "test_data.xlsx"  # Output file to save generated queries
-# generate_queries_from_long_essays(input_xlsx, output_xlsx, max_entries=1000)
-generate_keyword_queries(input_xlsx, output_xlsx, max_entries=1000)
+# Example usage, guarded since the spaCy worker processes import this module
+if __name__ == "__main__":
+    input_xlsx = "test_data.xlsx"   # Input file with 'title' and 'plot_synopsis' columns
+    output_xlsx = "test_data.xlsx"  # Output file to save generated queries
+    # generate_queries_from_long_essays(input_xlsx, output_xlsx, max_entries=1000, workers=4, rate=1.0)
+    generate_keyword_queries(input_xlsx, output_xlsx, max_entries=1000)
 
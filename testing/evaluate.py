@@ -1,8 +1,12 @@
-import requests
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
 import pandas as pd
 from openpyxl import Workbook, load_workbook
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
 
 
@@ -18,19 +22,87 @@ def precision_at_k(results, target, k = 10):
 def truncate(sentence, max_words = 5):
     return " ".join(sentence.split()[:max_words])
 
-def evaluate(queries, titles):
-    q = 0
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+
+def fetch_sequential(queries, url):
+    """Run the searches one after the other, on a single connection."""
+    with httpx.Client(base_url=url, timeout=60) as client:
+        return [
+            client.get("/movies/search", params={"query": query}).json()["results"]
+            for query in queries
+        ]
+
+
+async def fetch_concurrent_async(queries, url, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        async def search(query):
+            async with semaphore:
+                response = await client.get("/movies/search", params={"query": query})
+                response.raise_for_status()
+                return response.json()["results"]
+
+        return await asyncio.gather(*[search(query) for query in queries])
+
+
+def fetch_concurrent(queries, url, concurrency):
+    """Run the searches concurrently, on a pool of `concurrency` connections."""
+    return asyncio.run(fetch_concurrent_async(queries, url, concurrency))
+
+
+def fetch_in_process(queries, batch_size):
+    """Run the searches without the API, with the search backend of the configuration.
+
+    On Elasticsearch, the bodies built by the API are sent in `msearch` batches.
+    """
+    # The backend configuration and data paths are relative to its directory
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+
+    from src.models.movies import MovieSearchRequest
+    from src.services.search_backend import get_search_backend
+    from src.utils.config import config
+
+    search_requests = [MovieSearchRequest(query=query, page=1, size=10) for query in queries]
+
+    if config["SEARCH_BACKEND"] != "elasticsearch":
+        backend = get_search_backend()
+        return [backend.search(request, "movies")["results"] for request in search_requests]
+
+    from src.services.elastic import client_for
+    from src.services.elastic_backend import build_search_body
+
+    results = []
+    for start in range(0, len(search_requests), batch_size):
+        searches = []
+        for request in search_requests[start : start + batch_size]:
+            searches += [{"index": "movies"}, build_search_body(request)]
+
+        for response in client_for("bulk").msearch(body=searches)["responses"]:
+            if "error" in response:
+                raise ValueError(response["error"])
+            results.append([hit["_source"] for hit in response["hits"]["hits"]])
+
+    return results
+
+
+def evaluate(queries, titles, fetch):
+    pairs = [
+        (truncate(query), title)
+        for query, title in zip(queries, titles)
+        if query and isinstance(query, str) and len(query) >= 10
+    ]
+
+    started = time.perf_counter()
+    all_results = fetch([query for query, _ in pairs])
+    print(f"Ran {len(pairs)} searches in {time.perf_counter() - started:.2f}s")
+
     reciporical_ranks = []
     query_lengths = []
-    for query, title in zip(queries, titles):
-        if not query or not isinstance(query, str) or len(query) < 10:
-            continue
-
-        q += 1
-        query = truncate(query)
-        response = requests.get(f"http://127.0.0.1:3001/movies/search?query={query}")
-        results = response.json()["results"]
-        
+    for (query, title), results in zip(pairs, all_results):
         title_results = [item["title"] for item in results]
         rank = (title_results.index(title) + 1) if title in title_results else 0
 
@@ -45,6 +117,9 @@ def evaluate(queries, titles):
     return reciporical_ranks, query_lengths
 
 def plot_frequency(precision, query_length, title):
+    # Imported here, so the benchmark can reuse this module without the plotting libraries
+    import matplotlib.pyplot as plt
+
     # Convert to pandas DataFrame for easier manipulation
     df = pd.DataFrame({'Reciprocal Rank': precision, 'Query Length': query_length})
 
@@ -69,19 +144,36 @@ def plot_frequency(precision, query_length, title):
     # Show the plot
     plt.show()
 
-test_data = pd.read_excel("test_data.xlsx")
-
-queries = test_data["query"].tolist()
-keywords = test_data["keywords"].tolist()
-titles = test_data["title"].tolist()
-
-# ranks_short, short_lengths = evaluate(keywords, titles)
-# mrr_short = sum(ranks_short) / len(ranks_short)
-ranks_long, long_lengths = evaluate(queries, titles)
-mrr_long = sum(ranks_long) / len(ranks_long)
-
-print(f"MRR Keywords: {mrr_long}")
-# print(f"MRR Queries: {mrr_short}")
-
-plot_frequency(ranks_long, long_lengths, 'Reciprocal Rank vs Query Length (Binned) for Complete Queries (Truncated)')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mean reciprocal rank of the search.")
+    parser.add_argument("--mode", choices=["concurrent", "sequential", "in-process"], default="concurrent", help="How the searches are run.")
+    parser.add_argument("--url", default="http://127.0.0.1:3001", help="URL of the API.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent searches, in concurrent mode.")
+    parser.add_argument("--batch-size", type=int, default=100, help="Searches per msearch, in in-process mode.")
+    parser.add_argument("--data", default="test_data.xlsx", help="Test data with queries and titles.")
+    parser.add_argument("--no-plot", action="store_true", help="Only print the MRR.")
+    args = parser.parse_args()
+
+    fetchers = {
+        "concurrent": lambda queries: fetch_concurrent(queries, args.url, args.concurrency),
+        "sequential": lambda queries: fetch_sequential(queries, args.url),
+        "in-process": lambda queries: fetch_in_process(queries, args.batch_size),
+    }
+
+    test_data = pd.read_excel(os.path.abspath(args.data))
+
+    queries = test_data["query"].tolist()
+    keywords = test_data["keywords"].tolist()
+    titles = test_data["title"].tolist()
+
+    # ranks_short, short_lengths = evaluate(keywords, titles, fetchers[args.mode])
+    # mrr_short = sum(ranks_short) / len(ranks_short)
+    ranks_long, long_lengths = evaluate(queries, titles, fetchers[args.mode])
+    mrr_long = sum(ranks_long) / len(ranks_long)
+
+    print(f"MRR Keywords: {mrr_long}")
+    # print(f"MRR Queries: {mrr_short}")
+
+    if not args.no_plot:
+        plot_frequency(ranks_long, long_lengths, 'Reciprocal Rank vs Query Length (Binned) for Complete Queries (Truncated)')
 
@@ -0,0 +1,268 @@
+"""Load test of the movie search API.
+
+Replays a mix of searches, suggestions, movie details and feedback with concurrent
+clients, sampling the queries and titles of `test_data.xlsx`, then reports the
+throughput and the p50/p95/p99 latency of each endpoint.
+
+    python loadtest.py --url http://127.0.0.1:3001 --concurrency 32 --duration 30
+    python loadtest.py --local ../backend/src/data/cleaned.xlsx --workers 4
+
+With `--local`, the API is started with the in-process search backend on the given
+dataset, so no Elasticsearch cluster is needed. The feedback writes to the index, it
+is left out of the default mix.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+
+def truncate(sentence, max_words=5):
+    return " ".join(sentence.split()[:max_words])
+
+
+def parse_mix(mix):
+    """Parse a traffic mix such as `search=70,suggest=20,movie=10,feedback=0`."""
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = float(weight)
+
+    unknown = set(weights) - set(ENDPOINTS)
+    if unknown:
+        raise ValueError(f"Unknown endpoints in the mix: {', '.join(unknown)}")
+
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+class Workload:
+    """Requests sampled from the test data, and the movie ids seen in the results."""
+
+    def __init__(self, path):
+        data = pd.read_excel(path)
+        queries = [truncate(q) for q in data["query"].dropna() if len(q) >= 10]
+        keywords = [k for k in data["keywords"].dropna() if isinstance(k, str)]
+
+        self.queries = queries + keywords
+        self.titles = [str(t) for t in data["title"].dropna()]
+        self.movie_ids = []
+
+    def search(self):
+        params = {"query": random.choice(self.queries)}
+        if random.random() < 0.2:
+            params["page"] = random.randint(2, 5)
+        return "GET", "/movies/search", params
+
+    def suggest(self):
+        title = random.choice(self.titles)
+        return "GET", "/movies/suggest", {"query": title[: random.randint(2, 8)]}
+
+    def movie(self):
+        return "GET", f"/movies/{random.choice(self.movie_ids)}", None
+
+    def feedback(self):
+        movie_id = random.choice(self.movie_ids)
+        return "POST", f"/movies/feedback/{movie_id}", {"score": random.randint(1, 5)}
+
+    def collect_ids(self, response):
+        if len(self.movie_ids) < 10000:
+            results = response.json().get("results", [])
+            self.movie_ids.extend(movie["id"] for movie in results)
+
+
+ENDPOINTS = {
+    "search": Workload.search,
+    "suggest": Workload.suggest,
+    "movie": Workload.movie,
+    "feedback": Workload.feedback,
+}
+
+
+async def warm_up(client, workload, weights, requests=20):
+    """Run a few searches, to build the caches and collect movie ids."""
+    for _ in range(requests):
+        method, path, params = workload.search()
+        response = await client.request(method, path, params=params)
+        if response.status_code == 200:
+            workload.collect_ids(response)
+
+    if not workload.movie_ids and ("movie" in weights or "feedback" in weights):
+        raise RuntimeError("The warm-up searches returned no movies.")
+
+
+async def run_client(client, workload, weights, deadline, latencies, errors):
+    names = list(weights)
+    cumulative = np.cumsum([weights[name] for name in names])
+
+    while time.perf_counter() < deadline:
+        name = names[np.searchsorted(cumulative, random.random() * cumulative[-1])]
+        method, path, params = ENDPOINTS[name](workload)
+
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, params=params)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        latency = time.perf_counter() - started
+
+        if ok:
+            latencies[name].append(latency)
+            if name == "search":
+                workload.collect_ids(response)
+        else:
+            errors[name] += 1
+
+
+async def load_test(url, workload, weights, concurrency, duration):
+    """Run the clients for `duration` seconds.
+
+    Returns:
+        tuple: Latencies (seconds) of the successful requests and number of errors of
+            each endpoint, and the measured duration.
+    """
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        await warm_up(client, workload, weights)
+
+        latencies = {name: [] for name in weights}
+        errors = {name: 0 for name in weights}
+
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(
+            *[
+                run_client(client, workload, weights, deadline, latencies, errors)
+                for _ in range(concurrency)
+            ]
+        )
+
+    return latencies, errors, time.perf_counter() - started
+
+
+def report(latencies, errors, elapsed):
+    print(
+        f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    )
+
+    all_latencies = []
+    for name in latencies:
+        values = np.array(latencies[name])
+        all_latencies.extend(latencies[name])
+        print_row(name, values, errors[name], elapsed)
+
+    print_row("total", np.array(all_latencies), sum(errors.values()), elapsed)
+
+
+def print_row(name, values, errors, elapsed):
+    if len(values):
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    else:
+        p50 = p95 = p99 = float("nan")
+
+    print(
+        f"{name:<10} {len(values):>9} {errors:>7} {len(values) / elapsed:>9.1f} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}"
+    )
+
+
+def start_local_server(dataset, port, workers):
+    """Start the API with the in-process search backend, and wait until it answers."""
+    env = dict(
+        os.environ,
+        SEARCH_BACKEND="local",
+        LOCAL_INDEX_PATH=os.path.abspath(dataset),
+        PORT=str(port),
+        WORKERS=str(workers),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-c", "from src.server import Server; Server().run()"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+    # Each worker builds its index on startup, before it accepts requests
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(600):
+        try:
+            response = httpx.get(f"{url}/movies/genres", timeout=60)
+            if response.status_code == 200:
+                return server, url
+        except httpx.HTTPError:
+            pass
+        if server.poll() is not None:
+            raise RuntimeError("The local server stopped.")
+        time.sleep(0.5)
+
+    server.terminate()
+    raise RuntimeError("The local server did not start.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--url", default="http://127.0.0.1:3001", help="URL of the API."
+    )
+    parser.add_argument(
+        "--local",
+        metavar="DATASET",
+        help="Start the API with the local backend on this dataset.",
+    )
+    parser.add_argument("--port", type=int, default=3011, help="Port of the local API.")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Worker processes of the local API."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="Concurrent clients."
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Duration of the test, in seconds."
+    )
+    parser.add_argument(
+        "--mix",
+        default="search=70,suggest=20,movie=10,feedback=0",
+        help="Weight of each endpoint.",
+    )
+    parser.add_argument(
+        "--data", default="test_data.xlsx", help="Test data with queries and titles."
+    )
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the sampling.")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    weights = parse_mix(args.mix)
+    workload = Workload(args.data)
+
+    server = None
+    url = args.url
+    if args.local:
+        server, url = start_local_server(args.local, args.port, args.workers)
+
+    try:
+        print(
+            f"Load testing {url} with {args.concurrency} clients for {args.duration:.0f}s..."
+        )
+        latencies, errors, elapsed = asyncio.run(
+            load_test(url, workload, weights, args.concurrency, args.duration)
+        )
+        report(latencies, errors, elapsed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Replay of the captured search traffic against the movie search API.
+
+Re-issues the searches of the query log (see `QUERY_LOG_ENABLED` in the backend) with
+their original timing, or sped up or slowed down, then compares the latency with the
+one recorded in production.
+
+    python replay.py ../backend/src/data/query_log --url http://127.0.0.1:3001
+    python replay.py queries.jsonl.1234 --speed 4
+    python replay.py ../backend/src/data/query_log --speed 0 --max-in-flight 64
+    python replay.py ../backend/src/data/query_log --local ../backend/src/data/cleaned.xlsx
+
+The requests are sent open-loop, at their scheduled time whatever the latency of the
+previous ones, up to `--max-in-flight` concurrent requests: past it the requests are
+delayed, and the delay is reported as the schedule lag. With `--speed 0` the log is
+replayed as fast as the in-flight limit allows.
+"""
+
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import os
+import time
+
+import httpx
+import numpy as np
+
+from loadtest import start_local_server
+
+
+def read_log(paths):
+    """Read the searches of the log files, or of every file of the directories.
+
+    Returns:
+        list: Records of the searches, in time order.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, "*")))
+        else:
+            files.append(path)
+
+    records = []
+    for file in files:
+        opener = gzip.open if file.endswith(".gz") else open
+        with opener(file, "rt", encoding="utf8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+
+async def replay(records, url, speed, max_in_flight):
+    """Send the searches at their scheduled time.
+
+    Returns:
+        tuple: Latency (seconds), status code (0 on a connection error) and schedule
+            lag (seconds) of each search, and the duration of the replay.
+    """
+    limits = httpx.Limits(
+        max_connections=max_in_flight, max_keepalive_connections=max_in_flight
+    )
+    semaphore = asyncio.Semaphore(max_in_flight)
+    first = records[0]["ts"]
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+
+        async def search(record, scheduled):
+            async with semaphore:
+                lag = time.perf_counter() - scheduled
+                sent = time.perf_counter()
+                try:
+                    response = await client.post(
+                        "/movies/search", json=record["request"]
+                    )
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 0
+                return time.perf_counter() - sent, status, lag
+
+        started = time.perf_counter()
+        tasks = []
+        for record in records:
+            scheduled = started + ((record["ts"] - first) / speed if speed else 0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(search(record, scheduled)))
+
+        results = await asyncio.gather(*tasks)
+
+    return results, time.perf_counter() - started
+
+
+def percentiles(values):
+    if not len(values):
+        return [float("nan")] * 3
+    return np.percentile(values, [50, 95, 99])
+
+
+def report(records, results, elapsed, speed):
+    latencies = np.array([latency for latency, _, _ in results]) * 1000
+    statuses = np.array([status for _, status, _ in results])
+    lags = np.array([lag for _, _, lag in results]) * 1000
+    recorded = np.array([record["elapsed_ms"] for record in records])
+
+    span = records[-1]["ts"] - records[0]["ts"]
+    ok = (statuses > 0) & (statuses < 400)
+
+    print(
+        f"{len(records)} searches over {span:.1f}s of log, replayed in {elapsed:.1f}s"
+    )
+    if span and speed:
+        print(
+            f"Rate: {len(records) / span * speed:.1f} req/s scheduled, "
+            f"{len(records) / elapsed:.1f} req/s achieved"
+        )
+    print(
+        f"Errors: {(~ok).sum()} "
+        f"({(statuses == 429).sum()} rejected, {(statuses == 0).sum()} failed)"
+    )
+
+    print(f"\n{'latency ms':<24} {'p50':>9} {'p95':>9} {'p99':>9}")
+    rows = [
+        ("recorded (backend)", recorded),
+        ("replayed (client)", latencies[ok]),
+        ("schedule lag", lags),
+    ]
+    for name, values in rows:
+        p50, p95, p99 = percentiles(values)
+        print(f"{name:<24} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("logs", nargs="+", help="Query log files or directories.")
+    parser.add_argument(
+        "--url", default="http://127.0.0.1:3001", help="URL of the API."
+    )
+    parser.add_argument(
+        "--local",
+        metavar="DATASET",
+        help="Start the API with the local backend on this dataset.",
+    )
+    parser.add_argument("--port", type=int, default=3011, help="Port of the local API.")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Worker processes of the local API."
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1,
+        help="Replay rate relative to the log, 0 for as fast as possible.",
+    )
+    parser.add_argument(
+        "--max-in-flight", type=int, default=256, help="Concurrent requests."
+    )
+    parser.add_argument(
+        "--limit", type=int, default=None, help="Replay only the first searches."
+    )
+    parser.add_argument(
+        "--skip-errors",
+        action="store_true",
+        help="Leave out the searches which failed when recorded.",
+    )
+    args = parser.parse_args()
+
+    records = read_log(args.logs)
+    if args.skip_errors:
+        records = [record for record in records if not record.get("error")]
+    records = records[: args.limit]
+    if not records:
+        raise SystemExit("No searches in the query log.")
+
+    server = None
+    url = args.url
+    if args.local:
+        server, url = start_local_server(args.local, args.port, args.workers)
+
+    try:
+        print(f"Replaying {len(records)} searches against {url}...")
+        results, elapsed = asyncio.run(
+            replay(records, url, args.speed, args.max_in_flight)
+        )
+        report(records, results, elapsed, args.speed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
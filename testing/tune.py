@@ -0,0 +1,340 @@
+"""Offline tuning of the ranking weights of the Elasticsearch search.
+
+The score of each clause of `build_query` is fetched once for the top candidates of
+every test query, with named queries, and cached. The weights in `BOOSTS` (clause
+boosts, phrase slop and feedback factor) are then searched locally: the cached scores
+are recombined for thousands of configurations at once with NumPy, and each
+configuration is scored with the MRR and P@k of the test queries.
+
+    python tune.py                          # grid search
+    python tune.py --search random --samples 20000
+    python tune.py --refresh                # fetch the candidates again
+
+The candidates are the top `--candidates` documents by the unweighted sum of the
+clauses: a target missing from them is a miss for every configuration, so the recall
+of the candidates bounds the MRR. The scores follow the single-phase search; the
+two-phase search ranks the same way as long as the targets lie in the rescore window.
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmark import build_queries
+from evaluate import BACKEND_DIR, is_relevant
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tune_cache.npz")
+
+# Phrase slops whose scores are fetched, the slop is tuned among them
+SLOPS = [0, 1, 2, 3, 4]
+
+# Cached score columns: the match clauses, then the phrase clauses of each slop
+COLUMNS = ["title", "synopsis"] + [
+    f"{name}_{slop}" for slop in SLOPS for name in ["title_phrase", "synopsis_phrase"]
+]
+
+# Tuned weights, in the order of the configuration arrays
+WEIGHTS = ["title", "title_phrase", "synopsis", "synopsis_phrase", "slop", "feedback"]
+
+GRID = {
+    "title": [1, 2, 3, 5, 8, 13],
+    "title_phrase": [0, 2, 5, 10, 20],
+    "synopsis": [0.5, 1, 2],
+    "synopsis_phrase": [0, 1, 2, 4],
+    "slop": SLOPS,
+    "feedback": [0, 0.1, 0.2, 0.4],
+}
+
+# Ranges of the random search
+RANGES = {
+    "title": (0, 20),
+    "title_phrase": (0, 30),
+    "synopsis": (0, 5),
+    "synopsis_phrase": (0, 10),
+    "feedback": (0, 1),
+}
+
+
+def candidate_query(query):
+    """Build the candidate query, with a named clause per cached column."""
+    from src.models.movies import MovieSearchRequest
+    from src.services.elastic_backend import build_phrase_clauses, build_query
+
+    search_query = MovieSearchRequest(query=query)
+    names = {"title": "title", "plot_synopsis": "synopsis"}
+
+    clauses = build_query(search_query, phrases=False)["bool"]["should"]
+    for clause in clauses:
+        field, params = next(iter(clause["match"].items()))
+        params.update(boost=1, _name=names[field])
+
+    for slop in SLOPS:
+        for clause in build_phrase_clauses(search_query):
+            field, params = next(iter(clause["match_phrase"].items()))
+            params.update(boost=1, slop=slop, _name=f"{names[field]}_phrase_{slop}")
+            clauses.append(clause)
+
+    return {"bool": {"should": clauses, "minimum_should_match": 1}}
+
+
+def fetch_candidates(pairs, size, batch_size):
+    """Fetch the clause scores of the top `size` candidates of each query.
+
+    Returns:
+        dict: Arrays of the cache, the candidates padded to `size`.
+    """
+    # The backend configuration is relative to its directory
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+
+    from src.services.elastic import client_for
+
+    n_queries = len(pairs)
+    features = np.zeros((n_queries, size, len(COLUMNS)), dtype=np.float32)
+    feedback = np.zeros((n_queries, size), dtype=np.float32)
+    exact = np.zeros((n_queries, size), dtype=bool)
+    relevant = np.zeros((n_queries, size), dtype=bool)
+    valid = np.zeros((n_queries, size), dtype=bool)
+
+    for start in range(0, n_queries, batch_size):
+        searches = []
+        for query, _ in pairs[start : start + batch_size]:
+            body = {
+                "query": candidate_query(query),
+                "size": size,
+                "_source": ["title", "feedback_score"],
+            }
+            searches += [{"index": "movies"}, body]
+
+        responses = client_for("bulk").msearch(
+            body=searches, include_named_queries_score=True
+        )["responses"]
+
+        for i, response in enumerate(responses, start):
+            if "error" in response:
+                raise ValueError(response["error"])
+
+            target = pairs[i][1]
+            for j, hit in enumerate(response["hits"]["hits"]):
+                scores = hit.get("matched_queries", {})
+                features[i, j] = [scores.get(column, 0) for column in COLUMNS]
+                feedback[i, j] = hit["_source"].get("feedback_score") or 0
+                exact[i, j] = hit["_source"]["title"] == target
+                relevant[i, j] = is_relevant(str(hit["_source"]["title"]), target)
+                valid[i, j] = True
+
+        print(f"Fetched {min(start + batch_size, n_queries)}/{n_queries} queries")
+
+    return {
+        "features": features,
+        "feedback": feedback,
+        "exact": exact,
+        "relevant": relevant,
+        "valid": valid,
+    }
+
+
+def load_candidates(pairs, path, size, batch_size, refresh):
+    """Load the cached candidates, fetching them if missing or stale."""
+    queries = np.array([query for query, _ in pairs])
+
+    if not refresh and os.path.exists(path):
+        cache = dict(np.load(path))
+        columns = cache.pop("columns")
+        if (
+            np.array_equal(cache.pop("queries"), queries)
+            and list(columns) == COLUMNS
+            and cache["valid"].shape[1] == size
+        ):
+            return cache
+        print("The cached candidates do not match the queries, fetching them again.")
+
+    cache = fetch_candidates(pairs, size, batch_size)
+    np.savez_compressed(path, columns=np.array(COLUMNS), queries=queries, **cache)
+
+    return cache
+
+
+def score_configs(cache, configs, k, precision=True, chunk=64):
+    """Score the configurations on the cached candidates.
+
+    Args:
+        cache (dict): Cached candidates.
+        configs (np.ndarray): Configurations, one row of `WEIGHTS` each.
+        k (int): Results scored per query.
+        precision (bool): Whether to compute the P@k, slower than the MRR.
+        chunk (int): Configurations scored at once, bounding the memory.
+
+    Returns:
+        tuple: MRR and mean P@k (None unless computed) of each configuration.
+    """
+    n_queries = len(cache["valid"])
+
+    # Queries without their target among the candidates only count in the P@k
+    if not precision:
+        cache = {key: value[cache["exact"].any(axis=1)] for key, value in cache.items()}
+
+    valid = cache["valid"]
+    exact = cache["exact"][..., None]
+    relevant = cache["relevant"][..., None]
+
+    # Same feedback factor as the script of the search, before its weight
+    feedback = cache["feedback"]
+    feedback_log = np.sign(feedback) * np.log(np.abs(feedback) + 1)
+
+    mrr = np.zeros(len(configs))
+    precisions = np.zeros(len(configs)) if precision else None
+
+    for slop in np.unique(configs[:, 4]):
+        columns = [
+            COLUMNS.index(name)
+            for name in [
+                "title",
+                f"title_phrase_{int(slop)}",
+                "synopsis",
+                f"synopsis_phrase_{int(slop)}",
+            ]
+        ]
+        clause_scores = cache["features"][..., columns]
+        slop_rows = np.flatnonzero(configs[:, 4] == slop)
+
+        for start in range(0, len(slop_rows), chunk):
+            rows = slop_rows[start : start + chunk]
+            weights = configs[rows].astype(np.float32)
+
+            # Scores of the candidates, of shape (queries, candidates, configurations).
+            # The padding scores 0, below any matching candidate.
+            scores = clause_scores @ weights[:, :4].T
+            # Capped at 2 by max_boost, floored at 0 as a score cannot be negative
+            scores *= np.clip(1 + feedback_log[..., None] * weights[:, 5], 0, 2)
+
+            # Rank of the best-scored exact title
+            best = np.where(exact, scores, -np.inf).max(axis=1)
+            rank = (scores > best[:, None, :]).sum(axis=1) + 1
+            found = np.isfinite(best) & (rank <= k)
+            mrr[rows] = np.where(found, 1 / rank, 0).sum(axis=0) / n_queries
+
+            if precision:
+                # Relevant titles among the top k
+                scores[~valid] = -np.inf
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k, :]
+                hits = np.take_along_axis(relevant & valid[..., None], top, axis=1)
+                precisions[rows] = hits.sum(axis=1).mean(axis=0) / k
+
+    return mrr, precisions
+
+
+def grid_configs():
+    return np.array(list(itertools.product(*[GRID[name] for name in WEIGHTS])))
+
+
+def random_configs(samples, rng):
+    configs = np.zeros((samples, len(WEIGHTS)))
+    for i, name in enumerate(WEIGHTS):
+        if name == "slop":
+            configs[:, i] = rng.choice(SLOPS, samples)
+        else:
+            configs[:, i] = rng.uniform(*RANGES[name], samples)
+
+    return configs
+
+
+def report(title, cache, configs, k):
+    """Print the MRR and P@k of the configurations."""
+    mrr, precision = score_configs(cache, configs, k)
+
+    print(f"\n{title}:")
+    print(f"{'mrr':>7} {f'P@{k}':>7}  " + " ".join(f"{name:>15}" for name in WEIGHTS))
+    for config, config_mrr, config_precision in zip(configs, mrr, precision):
+        values = " ".join(f"{value:>15.3g}" for value in config)
+        print(f"{config_mrr:>7.4f} {config_precision:>7.4f}  {values}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--data", default="test_data.xlsx", help="Test data with queries and titles."
+    )
+    parser.add_argument(
+        "--max-words",
+        type=int,
+        nargs="+",
+        default=[3, 5, 8],
+        help="Truncation lengths of the plot queries.",
+    )
+    parser.add_argument("--k", type=int, default=10, help="Results scored per query.")
+    parser.add_argument(
+        "--candidates", type=int, default=100, help="Candidates cached per query."
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=50, help="Searches per msearch."
+    )
+    parser.add_argument("--cache", default=CACHE_PATH, help="Candidate cache file.")
+    parser.add_argument(
+        "--refresh", action="store_true", help="Fetch the candidates again."
+    )
+    parser.add_argument("--search", choices=["grid", "random"], default="grid")
+    parser.add_argument(
+        "--samples", type=int, default=10000, help="Configurations of a random search."
+    )
+    parser.add_argument(
+        "--holdout",
+        type=float,
+        default=0.2,
+        help="Share of the queries held out to check the best configurations.",
+    )
+    parser.add_argument("--top", type=int, default=10, help="Configurations printed.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the sampling.")
+    args = parser.parse_args()
+
+    pairs = build_queries(pd.read_excel(os.path.abspath(args.data)), args.max_words)
+    cache = load_candidates(
+        pairs,
+        os.path.abspath(args.cache),
+        args.candidates,
+        args.batch_size,
+        args.refresh,
+    )
+
+    recall = cache["exact"].any(axis=1).mean()
+    print(f"{len(pairs)} queries, target in the candidates of {recall:.1%} of them")
+
+    # Split the queries, the configurations are ranked on the training queries
+    rng = np.random.default_rng(args.seed)
+    held_out = rng.random(len(pairs)) < args.holdout
+    train = {key: value[~held_out] for key, value in cache.items()}
+    test = {key: value[held_out] for key, value in cache.items()}
+
+    sys.path.insert(0, BACKEND_DIR)
+    from src.services.search_backend import BOOSTS
+
+    current = np.array([[BOOSTS[name] for name in WEIGHTS]], dtype=float)
+    configs = (
+        grid_configs() if args.search == "grid" else random_configs(args.samples, rng)
+    )
+
+    started = time.perf_counter()
+    mrr, _ = score_configs(train, configs, args.k, precision=False)
+    elapsed = time.perf_counter() - started
+    print(
+        f"Scored {len(configs)} configurations in {elapsed:.2f}s "
+        f"({len(configs) / elapsed:.0f}/s)"
+    )
+
+    best = configs[np.argsort(-mrr, kind="stable")[: args.top]]
+
+    report("Current weights, training queries", train, current, args.k)
+    report("Best configurations, training queries", train, best, args.k)
+
+    if held_out.any():
+        report("Current weights, held-out queries", test, current, args.k)
+        report("Best configurations, held-out queries", test, best, args.k)
+
+
+if __name__ == "__main__":
+    main()